@@ -3,104 +3,202 @@ Author: Luigi Saetta
 Date created: 2024-04-27
 Date last modified: 2024-05-23
 Python Version: 3.11
+
+Usage:
+    python analyze_chunks.py 800 1500 [--overlaps 50 100] [--workers 4]
+
+    For every chunk size and overlap, reports the num. of tokens per chunk
+    (Cohere tokenizer): stats, histogram, chunks longer than 512 tokens
+    and the projected num. of calls to the embeddings model.
+    Books are parsed once (pdf_text_cache), chunks are tokenized in batches
+    by worker processes, the tokenizer is downloaded only the first time.
 """
 
-import sys
-import logging
 import argparse
-import numpy as np
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-from tqdm.auto import tqdm
+import numpy as np
+import requests
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-
 from tokenizers import Tokenizer
-import requests
 
+from pdf_text_cache import load_pdf_dir_pages
 from utils import get_console_logger, load_configuration
 
-#
-# Main
-#
 config = load_configuration()
 
-logger = get_console_logger()
+# here define the tokenizer to use (linked to the embedding model)
+MODEL_NAME = "embed-multilingual-v3"
+
+TOKENIZER_URL = (
+    f"https://storage.googleapis.com/cohere-assets/tokenizers/{MODEL_NAME}.json"
+)
 
-parser = argparse.ArgumentParser(description="Analyze chunking.")
-parser.add_argument("max_chunk_size", type=int, help="Max. dim. of a chunk in chars")
+# max num. of tokens for Cohere embeddings input
+THRESHOLD = 512
 
-args = parser.parse_args()
+# num. of chunks tokenized together by a worker
+TOKENIZE_BATCH_SIZE = 256
 
-if args.max_chunk_size is not None:
-    logging.info("Running with : %s max_chunk_size...", args.max_chunk_size)
-    max_chunk_size = args.max_chunk_size
-else:
-    logging.error("No params provided !!!")
-    sys.exit(-1)
+# limits (tokens) of the bins of the histogram, the last is open
+HISTOGRAM_BINS = [0, 128, 256, 384, 512, 768, 1024]
 
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=max_chunk_size,
-    chunk_overlap=config["text_splitting"]["chunk_overlap"],
-    length_function=len,
-    is_separator_regex=False,
-)
+def get_tokenizer_path():
+    """
+    the local copy of the tokenizer, downloaded if not there
+    """
+    tokenizer_dir = config["text_splitting"]["tokenizer_dir"]
+    tokenizer_path = os.path.join(tokenizer_dir, f"{MODEL_NAME}.json")
 
-loader = PyPDFDirectoryLoader(path=config["text_splitting"]["books_dir"], glob="*.pdf")
+    if not os.path.exists(tokenizer_path):
+        os.makedirs(tokenizer_dir, exist_ok=True)
 
-logger.info("")
-logger.info("Loading and splitting in chunks...")
+        response = requests.get(TOKENIZER_URL, timeout=60)
+        response.raise_for_status()
 
-docs = loader.load_and_split(text_splitter=text_splitter)
+        with open(tokenizer_path, "w", encoding="utf-8") as f:
+            f.write(response.text)
 
-logger.info("max_chunk_size: %s chars...", max_chunk_size)
-logger.info("Loaded %s chunks...", len(docs))
-logger.info("")
-logger.info("Analyzing chunks...")
-logger.info("")
+    return tokenizer_path
 
-# load the Cohere tokenizer
-# here define the tokenizer to use (linked to the embedding model)
-MODEL_NAME = "embed-multilingual-v3"
 
-tokenizer_url = (
-    f"https://storage.googleapis.com/cohere-assets/tokenizers/{MODEL_NAME}.json"
-)
+# the tokenizer of a worker process
+_tokenizer = None
 
-response = requests.get(tokenizer_url, timeout=60)
-tokenizer = Tokenizer.from_str(response.text)
 
-# max num. of tokens for Cohere embeddings input
-THRESHOLD = 512
+def init_worker(tokenizer_path):
+    """
+    load the tokenizer, once per worker
+    """
+    global _tokenizer
 
-tokens_list = []
+    _tokenizer = Tokenizer.from_file(tokenizer_path)
 
-# here we compute the num. of tokens per chunk using Cohere tokenizer
-for doc in tqdm(docs):
-    n_tokens = len(
-        tokenizer.encode(sequence=doc.page_content, add_special_tokens=False)
+
+def count_tokens(texts):
+    """
+    num. of tokens of every text (runs in a worker)
+    """
+    encodings = _tokenizer.encode_batch(texts, add_special_tokens=False)
+
+    return [len(encoding.ids) for encoding in encodings]
+
+
+def tokenize_all(chunks_by_config, tokenizer_path, n_workers):
+    """
+    num. of tokens of the chunks of every configuration
+    all the batches, of all configurations, are done in the same pool
+    """
+    with ProcessPoolExecutor(
+        max_workers=n_workers, initializer=init_worker, initargs=(tokenizer_path,)
+    ) as executor:
+        futures = {
+            key: [
+                executor.submit(count_tokens, texts[i : i + TOKENIZE_BATCH_SIZE])
+                for i in range(0, len(texts), TOKENIZE_BATCH_SIZE)
+            ]
+            for key, texts in chunks_by_config.items()
+        }
+
+        return {
+            key: np.array([n for f in key_futures for n in f.result()])
+            for key, key_futures in futures.items()
+        }
+
+
+def print_report(chunk_size, chunk_overlap, np_toks):
+    """
+    the report for a configuration
+    """
+    logger = get_console_logger()
+
+    mask = np_toks > THRESHOLD
+    embed_batch_size = config["embeddings"]["oci"]["embed_batch_size"]
+
+    logger.info("")
+    logger.info("chunk_size: %s, chunk_overlap: %s chars", chunk_size, chunk_overlap)
+    logger.info("Num. of chunks: %s", len(np_toks))
+    logger.info("Avg. # of tokens per chunk: %s", round(np.mean(np_toks)))
+    logger.info(
+        "Max: %s, Min: %s, 75-perc.: %s tokens",
+        np.max(np_toks),
+        np.min(np_toks),
+        round(np.percentile(np_toks, 75)),
+    )
+    logger.info(
+        "Num. of chunks longer than %s tokens: %s (%s perc.)",
+        THRESHOLD,
+        np.sum(mask),
+        round(np.sum(mask) * 100.0 / len(np_toks), 1),
+    )
+    logger.info(
+        "Projected calls to the embeddings model: %s",
+        math.ceil(len(np_toks) / embed_batch_size),
+    )
+
+    bins = HISTOGRAM_BINS + [max(np.max(np_toks), HISTOGRAM_BINS[-1]) + 1]
+    labels = HISTOGRAM_BINS[1:] + [""]
+
+    counts, _ = np.histogram(np_toks, bins=bins)
+    for low, high, count in zip(HISTOGRAM_BINS, labels, counts):
+        logger.info(
+            "  %5s - %5s tokens: %6s %s",
+            low,
+            high,
+            count,
+            "#" * int(count * 50 / len(np_toks)),
+        )
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Analyze chunking.")
+    parser.add_argument(
+        "chunk_sizes", type=int, nargs="+", help="Max. dim. of a chunk in chars"
+    )
+    parser.add_argument(
+        "--overlaps",
+        type=int,
+        nargs="+",
+        default=[config["text_splitting"]["chunk_overlap"]],
+        help="Overlaps between chunks in chars",
     )
-    tokens_list.append(n_tokens)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
 
-logger.info("Results:")
+    args = parser.parse_args()
 
-np_toks = np.array(tokens_list)
+    logger.info("")
+    logger.info("Loading and splitting in chunks...")
 
-# to compute how many are longer than threshold
-mask = np_toks > THRESHOLD
+    # the text of the pages is parsed only the first time
+    pages = load_pdf_dir_pages(config["text_splitting"]["books_dir"])
 
-logger.info("")
-logger.info("Avg. # of tokens per chunk: %s", round(np.mean(np_toks)))
+    chunks = {}
+    for size in args.chunk_sizes:
+        for overlap in args.overlaps:
+            text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=size,
+                chunk_overlap=overlap,
+                length_function=len,
+                is_separator_regex=False,
+            )
+            chunks[(size, overlap)] = [
+                doc.page_content for doc in text_splitter.split_documents(pages)
+            ]
 
-max_toks = np.max(np_toks)
-min_toks = np.min(np_toks)
-perc75 = round(np.percentile(np_toks, 75))
-logger.info("Max: %s, Min: %s, 75-perc.: %s tokens", max_toks, min_toks, perc75)
+    logger.info("Analyzing chunks...")
 
-sum_longer = np.sum(mask)
-perc = round(np.sum(mask) * 100.0 / len(tokens_list), 1)
-logger.info(
-    "Num. of chunks longer than %s tokens: %s (%s perc.)", THRESHOLD, sum_longer, perc
-)
-logger.info("")
+    tokens = tokenize_all(chunks, get_tokenizer_path(), args.workers)
+
+    for (size, overlap), config_tokens in tokens.items():
+        print_report(size, overlap, config_tokens)
+
+    logger.info("")
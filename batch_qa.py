@@ -0,0 +1,319 @@
+"""
+Batch question-answering runner
+
+Usage:
+    python batch_qa.py questions.jsonl answers.jsonl [--mode chain|citations]
+        [--model_id cohere.command-r-16k] [--workers 4]
+
+    Every line in the input file is a JSON object with a question, for ex:
+        {"id": "q001", "question": "Can metformin be used in elderly patients?"}
+
+    For every question a line is appended to the output file with:
+    answer, contexts, citations (citations mode) and per-stage timings.
+    Questions already answered in the output file are skipped,
+    so an interrupted run can be restarted with the same command
+    (error records are removed and those questions are run again).
+
+    chain: uses the RAG chain of the chat UI (build_rag_chain)
+    citations: uses command-r with documents (as in factory_for_citations_demo)
+
+Python Version: 3.11
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import time
+
+from usage_accounting import usage_scope
+from utils import get_console_logger, remove_path_from_ref
+
+QUESTION_KEYS = ["question", "input"]
+ID_KEYS = ["id", "request_id"]
+
+
+def read_questions(file_name):
+    """
+    read the questions from a JSONL file
+    returns a list of (id, question)
+    """
+    questions = []
+
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            record = json.loads(line)
+
+            question = next((record[k] for k in QUESTION_KEYS if k in record), None)
+            if question is None:
+                raise ValueError(f"No question found at line {line_num} of {file_name}")
+
+            q_id = next((record[k] for k in ID_KEYS if k in record), line_num)
+            questions.append((str(q_id), question))
+
+    return questions
+
+
+def read_answered_ids(file_name):
+    """
+    read the ids already answered (without errors) in the output file
+    """
+    answered = set()
+
+    if not os.path.exists(file_name):
+        return answered
+
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a truncated last line, if the run was killed while writing
+                continue
+
+            if "error" not in record:
+                answered.add(record["id"])
+
+    return answered
+
+
+def drop_error_records(file_name):
+    """
+    rewrite the output file without the errors (and a truncated last line):
+    those questions are run again, their old records must not stay
+    returns the num. of records dropped
+    """
+    if not os.path.exists(file_name):
+        return 0
+
+    kept = []
+    n_dropped = 0
+
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                n_dropped += 1
+                continue
+
+            if "error" in record:
+                n_dropped += 1
+            else:
+                kept.append(line)
+
+    if n_dropped:
+        tmp_name = file_name + ".tmp"
+        with open(tmp_name, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp_name, file_name)
+
+    return n_dropped
+
+
+def format_contexts(docs):
+    """
+    transform LangChain docs in a JSON serializable list
+    """
+    return [
+        {
+            "source": remove_path_from_ref(doc.metadata["source"]),
+            "page": doc.metadata["page"],
+            "text": doc.page_content,
+        }
+        for doc in docs
+    ]
+
+
+class ChainRunner:
+    """
+    answer using the RAG chain, the chain is shared between workers
+    """
+
+    def __init__(self, model_id):
+        from factory import build_rag_chain
+
+        self.rag_chain = build_rag_chain(verbose=False, model_id=model_id)
+
+    def __call__(self, question):
+        time_start = time()
+        timings = {}
+
+        answer = ""
+        contexts = []
+
+        for chunk in self.rag_chain.stream({"input": question, "chat_history": []}):
+            if "context" in chunk:
+                contexts = format_contexts(chunk["context"])
+                timings["retrieval"] = time() - time_start
+
+            if "answer" in chunk:
+                if "first_token" not in timings:
+                    timings["first_token"] = time() - time_start
+                answer += chunk["answer"]
+
+        timings["total"] = time() - time_start
+
+        return {"answer": answer, "contexts": contexts, "timings": timings}
+
+
+class CitationsRunner:
+    """
+    answer using command-r with documents, returns also citations
+    retriever and chat client are shared between workers,
+    every search takes its own connection from the pool
+    """
+
+    def __init__(self):
+        from factory_for_citations_demo import (
+            get_embed_model,
+            get_oracle_vs,
+            get_retriever,
+            get_chat_model,
+        )
+        from factory_vector_store import get_oracle_pool
+
+        self.retriever = get_retriever(
+            get_oracle_vs(get_embed_model(), pool=get_oracle_pool())
+        )
+        self.chat = get_chat_model()
+
+    def __call__(self, question):
+        from factory_for_citations_demo import (
+            get_documents_for_query,
+            invoke_chat_model,
+        )
+        from oci_citations_utils import extract_complete_citations
+
+        time_start = time()
+        timings = {}
+
+        documents = get_documents_for_query(question, retriever=self.retriever)
+        timings["retrieval"] = time() - time_start
+
+        response = invoke_chat_model(question, documents, chat=self.chat)
+        timings["total"] = time() - time_start
+
+        if response is None:
+            raise RuntimeError("No response from the chat model")
+
+        return {
+            "answer": response.data.chat_response.text,
+            "contexts": [
+                {"id": doc["id"], "source": doc["source"], "page": doc["page"]}
+                for doc in documents
+            ],
+            "citations": extract_complete_citations(response),
+            "timings": timings,
+        }
+
+
+def run_one(runner, q_id, question):
+    """
+    process a single question, errors are returned in the record
+    """
+    record = {"id": q_id, "question": question}
+
+    try:
+        # tokens, embeddings and rerank calls are counted for the question
+        with usage_scope("batch_qa", q_id):
+            record.update(runner(question))
+    except Exception as e:
+        record["error"] = str(e)
+
+    return record
+
+
+def run_batch(runner, questions, output_file, n_workers):
+    """
+    run the questions with at most n_workers requests in flight
+    and append every result to output_file as soon as it is ready
+    """
+    logger = get_console_logger()
+
+    n_done = 0
+    n_errors = 0
+
+    with open(output_file, "a", encoding="utf-8") as out_f, ThreadPoolExecutor(
+        max_workers=n_workers
+    ) as executor:
+        in_flight = set()
+
+        for q_id, question in questions:
+            in_flight.add(executor.submit(run_one, runner, q_id, question))
+
+            if len(in_flight) < n_workers:
+                continue
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                n_errors += write_record(out_f, future.result())
+                n_done += 1
+
+        for future in in_flight:
+            n_errors += write_record(out_f, future.result())
+            n_done += 1
+
+    logger.info("Processed %s questions, %s errors.", n_done, n_errors)
+
+
+def write_record(out_f, record):
+    """
+    append a record to the output and flush, so that it survives interruptions
+    returns 1 if the record is an error
+    """
+    out_f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out_f.flush()
+
+    return 1 if "error" in record else 0
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Batch question answering.")
+    parser.add_argument("input_file", type=str, help="JSONL file with questions")
+    parser.add_argument("output_file", type=str, help="JSONL file for the answers")
+    parser.add_argument(
+        "--mode", type=str, choices=["chain", "citations"], default="chain"
+    )
+    parser.add_argument("--model_id", type=str, default="cohere.command-r-16k")
+    parser.add_argument("--workers", type=int, default=4, help="Requests in flight")
+
+    args = parser.parse_args()
+
+    all_questions = read_questions(args.input_file)
+
+    n_old_errors = drop_error_records(args.output_file)
+    if n_old_errors:
+        logger.info("Removed %s error records, to be run again", n_old_errors)
+
+    answered_ids = read_answered_ids(args.output_file)
+
+    todo = [(q_id, q) for q_id, q in all_questions if q_id not in answered_ids]
+
+    logger.info(
+        "Questions: %s, already answered: %s, to do: %s",
+        len(all_questions),
+        len(all_questions) - len(todo),
+        len(todo),
+    )
+
+    if todo:
+        if args.mode == "chain":
+            qa_runner = ChainRunner(args.model_id)
+        else:
+            qa_runner = CitationsRunner()
+
+        time_start = time()
+
+        run_batch(qa_runner, todo, args.output_file, args.workers)
+
+        logger.info("Elapsed time: %s sec.", round(time() - time_start, 1))
@@ -0,0 +1,95 @@
+"""
+Import-time benchmark of the entry points
+
+Usage:
+    python bench_import_time.py [--runs 3]
+
+    For every entry point the modules it imports at start are loaded
+    in a new interpreter with -X importtime; the cumulative time is
+    compared with the budget in [startup.budget_ms] (config.toml).
+    Exit code is 1 if some entry point is over budget, so it can be
+    used as a check after changes to the imports.
+
+    The streamlit apps are imported as they are: outside of streamlit
+    run the UI calls do nothing, while the work done at start (imports,
+    creation of the RAG chain and of the LLM) is measured, as at cold start.
+    They need the same config and credentials used to run the app.
+
+Python Version: 3.11
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+from utils import get_console_logger, load_configuration
+
+config = load_configuration()
+
+# entry point -> modules imported at start
+ENTRY_POINTS = {
+    "app": ["oracle_chat_with_memory"],
+    "factory": ["factory"],
+    "chunk_index_utils": ["chunk_index_utils"],
+    "batch_qa": ["batch_qa"],
+    "citations_demo": ["test_oci_command_r_rag_st"],
+}
+
+# example: import time:      1205 |      17032 | factory
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import_ms(modules):
+    """
+    cumulative import time (ms) of modules, in a new interpreter
+    """
+    code = "; ".join(f"import {module}" for module in modules)
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+
+        # only top level imports: the cumulative includes the nested ones
+        if match and len(match.group(3)) == 1:
+            total_us += int(match.group(2))
+
+    return total_us / 1000.0
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Import-time benchmark.")
+    parser.add_argument("--runs", type=int, default=3, help="Take the best of runs")
+
+    args = parser.parse_args()
+
+    budgets = config["startup"]["budget_ms"]
+    over_budget = []
+
+    logger.info("%-20s %10s %10s", "entry point", "time (ms)", "budget")
+
+    for entry_point, entry_modules in ENTRY_POINTS.items():
+        # the best of runs, to reduce the noise from disk cache
+        elapsed = min(measure_import_ms(entry_modules) for _ in range(args.runs))
+        budget = budgets.get(entry_point)
+
+        logger.info("%-20s %10.1f %10s", entry_point, elapsed, budget)
+
+        if budget is not None and elapsed > budget:
+            over_budget.append(entry_point)
+
+    if over_budget:
+        logger.error("Over budget: %s", ", ".join(over_budget))
+        sys.exit(1)
@@ -0,0 +1,121 @@
+"""
+Benchmark: insert throughput (rows/s) in Oracle 23ai
+
+Usage:
+    python bench_oracle_insert.py [--n_rows 20000] [--dimension 1024]
+
+    The same rows (random float32 vectors, texts of ~500 chars) are
+    inserted in two temporary tables:
+        * OracleVS.add_texts: vectors as lists of Python floats (current path)
+        * OracleBulkWriter: vectors bound from the NumPy buffer, executemany
+          in batches of insert_batch_size, commit every commit_every rows
+    The embeddings model is not called: only the insert is measured.
+    The tables are dropped at the end.
+
+Python Version: 3.11
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+
+from factory_vector_store import get_oracle_connection
+from oracle_bulk_writer import OracleBulkWriter
+from utils import get_console_logger, load_configuration
+
+config = load_configuration()
+
+ORACLEVS_TABLE = "BENCH_INSERT_ORACLEVS"
+BULK_TABLE = "BENCH_INSERT_BULK"
+
+
+def insert_with_oraclevs(connection, texts, metadatas, vectors):
+    """
+    the current path, returns the elapsed time (sec.)
+    """
+    from langchain_community.vectorstores.oraclevs import OracleVS
+    from langchain_community.vectorstores.utils import DistanceStrategy
+
+    from oci_cohere_embeddings_utils import PrecomputedEmbeddings
+
+    embeddings = PrecomputedEmbeddings(vectors.shape[1], probe=True)
+
+    v_store = OracleVS(
+        client=connection,
+        table_name=ORACLEVS_TABLE,
+        distance_strategy=DistanceStrategy.COSINE,
+        embedding_function=embeddings,
+    )
+
+    # as they come from the embeddings model
+    embeddings.set_vectors(vectors.tolist())
+
+    time_start = time()
+    v_store.add_texts(texts, metadatas)
+
+    return time() - time_start
+
+
+def insert_with_bulk_writer(connection, texts, metadatas, vectors):
+    """
+    the array-backed path, returns the elapsed time (sec.)
+    """
+    writer = OracleBulkWriter(connection, BULK_TABLE)
+    writer.create_table(vectors.shape[1])
+
+    time_start = time()
+    writer.write(texts, metadatas, vectors)
+
+    return time() - time_start
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Benchmark of 23ai inserts.")
+    parser.add_argument("--n_rows", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=1024)
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    bench_vectors = rng.standard_normal((args.n_rows, args.dimension), np.float32)
+    bench_texts = [f"chunk {i} " * 50 for i in range(args.n_rows)]
+    bench_metadatas = [{"source": "bench.pdf", "page": i} for i in range(args.n_rows)]
+
+    db_connection = get_oracle_connection()
+
+    try:
+        results = {
+            "OracleVS.add_texts": insert_with_oraclevs(
+                db_connection, bench_texts, bench_metadatas, bench_vectors
+            ),
+            "OracleBulkWriter": insert_with_bulk_writer(
+                db_connection, bench_texts, bench_metadatas, bench_vectors
+            ),
+        }
+    finally:
+        with db_connection.cursor() as bench_cursor:
+            for bench_table in [ORACLEVS_TABLE, BULK_TABLE]:
+                bench_cursor.execute(f"DROP TABLE IF EXISTS {bench_table} PURGE")
+
+    logger.info("")
+    logger.info(
+        "%s rows, dimension %s, insert_batch_size %s, commit_every %s",
+        args.n_rows,
+        args.dimension,
+        config["vector_store"]["23ai"]["insert_batch_size"],
+        config["vector_store"]["23ai"]["commit_every"],
+    )
+    for path_name, elapsed in results.items():
+        logger.info(
+            "%-20s %8s rows/s (%s sec.)",
+            path_name,
+            round(args.n_rows / elapsed),
+            round(elapsed, 1),
+        )
+    logger.info("")
@@ -0,0 +1,124 @@
+"""
+Benchmark: parallel vector searches on Oracle 23ai, single connection vs pool
+
+Usage:
+    python bench_parallel_search.py [--n_searches 4] [--n_rounds 20]
+
+    Every round runs n_searches searches (as multi-query retrieval does)
+    from n_searches threads:
+        * single: the store has one connection, python-oracledb serializes
+          the calls, so the elapsed time is close to the sum of the searches
+        * pool: every search takes its own connection (get_oracle_pool)
+    The query vectors are sampled from the collection, the embeddings model
+    is not called. It reports the median elapsed time per round and the
+    speed-up of the pool.
+
+Python Version: 3.11
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import numpy as np
+
+from factory_vector_store import (
+    get_collection_name,
+    get_oracle_connection,
+    get_oracle_pool,
+)
+from utils import get_console_logger, load_configuration
+
+config = load_configuration()
+
+
+def sample_vectors(connection, table_name, n_vectors):
+    """
+    query vectors taken from the collection
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT embedding FROM {table_name} SAMPLE (10) "
+            f"FETCH FIRST {int(n_vectors)} ROWS ONLY"
+        )
+        return [list(row[0]) for row in cursor.fetchall()]
+
+
+def time_rounds(v_store, vectors, n_searches, n_rounds, k):
+    """
+    elapsed time (ms) of every round of n_searches parallel searches
+    """
+    elapsed = []
+
+    with ThreadPoolExecutor(max_workers=n_searches) as executor:
+        for i in range(n_rounds):
+            batch = [
+                vectors[(i * n_searches + j) % len(vectors)] for j in range(n_searches)
+            ]
+
+            time_start = time()
+            list(
+                executor.map(
+                    lambda vector: v_store.similarity_search_by_vector(vector, k=k),
+                    batch,
+                )
+            )
+            elapsed.append((time() - time_start) * 1000)
+
+    return np.array(elapsed)
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    from langchain_community.vectorstores.utils import DistanceStrategy
+
+    from oci_cohere_embeddings_utils import PrecomputedEmbeddings
+    from oracle_vs_filters import OracleVSWithFilters
+
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Parallel searches on 23ai.")
+    parser.add_argument("--n_searches", type=int, default=4)
+    parser.add_argument("--n_rounds", type=int, default=20)
+    parser.add_argument("--k", type=int, default=config["retriever"]["top_k"])
+
+    args = parser.parse_args()
+
+    table = get_collection_name()
+    db_connection = get_oracle_connection()
+
+    query_vectors = sample_vectors(
+        db_connection, table, args.n_searches * args.n_rounds
+    )
+    # only to create the stores: search is done by vector
+    embeddings = PrecomputedEmbeddings(len(query_vectors[0]), probe=True)
+
+    results = {}
+    for mode, pool in [("single", None), ("pool", get_oracle_pool())]:
+        v_store = OracleVSWithFilters(
+            client=db_connection,
+            table_name=table,
+            distance_strategy=DistanceStrategy.COSINE,
+            embedding_function=embeddings,
+            pool=pool,
+        )
+        results[mode] = time_rounds(
+            v_store, query_vectors, args.n_searches, args.n_rounds, args.k
+        )
+
+    logger.info("")
+    logger.info("%s parallel searches, %s rounds", args.n_searches, args.n_rounds)
+    for mode, latencies in results.items():
+        logger.info(
+            "%-7s p50: %7.1f ms, p95: %7.1f ms per round",
+            mode,
+            np.percentile(latencies, 50),
+            np.percentile(latencies, 95),
+        )
+    logger.info(
+        "Speed-up with pool: %.2fx",
+        np.median(results["single"]) / np.median(results["pool"]),
+    )
+    logger.info("")
@@ -0,0 +1,170 @@
+"""
+Benchmark: flat chunking vs small-to-big (parent/child) chunking
+
+Usage:
+    python bench_small_to_big.py questions.jsonl [--no_llm]
+
+    The books in books_dir are split with chunk_size (flat chunks = parents),
+    parents are split with child_chunk_size ([text_splitting]).
+    For both modes it reports:
+        * embedding cost: chunks and (estimated) tokens embedded, time
+        * index size: float32 vectors + texts (+ parent store)
+        * for every question: tokens in the context and the answer latency
+    Search is done in NumPy (as in eval_retrieval.py): the latency doesn't
+    depend on the Vector Store. The questions file is the same labelled
+    file used by eval_retrieval.py (only "question" is used).
+
+    With --no_llm the LLM is not called (only context tokens are reported).
+
+Python Version: 3.11
+"""
+
+import argparse
+import tempfile
+from time import time
+
+import numpy as np
+
+from chunk_index_utils import load_books_and_split, make_child_chunks
+from eval_retrieval import normalize, read_labelled_questions, search_top_k
+from factory import get_embed_model, get_llm
+from parent_store import ParentStore, map_to_parents
+from utils import estimate_tokens, get_console_logger, load_configuration
+
+config = load_configuration()
+
+
+def embed_and_measure(docs, embed_model):
+    """
+    embed the docs, returns vectors and the stats on cost and size
+    """
+    texts = [doc.page_content for doc in docs]
+
+    time_start = time()
+    vectors = normalize(embed_model.embed_documents(texts))
+
+    stats = {
+        "chunks": len(texts),
+        "embed_tokens": sum(estimate_tokens(text) for text in texts),
+        "embed_sec": round(time() - time_start, 1),
+        "index_mb": (vectors.nbytes + sum(len(text.encode("utf-8")) for text in texts))
+        / 2**20,
+    }
+
+    return vectors, stats
+
+
+def answer_latency(llm, question, context_docs):
+    """
+    latency (sec.) of the answer with context_docs
+    """
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
+    from oracle_chat_prompts import QA_PROMPT
+
+    chain = create_stuff_documents_chain(llm, QA_PROMPT)
+
+    time_start = time()
+    chain.invoke({"input": question, "chat_history": [], "context": context_docs})
+
+    return time() - time_start
+
+
+def run_questions(questions, q_vectors, docs, vectors, llm, small_to_big, store):
+    """
+    context tokens and latency for every question
+    """
+    top_k = config["retriever"]["top_k"]
+    top_n = config["retriever"]["top_n"]
+
+    top, _ = search_top_k(q_vectors, vectors, top_k)
+
+    context_tokens = []
+    latencies = []
+
+    for question, indexes in zip(questions, top):
+        hits = [docs[i] for i in indexes]
+
+        # without the reranker, we keep the first top_n
+        if small_to_big:
+            context_docs = map_to_parents(hits, store)[:top_n]
+        else:
+            context_docs = hits[:top_n]
+
+        context_tokens.append(
+            sum(estimate_tokens(doc.page_content) for doc in context_docs)
+        )
+
+        if llm is not None:
+            latencies.append(answer_latency(llm, question, context_docs))
+
+    return {
+        "context_tokens": round(float(np.mean(context_tokens)), 1),
+        "answer_sec_p50": round(float(np.median(latencies)), 2) if latencies else None,
+    }
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Flat vs small-to-big chunking.")
+    parser.add_argument("questions_file", type=str, help="Labelled questions (JSONL)")
+    parser.add_argument("--no_llm", action="store_true", help="Don't call the LLM")
+
+    args = parser.parse_args()
+
+    embed_model = get_embed_model(config["embeddings"]["embed_model_type"])
+    chat_llm = None
+    if not args.no_llm:
+        chat_llm = get_llm(
+            model_type=config["llm"]["model_type"],
+            model_id=config["llm"]["oci"]["llm_model"],
+        )
+
+    all_questions, _ = read_labelled_questions(args.questions_file)
+    question_vectors = normalize(embed_model.embed_documents(all_questions))
+
+    parent_docs = load_books_and_split(config["text_splitting"]["books_dir"])
+
+    results = {}
+
+    flat_vectors, results["flat"] = embed_and_measure(parent_docs, embed_model)
+    results["flat"].update(
+        run_questions(
+            all_questions,
+            question_vectors,
+            parent_docs,
+            flat_vectors,
+            chat_llm,
+            False,
+            None,
+        )
+    )
+
+    # a temporary parent store, not the one used by the app
+    with tempfile.TemporaryDirectory() as tmp_dir_name:
+        parent_store = ParentStore(tmp_dir_name)
+        child_docs = make_child_chunks(parent_docs, parent_store)
+
+        child_vectors, results["small_to_big"] = embed_and_measure(
+            child_docs, embed_model
+        )
+        results["small_to_big"]["index_mb"] += parent_store.size_bytes() / 2**20
+        results["small_to_big"].update(
+            run_questions(
+                all_questions,
+                question_vectors,
+                child_docs,
+                child_vectors,
+                chat_llm,
+                True,
+                parent_store,
+            )
+        )
+
+    for mode, stats in results.items():
+        stats["index_mb"] = round(stats["index_mb"], 2)
+        logger.info("%-13s %s", mode, stats)
@@ -0,0 +1,165 @@
+"""
+Benchmark of filtered retrieval when the number of tenants grows
+
+Usage:
+    python bench_tenant_filters.py --store 23AI --tenants 1 10 50
+        [--docs_per_tenant 500] [--n_queries 50]
+
+    Synthetic documents with random vectors (no calls to the embedding
+    model) are loaded for every tenant in a dedicated collection
+    (BENCH_TENANTS), then queries for a single tenant are timed:
+        * filtered: only the partition/filter of the tenant is searched
+        * global: search on the whole collection, then keep the tenant docs
+          (this is what we did before, with post-filtering)
+
+    Warning: the benchmark collection is dropped and re-created.
+
+Python Version: 3.11
+"""
+
+import argparse
+import hashlib
+from time import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from factory_vector_store import get_vector_store, get_search_kwargs
+from utils import get_console_logger
+
+BENCH_COLLECTION = "BENCH_TENANTS"
+EMBED_DIM = 1024
+TOP_K = 8
+
+
+class RandomEmbeddings(Embeddings):
+    """
+    deterministic random vectors, derived from the hash of the text
+    """
+
+    def _embed(self, text):
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(EMBED_DIM)
+
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def get_bench_store(store_type, embed_model, tenant=None):
+    """
+    the Vector Store on the dedicated collection
+    """
+    if store_type == "23AI":
+        collection_name = BENCH_COLLECTION
+    else:
+        collection_name = BENCH_COLLECTION.lower()
+
+    return get_vector_store(
+        store_type, embed_model, tenant=tenant, collection_name=collection_name
+    )
+
+
+def load_tenants(store_type, embed_model, n_tenants, docs_per_tenant):
+    """
+    load the synthetic docs for n_tenants
+    """
+    for i in range(n_tenants):
+        tenant = f"T{i}"
+        texts = [f"{tenant} document {j}" for j in range(docs_per_tenant)]
+        metadatas = [{"tenant": tenant, "source": f"{tenant}.pdf"} for _ in texts]
+
+        # in 23AI every tenant has its table, plus the global one for comparison
+        tenant_store = get_bench_store(store_type, embed_model, tenant=tenant)
+        tenant_store.add_texts(texts, metadatas=metadatas)
+
+        if store_type == "23AI":
+            get_bench_store(store_type, embed_model).add_texts(
+                texts, metadatas=metadatas
+            )
+
+
+def time_queries(v_store, search_kwargs, n_queries, keep_tenant=None):
+    """
+    returns the latencies (ms) of n_queries
+    keep_tenant: if given, post-filter the results on the tenant
+    """
+    latencies = []
+
+    for i in range(n_queries):
+        time_start = time()
+
+        docs = v_store.similarity_search(f"query {i}", **search_kwargs)
+        if keep_tenant is not None:
+            docs = [doc for doc in docs if doc.metadata.get("tenant") == keep_tenant]
+
+        latencies.append((time() - time_start) * 1000)
+
+    return np.array(latencies)
+
+
+def drop_bench_collections(store_type, embed_model, max_tenants):
+    """
+    remove the data of a previous run
+    """
+    if store_type == "23AI":
+        from langchain_community.vectorstores.oraclevs import drop_table_purge
+
+        v_store = get_bench_store(store_type, embed_model)
+        drop_table_purge(v_store.client, BENCH_COLLECTION)
+        for i in range(max_tenants):
+            drop_table_purge(v_store.client, f"{BENCH_COLLECTION}_T{i}")
+    else:
+        v_store = get_bench_store(store_type, embed_model)
+        if v_store.index_exists():
+            v_store.delete_index()
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Benchmark filtered retrieval.")
+    parser.add_argument("--store", choices=["OPENSEARCH", "23AI"], required=True)
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--docs_per_tenant", type=int, default=500)
+    parser.add_argument("--n_queries", type=int, default=50)
+
+    args = parser.parse_args()
+
+    embeddings = RandomEmbeddings()
+
+    logger.info("tenants  filtered p50/p95 (ms)  global p50/p95 (ms)")
+
+    for num_tenants in args.tenants:
+        drop_bench_collections(args.store, embeddings, max(args.tenants))
+        load_tenants(args.store, embeddings, num_tenants, args.docs_per_tenant)
+
+        filters = {"tenant": "T0"}
+
+        filtered = time_queries(
+            get_bench_store(args.store, embeddings, tenant="T0"),
+            get_search_kwargs(args.store, TOP_K, filters),
+            args.n_queries,
+        )
+        global_search = time_queries(
+            get_bench_store(args.store, embeddings),
+            {"k": TOP_K},
+            args.n_queries,
+            keep_tenant="T0",
+        )
+
+        logger.info(
+            "%7s  %8.1f / %8.1f       %8.1f / %8.1f",
+            num_tenants,
+            np.percentile(filtered, 50),
+            np.percentile(filtered, 95),
+            np.percentile(global_search, 50),
+            np.percentile(global_search, 95),
+        )
@@ -0,0 +1,150 @@
+"""
+Bounded conversation memory
+
+The history sent to the LLM is made of:
+    * a rolling summary of the older messages
+    * the last messages, within a token budget
+the summary is updated in a background thread, after the answer is
+returned, so it doesn't add latency to the requests. Until the new summary
+is ready, the evicted messages are still sent (the history can exceed
+the budget for a turn, but no message is missing).
+
+Python Version: 3.11
+"""
+
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage
+
+from oracle_chat_prompts import SUMMARY_PROMPT
+from utils import estimate_tokens, load_configuration
+
+config = load_configuration()
+
+SUMMARY_PREFIX = "Summary of the previous conversation: "
+
+
+class ConversationMemory:
+    """
+    Sliding window over the messages + rolling summary of the evicted ones
+
+    Usage:
+        memory = ConversationMemory(llm)
+        memory.add_message(HumanMessage(content=question))
+        chain.invoke({"input": question, "chat_history": memory.get_history()})
+    """
+
+    def __init__(self, llm, max_history_tokens=None, chars_per_token=None):
+        """
+        llm: the chat model used to summarise
+        max_history_tokens: budget for the history (summary included)
+        """
+        if max_history_tokens is None:
+            max_history_tokens = config["chat_memory"]["max_history_tokens"]
+        if chars_per_token is None:
+            chars_per_token = config["context_packing"]["chars_per_token"]
+
+        self.llm = llm
+        self.max_history_tokens = max_history_tokens
+        self.chars_per_token = chars_per_token
+
+        self.window = []
+        self.summary = ""
+        # messages evicted from the window, not yet in the summary
+        self.to_summarise = []
+        # messages being added to the summary (in the background)
+        self.summarising = []
+
+        self.lock = threading.Lock()
+        # one worker: summaries are applied in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.logger = logging.getLogger("ConsoleLogger")
+
+    def _tokens(self, text):
+        return estimate_tokens(text, self.chars_per_token)
+
+    def _window_budget(self):
+        """
+        tokens available for the window, after the summary
+        """
+        return self.max_history_tokens - self._tokens(self.summary)
+
+    def add_message(self, message):
+        """
+        add a message to the window, evicting the older ones if needed
+        """
+        with self.lock:
+            self.window.append(message)
+
+            budget = self._window_budget()
+            used = sum(self._tokens(str(msg.content)) for msg in self.window)
+
+            # evict the oldest messages, keep at least the last one
+            while used > budget and len(self.window) > 1:
+                evicted = self.window.pop(0)
+                used -= self._tokens(str(evicted.content))
+                self.to_summarise.append(evicted)
+
+    def get_history(self):
+        """
+        the messages to send to the LLM, bounded in size
+        """
+        with self.lock:
+            # evicted messages not yet in the summary are kept
+            history = self.summarising + self.to_summarise + self.window
+
+            if self.summary:
+                history.insert(0, AIMessage(content=SUMMARY_PREFIX + self.summary))
+
+        return history
+
+    def update_summary_async(self):
+        """
+        to be called when the answer has been sent to the user:
+        the summary is updated off the critical path
+        """
+        with self.lock:
+            if not self.to_summarise:
+                return None
+
+            new_lines = self.to_summarise
+            self.to_summarise = []
+            self.summarising += new_lines
+
+        # in the same context: the tokens are counted for the request
+        return self.executor.submit(
+            contextvars.copy_context().run, self._update_summary, new_lines
+        )
+
+    def _update_summary(self, new_lines):
+        """
+        ask the LLM to add new_lines to the current summary
+        """
+        messages = SUMMARY_PROMPT.format_messages(
+            summary=self.summary,
+            new_lines=new_lines,
+            max_words=config["chat_memory"]["summary_max_words"],
+        )
+
+        try:
+            new_summary = self.llm.invoke(messages).content
+        except Exception as e:
+            # keep the old summary, the messages will be summarised next time
+            self.logger.error("Error updating the conversation summary: %s", e)
+
+            with self.lock:
+                del self.summarising[: len(new_lines)]
+                self.to_summarise = new_lines + self.to_summarise
+            return
+
+        with self.lock:
+            self.summary = new_summary
+            # one worker: new_lines are the first of summarising
+            del self.summarising[: len(new_lines)]
+
+        self.logger.info(
+            "Updated conversation summary (%s tokens)", self._tokens(new_summary)
+        )
@@ -7,16 +7,21 @@ Python Version: 3.11
 Usage: contains the functions to split in chunks and create the index
 """
 
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from glob import glob
-from tqdm.auto import tqdm
-import oracledb
-
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import OpenSearchVectorSearch
-from langchain_community.vectorstores.oraclevs import OracleVS
-from langchain_community.vectorstores.utils import DistanceStrategy
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
+from time import time
+
+# loaders, splitters, vector stores and oracledb are imported
+# inside the functions: they're needed only to load documents
+from factory_vector_store import (
+    check_tenant,
+    get_collection_name,
+    get_opensearch_params,
+    get_ann_params,
+)
 from utils import get_console_logger, remove_path_from_ref, load_configuration
 
 from config_private import (
@@ -31,47 +36,172 @@ from config_private import (
 # config is a global object
 config = load_configuration()
 
+# with precomputed vectors: num. of docs per add_documents call
+PRECOMPUTED_SLICE_SIZE = 5000
 
-def get_recursive_text_splitter():
+# max num. of ids in a single delete (expressions in an Oracle IN list)
+ORACLE_DELETE_SLICE_SIZE = 1000
+
+
+def get_recursive_text_splitter(chunk_size=None, chunk_overlap=None):
     """
     return a recursive text splitter
+    chunk_size, chunk_overlap: if not given, taken from config
     """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if chunk_size is None:
+        chunk_size = config["text_splitting"]["chunk_size"]
+    if chunk_overlap is None:
+        chunk_overlap = config["text_splitting"]["chunk_overlap"]
+
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=config["text_splitting"]["chunk_size"],
-        chunk_overlap=config["text_splitting"]["chunk_overlap"],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
         length_function=len,
         is_separator_regex=False,
     )
     return text_splitter
 
 
-def load_book_and_split(book_path):
+def add_ingestion_metadata(docs, tenant=None):
+    """
+    add the metadata used to filter: tenant, ingest_date (YYYY-MM-DD)
+    """
+    if tenant:
+        check_tenant(tenant)
+
+    ingest_date = date.today().isoformat()
+
+    for doc in docs:
+        doc.metadata["ingest_date"] = ingest_date
+        if tenant:
+            doc.metadata["tenant"] = tenant
+
+    return docs
+
+
+def make_child_chunks(parent_docs, parent_store=None):
+    """
+    small-to-big: split the (parent) chunks in small chunks to embed
+    parents are saved in the parent store, children have their parent_id
+    parent_store: if not given, the shared one
+    """
+    from langchain_core.documents import Document
+    from parent_store import get_parent_store
+
+    logger = get_console_logger()
+
+    if parent_store is None:
+        parent_store = get_parent_store()
+
+    text_splitter = get_recursive_text_splitter(
+        config["text_splitting"]["child_chunk_size"],
+        config["text_splitting"]["child_chunk_overlap"],
+    )
+
+    parent_ids = parent_store.add([doc.page_content for doc in parent_docs])
+
+    child_docs = []
+    for parent_id, parent in zip(parent_ids, parent_docs):
+        for text in text_splitter.split_text(parent.page_content):
+            child_docs.append(
+                Document(
+                    page_content=text,
+                    metadata={**parent.metadata, "parent_id": parent_id},
+                )
+            )
+
+    logger.info(
+        "Split %s parent chunks in %s child chunks...",
+        len(parent_docs),
+        len(child_docs),
+    )
+
+    return child_docs
+
+
+def get_chunk_ids(docs):
+    """
+    ids of the chunks, from file name, page, tenant, position in the page
+    and text: the same docs loaded again (for ex. a load retried after an
+    error) have the same ids, so they're not saved twice
+    """
+    positions = {}
+    ids = []
+
+    for doc in docs:
+        page_key = (
+            # files are uploaded in temporary dirs: only the name
+            os.path.basename(str(doc.metadata.get("source", ""))),
+            doc.metadata.get("page", ""),
+            doc.metadata.get("tenant", ""),
+        )
+        position = positions.get(page_key, 0)
+        positions[page_key] = position + 1
+
+        text_hash = hashlib.sha256(doc.page_content.encode()).hexdigest()[:16]
+        ids.append("|".join(map(str, [*page_key, position, text_hash])))
+
+    return ids
+
+
+def load_book_and_split(book_path, tenant=None):
     """
     load a single book
+    tenant: if given, added to metadata
     """
+    from pdf_text_cache import load_and_split_pdf
+
     logger = get_console_logger()
 
     text_splitter = get_recursive_text_splitter()
 
-    loader = PyPDFLoader(file_path=book_path)
-
-    docs = loader.load_and_split(text_splitter=text_splitter)
+    # the text of the pages is parsed only the first time
+    docs = load_and_split_pdf(book_path, text_splitter)
 
     # remove path from source
     for doc in docs:
         doc.metadata["source"] = remove_path_from_ref(doc.metadata["source"])
 
+    add_ingestion_metadata(docs, tenant)
+
     logger.info("Loaded %s chunks...", len(docs))
 
     return docs
 
 
-def add_docs_to_23ai(docs, embed_model):
+def add_precomputed_docs(v_store, embeddings, docs, vectors, ids, **kwargs):
+    """
+    add docs with their vectors (list or NumPy array) and ids to a LangChain
+    store, a slice at a time: only the vectors of a slice are Python lists
+    embeddings: the PrecomputedEmbeddings of v_store
+    """
+    for i in range(0, len(docs), PRECOMPUTED_SLICE_SIZE):
+        end = i + PRECOMPUTED_SLICE_SIZE
+
+        embeddings.set_vectors(vectors[i:end])
+        v_store.add_documents(docs[i:end], ids=ids[i:end], **kwargs)
+
+
+def add_docs_to_23ai(docs, embed_model, tenant=None, vectors=None):
     """
     add docs from a book to Oracle vector store
+    tenant: if given, docs are added to the table of the tenant
+    vectors: if given, the embeddings of docs (embed_model is not called)
     """
+    import oracledb
+    from langchain_community.vectorstores.oraclevs import OracleVS
+    from langchain_community.vectorstores.utils import DistanceStrategy
+    from oci_cohere_embeddings_utils import PrecomputedEmbeddings
+    from oracle_vector_index import ensure_vector_index
+
     logger = get_console_logger()
 
+    if vectors is not None:
+        # OracleVS embeds a text to get the dimension
+        embed_model = PrecomputedEmbeddings(len(vectors[0]), probe=True)
+
     try:
         dsn = f"{DB_HOST_IP}:1521/{DB_SERVICE}"
 
@@ -79,57 +209,188 @@ def add_docs_to_23ai(docs, embed_model):
 
         v_store = OracleVS(
             client=connection,
-            table_name=config["vector_store"]["collection_name"],
+            table_name=get_collection_name(tenant),
             distance_strategy=DistanceStrategy.COSINE,
             embedding_function=embed_model,
         )
 
         logger.info("Saving new documents to Vector Store...")
 
-        v_store.add_documents(docs)
+        ids = get_chunk_ids(docs)
+
+        if config["vector_store"]["23ai"]["bulk_insert"]:
+            from oci_cohere_embeddings_utils import embed_to_array
+            from oracle_bulk_writer import OracleBulkWriter
+
+            texts = [doc.page_content for doc in docs]
+            if vectors is None:
+                vectors = embed_to_array(embed_model, texts)
+
+            OracleBulkWriter(connection, v_store.table_name).write(
+                texts, [doc.metadata for doc in docs], vectors, ids
+            )
+        else:
+            # OracleVS fails on ids already saved (for ex. by a failed load)
+            for i in range(0, len(ids), ORACLE_DELETE_SLICE_SIZE):
+                v_store.delete(ids[i : i + ORACLE_DELETE_SLICE_SIZE])
+
+            if vectors is not None:
+                # set after OracleVS is created: it embeds a text for the dimension
+                add_precomputed_docs(v_store, embed_model, docs, vectors, ids)
+            else:
+                v_store.add_documents(docs, ids=ids)
 
         logger.info("Saved new documents to Vector Store !")
 
+        # without a vector index every search is an exact scan
+        if config["vector_store"]["23ai"]["create_index"]:
+            ensure_vector_index(connection, v_store.table_name)
+
     except oracledb.Error as e:
         err_msg = "An error occurred in add_docs_to_23ai: " + str(e)
         logger.error(err_msg)
+        # the caller must know that docs haven't been saved
+        raise
 
 
-def add_docs_to_opensearch(docs, embed_model):
+def add_docs_to_opensearch(docs, embed_model, vectors=None):
     """
     add docs from a book to opensearch vector store
+    vectors: if given, the embeddings of docs (embed_model is not called)
     """
+    from langchain_community.vectorstores import OpenSearchVectorSearch
+    from oci_cohere_embeddings_utils import PrecomputedEmbeddings
+
     logger = get_console_logger()
 
+    if vectors is not None:
+        embed_model = PrecomputedEmbeddings(len(vectors[0]))
+
     v_store = OpenSearchVectorSearch(
         embedding_function=embed_model,
-        opensearch_url=config["vector_store"]["opensearch"]["opensearch_url"],
         http_auth=(OPENSEARCH_USER, OPENSEARCH_PWD),
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False,
-        bulk_size=5000,
-        index_name=config["vector_store"]["opensearch"]["index_name"],
-        engine="faiss",
+        **get_opensearch_params(),
     )
 
     logger.info("Saving new documents to Vector Store...")
 
-    v_store.add_documents(docs)
+    # docs with the same id are replaced: a retried load doesn't duplicate
+    ids = get_chunk_ids(docs)
+
+    if vectors is not None:
+        add_precomputed_docs(
+            v_store, embed_model, docs, vectors, ids, **get_ann_params()
+        )
+    else:
+        v_store.add_documents(docs, ids=ids, **get_ann_params())
 
     logger.info("Saved new documents to Vector Store !")
 
 
-def load_books_and_split(books_dir) -> list:
+def add_docs_to_store(docs, embed_model, store_type=None, tenant=None):
+    """
+    add docs to the Vector Store configured (or store_type)
+    tenant: in OpenSearch is only in metadata, in 23AI selects the table
+    chunks have the same ids every time (get_chunk_ids): after an error,
+    also in only one of write_stores, the load can be retried
+    """
+    if store_type is None:
+        # during a migration, docs are written in all the stores
+        if config["vector_store"]["write_stores"]:
+            report = add_docs_to_stores(docs, embed_model, tenant=tenant)
+
+            failed = [name for name, info in report.items() if info["error"]]
+            if failed:
+                raise RuntimeError(f"Error writing docs in: {', '.join(failed)}")
+            return
+
+        store_type = config["vector_store"]["store_type"]
+
+    # only the small chunks are embedded
+    if config["text_splitting"]["small_to_big"]:
+        docs = make_child_chunks(docs)
+
+    if store_type == "OPENSEARCH":
+        add_docs_to_opensearch(docs, embed_model)
+    elif store_type == "23AI":
+        add_docs_to_23ai(docs, embed_model, tenant)
+
+
+def add_docs_to_stores(docs, embed_model, store_types=None, tenant=None):
+    """
+    add docs to several Vector Stores (for ex. during a migration):
+    embeddings are computed once, then the stores are written in parallel
+
+    store_types: if not given, write_stores in config
+    returns, for every store, the time (sec.) and the error (None if ok):
+    an error in a store doesn't stop the others
+    """
+    logger = get_console_logger()
+
+    if store_types is None:
+        store_types = config["vector_store"]["write_stores"]
+
+    if not docs or not store_types:
+        return {}
+
+    # only the small chunks are embedded
+    if config["text_splitting"]["small_to_big"]:
+        docs = make_child_chunks(docs)
+
+    from oci_cohere_embeddings_utils import embed_to_array
+
+    # float32 array (memory-mapped for large loads), shared by the writers
+    time_start = time()
+    vectors = embed_to_array(embed_model, [doc.page_content for doc in docs])
+
+    logger.info(
+        "Embedded %s docs in %s sec.", len(docs), round(time() - time_start, 1)
+    )
+
+    def write_to_store(store_type):
+        time_start = time()
+        error = None
+
+        try:
+            if store_type == "OPENSEARCH":
+                add_docs_to_opensearch(docs, embed_model, vectors)
+            elif store_type == "23AI":
+                add_docs_to_23ai(docs, embed_model, tenant, vectors)
+            else:
+                raise ValueError(f"Unknown store type: {store_type}")
+        except Exception as e:
+            logger.error("Error writing docs in %s: %s", store_type, e)
+            error = str(e)
+
+        return {"sec": round(time() - time_start, 1), "error": error}
+
+    with ThreadPoolExecutor(max_workers=len(store_types)) as executor:
+        report = dict(zip(store_types, executor.map(write_to_store, store_types)))
+
+    for store_type, info in report.items():
+        logger.info(
+            "%s: %s in %s sec.", store_type, info["error"] or "ok", info["sec"]
+        )
+
+    return report
+
+
+def load_books_and_split(
+    books_dir, chunk_size=None, chunk_overlap=None, tenant=None
+) -> list:
     """
     load a set of books from books_dir and split in chunks
+    chunk_size, chunk_overlap: if not given, taken from config
+    tenant: if given, added to metadata
     """
+    from tqdm.auto import tqdm
+    from pdf_text_cache import load_and_split_pdf
+
     logger = get_console_logger()
 
     logger.info("Loading documents from %s...", books_dir)
 
-    text_splitter = get_recursive_text_splitter()
+    text_splitter = get_recursive_text_splitter(chunk_size, chunk_overlap)
 
     books_list = sorted(glob(books_dir + "/*.pdf"))
 
@@ -139,10 +400,11 @@ def load_books_and_split(books_dir) -> list:
 
     docs = []
 
+    # only the split is done again, if the books are in the cache
     for book in tqdm(books_list):
-        loader = PyPDFLoader(file_path=book)
+        docs += load_and_split_pdf(book, text_splitter)
 
-        docs += loader.load_and_split(text_splitter=text_splitter)
+    add_ingestion_metadata(docs, tenant)
 
     logger.info("Loaded %s chunks of text...", len(docs))
 
@@ -0,0 +1,25 @@
+"""
+Cohere rerank with usage accounting
+
+Python Version: 3.11
+"""
+
+from langchain_cohere import CohereRerank
+
+from usage_accounting import RERANK, record_usage
+
+
+#
+# extend CohereRerank adding usage accounting
+#
+class CohereRerankWithUsage(CohereRerank):
+    """
+    records every call to the rerank API (usage_accounting)
+    """
+
+    def rerank(self, documents, query, **kwargs):
+        results = super().rerank(documents, query, **kwargs)
+
+        record_usage(RERANK, kwargs.get("model") or self.model, n_docs=len(documents))
+
+        return results
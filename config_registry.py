@@ -0,0 +1,169 @@
+"""
+Shared configuration, parsed once and reloaded when the file changes
+
+load_configuration() (in utils) returns a LiveConfig: a read-only view
+on the last valid content of config.toml. Modules can keep it in a
+global variable: values are read when used, so a change in the file
+(for ex: top_k, or a preamble) takes effect without restarting the app.
+Sections are read-only too (MappingProxyType, lists become tuples):
+a module can't change the configuration seen by the others.
+
+A new version of the file is checked (types of the main params)
+before replacing the current one: if not valid, it is ignored.
+
+Python Version: 3.11
+"""
+
+import logging
+import os
+import threading
+from collections.abc import Mapping
+from time import time
+from types import MappingProxyType
+
+import toml
+
+# how often (sec.) we check if the file has changed
+CHECK_INTERVAL = 2.0
+
+# the expected type of the main params (section.key -> type)
+CONFIG_SCHEMA = {
+    "ui.add_references": bool,
+    "ui.do_streaming": bool,
+    "text_splitting.books_dir": str,
+    "text_splitting.chunk_size": int,
+    "text_splitting.chunk_overlap": int,
+    "embeddings.embed_model_type": str,
+    "embeddings.oci.embed_batch_size": int,
+    "embeddings.oci.embed_model": str,
+    "vector_store.collection_name": str,
+    "vector_store.store_type": str,
+    "reranker.add_reranker": bool,
+    "retriever.top_k": int,
+    "retriever.top_n": int,
+    "llm.max_tokens": int,
+    "llm.model_type": str,
+    "llm.oci.endpoint": str,
+}
+
+
+def validate(data, schema):
+    """
+    check that all the keys in schema are in data, with the right type
+    raise ValueError if not
+    """
+    for path, expected_type in schema.items():
+        value = data
+        for key in path.split("."):
+            if not isinstance(value, dict) or key not in value:
+                raise ValueError(f"Missing {path} in configuration")
+            value = value[key]
+
+        if not isinstance(value, expected_type):
+            raise ValueError(
+                f"Wrong type for {path}: {type(value).__name__} "
+                f"instead of {expected_type.__name__}"
+            )
+
+
+def freeze(value):
+    """
+    read-only copy of the parsed TOML: dicts -> MappingProxyType, lists -> tuples
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+
+class ConfigRegistry:
+    """
+    Holds the content of a TOML file, reloaded if the file changes
+    """
+
+    def __init__(self, file_name, schema=None):
+        self.file_name = file_name
+        self.schema = schema or {}
+
+        self.lock = threading.Lock()
+
+        self.data = self._load()
+        self.mtime = os.path.getmtime(self.file_name)
+        self.last_check = time()
+
+    def _load(self):
+        data = toml.load(self.file_name)
+        validate(data, self.schema)
+
+        return freeze(data)
+
+    def get(self):
+        """
+        the current content, reloaded if the file has changed
+        """
+        now = time()
+
+        if now - self.last_check < CHECK_INTERVAL:
+            return self.data
+
+        with self.lock:
+            self.last_check = now
+
+            try:
+                mtime = os.path.getmtime(self.file_name)
+            except OSError:
+                return self.data
+
+            if mtime == self.mtime:
+                return self.data
+
+            self.mtime = mtime
+            logger = logging.getLogger("ConsoleLogger")
+
+            try:
+                self.data = self._load()
+            except (ValueError, toml.TomlDecodeError) as e:
+                logger.error("Ignored new version of %s: %s", self.file_name, e)
+                return self.data
+
+            logger.info("Reloaded %s", self.file_name)
+
+        return self.data
+
+
+class LiveConfig(Mapping):
+    """
+    read-only view on the current content of a ConfigRegistry
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __getitem__(self, key):
+        return self.registry.get()[key]
+
+    def __iter__(self):
+        return iter(self.registry.get())
+
+    def __len__(self):
+        return len(self.registry.get())
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(file_name, schema=None):
+    """
+    one registry for every file, shared by all the modules
+    """
+    key = os.path.abspath(file_name)
+
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = ConfigRegistry(file_name, schema)
+
+    return _registries[key]
@@ -0,0 +1,485 @@
+"""
+Offline evaluation of retrieval parameters
+
+Usage:
+    1. build (once) a snapshot of the embeddings for every chunk size to test:
+        python eval_retrieval.py snapshot --chunk_sizes 800 1500
+
+    2. run the sweep on a labelled question set:
+        python eval_retrieval.py sweep questions.jsonl --chunk_sizes 800 1500
+            --top_k 4 8 12 --top_n 3 6 [--out pareto.csv]
+
+    Every line of the question set is a JSON object, for ex:
+        {"question": "...", "relevant": [{"source": "book.pdf", "page": 12}]}
+    a chunk is relevant if it comes from one of the relevant pages.
+
+    Similarity search is done in NumPy on the snapshot (one matrix product for
+    all the questions), rerank results are cached in the snapshot dir,
+    so after the first run the sweep doesn't need any live call.
+    With --no_reranker only the configurations without reranker are
+    evaluated (the Cohere key is not needed).
+
+    recall@k is the fraction of questions with at least one relevant chunk
+    in the context sent to the LLM, MRR uses the rank of the first one.
+    retrieval_ms is the time of the search in NumPy (in memory, per
+    question), not the latency of the Vector Store.
+
+Python Version: 3.11
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from time import time
+
+import numpy as np
+
+from utils import get_console_logger, load_configuration, remove_path_from_ref
+
+config = load_configuration()
+
+SNAPSHOT_DIR = config["evaluation"]["snapshot_dir"]
+QUESTIONS_SNAPSHOT = "questions.npz"
+RERANK_CACHE = "rerank_cache.json"
+
+# the rerank cache is saved after this num. of new live calls
+RERANK_SAVE_EVERY = 20
+
+
+def get_snapshot_path(chunk_size):
+    """
+    the file with the embeddings of the chunks for chunk_size
+    """
+    return os.path.join(SNAPSHOT_DIR, f"chunks_{chunk_size}.npz")
+
+
+def normalize(vectors):
+    """
+    normalize rows, so that the dot product is the cosine similarity
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def build_snapshot(chunk_size, embed_model):
+    """
+    split the books with chunk_size, embed all the chunks and save on disk
+    """
+    from chunk_index_utils import load_books_and_split
+
+    logger = get_console_logger()
+
+    docs = load_books_and_split(
+        config["text_splitting"]["books_dir"], chunk_size=chunk_size
+    )
+    texts = [doc.page_content for doc in docs]
+
+    logger.info("Embedding %s chunks for chunk_size %s...", len(texts), chunk_size)
+
+    vectors = normalize(embed_model.embed_documents(texts))
+
+    np.savez_compressed(
+        get_snapshot_path(chunk_size),
+        vectors=vectors,
+        texts=np.array(texts, dtype=object),
+        sources=np.array(
+            [remove_path_from_ref(doc.metadata["source"]) for doc in docs]
+        ),
+        pages=np.array([int(doc.metadata["page"]) for doc in docs]),
+    )
+
+
+def load_snapshot(chunk_size):
+    """
+    load the snapshot for chunk_size
+    """
+    return dict(np.load(get_snapshot_path(chunk_size), allow_pickle=True))
+
+
+def snapshot_digest(snapshot):
+    """
+    identifies the content of a snapshot (texts and vectors):
+    a snapshot built again gives a new digest
+    """
+    digest = hashlib.sha256()
+
+    for text in snapshot["texts"]:
+        digest.update(text.encode("utf-8") + b"\0")
+    digest.update(np.ascontiguousarray(snapshot["vectors"]).tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+def read_labelled_questions(file_name):
+    """
+    returns the list of questions and the list of sets of relevant (source, page)
+    """
+    questions = []
+    relevant = []
+
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            questions.append(record["question"])
+            relevant.append(
+                {(item["source"], int(item["page"])) for item in record["relevant"]}
+            )
+
+    return questions, relevant
+
+
+def get_question_vectors(questions, embed_model):
+    """
+    embed the questions, reusing the vectors already in the snapshot dir
+    """
+    path = os.path.join(SNAPSHOT_DIR, QUESTIONS_SNAPSHOT)
+
+    cached = {}
+    if os.path.exists(path):
+        data = np.load(path, allow_pickle=True)
+        cached = dict(zip(data["texts"], data["vectors"]))
+
+    missing = [q for q in dict.fromkeys(questions) if q not in cached]
+
+    if missing:
+        cached.update(zip(missing, normalize(embed_model.embed_documents(missing))))
+
+        np.savez_compressed(
+            path,
+            texts=np.array(list(cached.keys()), dtype=object),
+            vectors=np.array(list(cached.values()), dtype=np.float32),
+        )
+
+    return np.array([cached[q] for q in questions], dtype=np.float32)
+
+
+def search_top_k(q_vectors, d_vectors, top_k):
+    """
+    vectorised similarity search for all the questions
+    returns the indexes of the top_k chunks (by decreasing similarity)
+    and the search time per question
+    (less than top_k chunks if there aren't enough)
+    """
+    time_start = time()
+
+    scores = q_vectors @ d_vectors.T
+    top_k = min(top_k, scores.shape[1])
+
+    top = np.argpartition(-scores, kth=top_k - 1, axis=1)[:, :top_k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+
+    elapsed = (time() - time_start) / len(q_vectors)
+
+    return top, elapsed
+
+
+class RerankCache:
+    """
+    cache of the rerank results, to avoid repeating live calls
+    the key is (chunk_size, snapshot digest, top_k, question): results
+    of a snapshot built again are not reused
+    """
+
+    def __init__(self):
+        self.path = os.path.join(SNAPSHOT_DIR, RERANK_CACHE)
+        self.data = {}
+        self.reranker = None
+        self.n_unsaved = 0
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def get_reranker(self):
+        """
+        create the Cohere reranker only if needed
+        """
+        if self.reranker is None:
+            from langchain_cohere import CohereRerank
+            from config_private import COHERE_API_KEY
+
+            self.reranker = CohereRerank(
+                cohere_api_key=COHERE_API_KEY,
+                model=config["reranker"]["cohere_reranker_model"],
+            )
+
+        return self.reranker
+
+    def rerank(self, chunk_size, digest, question, texts):
+        """
+        returns the order of texts by decreasing relevance and the latency
+        of the (first and only) live call
+        digest: the snapshot_digest of the snapshot of texts
+        """
+        key = f"{chunk_size}|{digest}|{len(texts)}|{question}"
+
+        if key not in self.data:
+            time_start = time()
+            results = self.get_reranker().rerank(
+                documents=list(texts), query=question, top_n=len(texts)
+            )
+            self.data[key] = {
+                "order": [res["index"] for res in results],
+                "latency": time() - time_start,
+            }
+
+            # an interrupted sweep doesn't lose the live calls already done
+            self.n_unsaved += 1
+            if self.n_unsaved >= RERANK_SAVE_EVERY:
+                self.save()
+
+        return self.data[key]["order"], self.data[key]["latency"]
+
+    def save(self):
+        """
+        save the cache on disk
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+        self.n_unsaved = 0
+
+
+def compute_metrics(hits):
+    """
+    hits: boolean matrix (n_questions x n_chunks in context), in rank order
+    returns recall@k and MRR
+    """
+    any_hit = hits.any(axis=1)
+    first_rank = np.argmax(hits, axis=1) + 1
+
+    recall = float(np.mean(any_hit))
+    mrr = float(np.mean(np.where(any_hit, 1.0 / first_rank, 0.0)))
+
+    return recall, mrr
+
+
+def relevance_matrix(snapshot, relevant):
+    """
+    boolean matrix (n_questions x n_chunks): True if the chunk is relevant
+    """
+    keys = np.array(
+        [f"{src}|{page}" for src, page in zip(snapshot["sources"], snapshot["pages"])]
+    )
+
+    return np.stack(
+        [np.isin(keys, [f"{src}|{page}" for src, page in rel]) for rel in relevant]
+    )
+
+
+def sweep(
+    questions,
+    relevant,
+    q_vectors,
+    chunk_sizes,
+    top_k_list,
+    top_n_list,
+    use_reranker=True,
+):
+    """
+    evaluate all the combinations of the parameters
+    use_reranker: if False, only the configurations without reranker
+    returns a list of dict, one for each configuration
+    """
+    rerank_cache = RerankCache()
+
+    try:
+        return sweep_chunk_sizes(
+            rerank_cache,
+            questions,
+            relevant,
+            q_vectors,
+            chunk_sizes,
+            top_k_list,
+            top_n_list if use_reranker else [],
+        )
+    finally:
+        if rerank_cache.n_unsaved:
+            rerank_cache.save()
+
+
+def sweep_chunk_sizes(
+    rerank_cache, questions, relevant, q_vectors, chunk_sizes, top_k_list, top_n_list
+):
+    """
+    the loops of sweep, for every chunk size and top_k
+    """
+    results = []
+
+    for chunk_size in chunk_sizes:
+        snapshot = load_snapshot(chunk_size)
+        digest = snapshot_digest(snapshot)
+        rel_matrix = relevance_matrix(snapshot, relevant)
+
+        for top_k in top_k_list:
+            top, search_time = search_top_k(q_vectors, snapshot["vectors"], top_k)
+            hits = np.take_along_axis(rel_matrix, top, axis=1)
+
+            recall, mrr = compute_metrics(hits)
+            results.append(
+                {
+                    "chunk_size": chunk_size,
+                    "top_k": top_k,
+                    "top_n": top_k,
+                    "reranker": False,
+                    "recall": recall,
+                    "mrr": mrr,
+                    "retrieval_ms": search_time * 1000,
+                    "rerank_ms": 0.0,
+                    "context_chars": chunk_size * top.shape[1],
+                }
+            )
+
+            top_n_values = [n for n in top_n_list if n <= top_k]
+            if not top_n_values:
+                continue
+
+            # with reranker: reorder once, then take the first top_n
+            orders = []
+            latencies = []
+            for i, question in enumerate(questions):
+                order, latency = rerank_cache.rerank(
+                    chunk_size, digest, question, snapshot["texts"][top[i]]
+                )
+                orders.append(order)
+                latencies.append(latency)
+
+            reranked_hits = np.take_along_axis(hits, np.array(orders), axis=1)
+
+            for top_n in top_n_values:
+                recall, mrr = compute_metrics(reranked_hits[:, :top_n])
+                results.append(
+                    {
+                        "chunk_size": chunk_size,
+                        "top_k": top_k,
+                        "top_n": top_n,
+                        "reranker": True,
+                        "recall": recall,
+                        "mrr": mrr,
+                        "retrieval_ms": search_time * 1000,
+                        "rerank_ms": float(np.mean(latencies)) * 1000,
+                        "context_chars": chunk_size * top_n,
+                    }
+                )
+
+    return results
+
+
+def mark_pareto(results):
+    """
+    mark the configurations not dominated by any other one
+    (higher recall, lower latency and smaller context are better)
+    """
+    recall = np.array([r["recall"] for r in results])
+    latency = np.array([r["retrieval_ms"] + r["rerank_ms"] for r in results])
+    context = np.array([r["context_chars"] for r in results])
+
+    for i, res in enumerate(results):
+        not_worse = (recall >= recall[i]) & (latency <= latency[i]) & (
+            context <= context[i]
+        )
+        better = (recall > recall[i]) | (latency < latency[i]) | (context < context[i])
+        res["pareto"] = not bool(np.any(not_worse & better))
+
+    return results
+
+
+def print_table(results):
+    """
+    print the results, Pareto optimal configurations first
+    """
+    logger = get_console_logger()
+
+    header = (
+        f"{'chunk':>6} {'top_k':>5} {'top_n':>5} {'rerank':>6} {'recall':>7} "
+        f"{'MRR':>6} {'retr_ms':>8} {'rerank_ms':>9} {'ctx_chars':>9} pareto"
+    )
+    logger.info(header)
+
+    for res in sorted(results, key=lambda r: (not r["pareto"], -r["recall"])):
+        logger.info(
+            "%6s %5s %5s %6s %7.3f %6.3f %8.2f %9.1f %9s %s",
+            res["chunk_size"],
+            res["top_k"],
+            res["top_n"],
+            res["reranker"],
+            res["recall"],
+            res["mrr"],
+            res["retrieval_ms"],
+            res["rerank_ms"],
+            res["context_chars"],
+            "*" if res["pareto"] else "",
+        )
+
+
+def save_csv(results, file_name):
+    """
+    save the results in a csv file
+    """
+    columns = list(results[0].keys())
+
+    with open(file_name, "w", encoding="utf-8") as f:
+        f.write(",".join(columns) + "\n")
+        for res in results:
+            f.write(",".join(str(res[col]) for col in columns) + "\n")
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    from factory import get_embed_model
+
+    parser = argparse.ArgumentParser(description="Evaluate retrieval parameters.")
+    parser.add_argument("command", choices=["snapshot", "sweep"])
+    parser.add_argument("questions_file", nargs="?", help="Labelled questions (JSONL)")
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", required=True)
+    parser.add_argument("--top_k", type=int, nargs="+", default=[4, 8, 12])
+    parser.add_argument("--top_n", type=int, nargs="+", default=[3, 6])
+    parser.add_argument("--out", type=str, help="csv file for the results")
+    parser.add_argument(
+        "--no_reranker", action="store_true", help="Skip configs with reranker"
+    )
+
+    args = parser.parse_args()
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    embeddings = get_embed_model(config["embeddings"]["embed_model_type"])
+
+    if args.command == "snapshot":
+        for size in args.chunk_sizes:
+            build_snapshot(size, embeddings)
+    else:
+        if args.questions_file is None:
+            parser.error("sweep requires the labelled questions file")
+
+        all_questions, all_relevant = read_labelled_questions(args.questions_file)
+        question_vectors = get_question_vectors(all_questions, embeddings)
+
+        sweep_results = mark_pareto(
+            sweep(
+                all_questions,
+                all_relevant,
+                question_vectors,
+                args.chunk_sizes,
+                args.top_k,
+                args.top_n,
+                use_reranker=not args.no_reranker,
+            )
+        )
+
+        print_table(sweep_results)
+
+        if args.out:
+            save_csv(sweep_results, args.out)
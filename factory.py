@@ -6,26 +6,19 @@ Python Version: 3.11
 """
 
 import logging
-
-# Cohere
-from langchain_cohere import CohereRerank
-from langchain.retrievers import ContextualCompressionRetriever
-
-# to handle conversational memory
-from langchain.chains import create_history_aware_retriever
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-
-# (4/07/2024) replaced with new OCI Models
-from langchain_community.chat_models.oci_generative_ai import ChatOCIGenAI
-
-from factory_vector_store import get_vector_store
-from oci_cohere_embeddings_utils import OCIGenAIEmbeddingsWithBatch
-
-# prompts
-from oracle_chat_prompts import CONTEXT_Q_PROMPT, QA_PROMPT
-
-from utils import print_configuration, check_value_in_list, load_configuration
+import re
+
+# light: heavy dependencies are imported only when needed
+from factory_vector_store import get_vector_store, get_search_kwargs
+
+# LangChain, OCI and Cohere modules are imported inside the functions,
+# so that importing this module is fast (see bench_import_time.py)
+from utils import (
+    print_configuration,
+    check_value_in_list,
+    load_configuration,
+    estimate_tokens,
+)
 
 from config_private import (
     COMPARTMENT_ID,
@@ -35,6 +28,9 @@ from config_private import (
 # configuratin is global
 config = load_configuration()
 
+# models already reported as missing in context_limits
+_models_without_limit = set()
+
 #
 # functions
 #
@@ -46,6 +42,8 @@ def get_embed_model(model_type="OCI"):
     """
     check_value_in_list(model_type, ["OCI"])
 
+    from oci_cohere_embeddings_utils import OCIGenAIEmbeddingsWithBatch
+
     embed_model = None
 
     if model_type == "OCI":
@@ -66,6 +64,11 @@ def get_llm(model_type="OCI", model_id="cohere.command-r-16k"):
     # we can use OCI
     check_value_in_list(model_type, ["OCI"])
 
+    # (4/07/2024) replaced with new OCI Models
+    from langchain_community.chat_models.oci_generative_ai import ChatOCIGenAI
+
+    from usage_accounting import get_usage_callback
+
     logger = logging.getLogger("ConsoleLogger")
 
     max_tokens = config["llm"]["max_tokens"]
@@ -87,18 +90,185 @@ def get_llm(model_type="OCI", model_id="cohere.command-r-16k"):
                 "max_tokens": max_tokens,
                 "temperature": temperature,
             },
+            # to count the tokens (usage_accounting)
+            callbacks=[get_usage_callback(model_id)],
         )
 
     return llm
 
 
+#
+# to fit the retrieved chunks in the context window
+#
+def get_context_limit(model_id):
+    """
+    the context window (tokens) of the model, from config
+    (default_context_limit if the model is not listed)
+    """
+    context_limits = config["llm"]["oci"]["context_limits"]
+
+    if model_id not in context_limits:
+        if model_id not in _models_without_limit:
+            _models_without_limit.add(model_id)
+
+            logging.getLogger("ConsoleLogger").warning(
+                "No context limit for %s, using %s tokens",
+                model_id,
+                config["context_packing"]["default_context_limit"],
+            )
+
+        return config["context_packing"]["default_context_limit"]
+
+    return context_limits[model_id]
+
+
+def get_context_budget(model_id, history, question):
+    """
+    num. of tokens available for the retrieved chunks:
+    context window - max_tokens - (prompt, history and question)
+    """
+    from oracle_chat_prompts import QA_SYSTEM_PROMPT
+
+    chars_per_token = config["context_packing"]["chars_per_token"]
+
+    context_limit = get_context_limit(model_id)
+    used = config["llm"]["max_tokens"] + config["context_packing"]["reserved_tokens"]
+
+    prompt_text = QA_SYSTEM_PROMPT + question
+    prompt_text += "".join(str(msg.content) for msg in history)
+    used += estimate_tokens(prompt_text, chars_per_token)
+
+    return context_limit - used
+
+
+def trim_to_best_sentences(doc, question, max_tokens):
+    """
+    keep the sentences of doc sharing more words with the question,
+    in their original order, within max_tokens
+    """
+    from langchain_core.documents import Document
+
+    chars_per_token = config["context_packing"]["chars_per_token"]
+
+    sentences = re.split(r"(?<=[.!?])\s+", doc.page_content)
+    q_words = set(re.findall(r"\w+", question.lower()))
+
+    overlaps = [len(q_words & set(re.findall(r"\w+", s.lower()))) for s in sentences]
+    ranked = sorted(range(len(sentences)), key=lambda i: -overlaps[i])
+
+    selected = []
+    used = 0
+    for i in ranked:
+        if overlaps[i] == 0:
+            break
+
+        n_tokens = estimate_tokens(sentences[i], chars_per_token)
+        if used + n_tokens <= max_tokens:
+            selected.append(i)
+            used += n_tokens
+
+    if not selected:
+        return None
+
+    text = " ".join(sentences[i] for i in sorted(selected))
+
+    return Document(page_content=text, metadata=doc.metadata)
+
+
+def pack_context(docs, budget, question):
+    """
+    add the docs, in rank order, while they fit in budget (tokens)
+    returns the packed docs and the num. of tokens used
+    """
+    chars_per_token = config["context_packing"]["chars_per_token"]
+    trim = config["context_packing"]["trim_to_sentences"]
+
+    packed = []
+    used = 0
+
+    for doc in docs:
+        n_tokens = estimate_tokens(doc.page_content, chars_per_token)
+
+        if used + n_tokens > budget:
+            if not trim:
+                continue
+
+            doc = trim_to_best_sentences(doc, question, budget - used)
+            if doc is None:
+                continue
+            n_tokens = estimate_tokens(doc.page_content, chars_per_token)
+
+        packed.append(doc)
+        used += n_tokens
+
+    return packed, used
+
+
+def get_context_packer(model_id):
+    """
+    returns a function to be used in the chain
+    to replace the retrieved docs with the packed ones
+    the docs are packed for answer_model in inputs (set by the router),
+    if there, otherwise for model_id
+    """
+    logger = logging.getLogger("ConsoleLogger")
+
+    def context_packer(inputs):
+        answer_model_id = inputs.get("answer_model", model_id)
+
+        history = inputs.get("chat_history", [])
+        budget = get_context_budget(answer_model_id, history, inputs["input"])
+
+        packed, context_tokens = pack_context(
+            inputs["context"], budget, inputs["input"]
+        )
+
+        # all the tokens in input to the LLM, excluding max_tokens
+        prompt_tokens = (
+            get_context_limit(answer_model_id)
+            - config["llm"]["max_tokens"]
+            - budget
+            + context_tokens
+        )
+        logger.info(
+            " Context packing: %s/%s chunks, prompt tokens (est.): %s",
+            len(packed),
+            len(inputs["context"]),
+            prompt_tokens,
+        )
+
+        return packed
+
+    return context_packer
+
+
 #
 # create the entire RAG chain
 #
-def build_rag_chain(verbose, model_id="cohere.command-r-16k"):
+def build_rag_chain(verbose, model_id="cohere.command-r-16k", filters=None):
     """
     Build the entire RAG chain
+    model_id: the LLM, or "auto" to choose it for every request ([routing])
+    filters: dict with metadata filters for retrieval
+        (tenant, source, date_from, date_to)
     """
+    # Cohere
+    from cohere_rerank_utils import CohereRerankWithUsage
+    from langchain.retrievers import ContextualCompressionRetriever
+
+    # to handle conversational memory
+    from langchain.chains import create_history_aware_retriever
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+    from fanout_retriever import MultiQueryFanOutRetriever
+    from model_router import AUTO_MODEL_ID, ModelRouter
+    from parent_store import map_to_parents
+    from speculative_retriever import SpeculativeHistoryAwareRetriever
+
+    # prompts
+    from oracle_chat_prompts import CONTEXT_Q_PROMPT, QA_PROMPT
+
     logger = logging.getLogger("ConsoleLogger")
 
     # print all the used configuration to the console
@@ -109,19 +279,44 @@ def build_rag_chain(verbose, model_id="cohere.command-r-16k"):
 
     embed_model = get_embed_model(config["embeddings"]["embed_model_type"])
 
+    store_type = config["vector_store"]["store_type"]
+    filters = filters or {}
+
     v_store = get_vector_store(
-        vector_store_type=config["vector_store"]["store_type"], embed_model=embed_model
+        vector_store_type=store_type,
+        embed_model=embed_model,
+        tenant=filters.get("tenant"),
+    )
+
+    # filters are applied during the search, not on the top_k results
+    search_kwargs = get_search_kwargs(
+        store_type, config["retriever"]["top_k"], filters
     )
 
-    # 10/05: I can add a filter here (for ex: to filter by profile_id)
-    base_retriever = v_store.as_retriever(k=config["retriever"]["top_k"])
+    if config["retriever"]["multi_query"]:
+        if verbose:
+            logger.info("Using multi-query retrieval...")
+
+        base_retriever = MultiQueryFanOutRetriever(
+            llm=get_llm(
+                model_type=config["llm"]["model_type"],
+                model_id=config["retriever"]["multi_query_model"],
+            ),
+            vector_store=v_store,
+            embed_model=embed_model,
+            n_queries=config["retriever"]["multi_query_n"],
+            k=search_kwargs.pop("k"),
+            search_kwargs=search_kwargs,
+        )
+    else:
+        base_retriever = v_store.as_retriever(search_kwargs=search_kwargs)
 
     # add the reranker
     if config["reranker"]["add_reranker"]:
         if verbose:
             logger.info("Adding a reranker...")
 
-        cohere_rerank = CohereRerank(
+        cohere_rerank = CohereRerankWithUsage(
             cohere_api_key=COHERE_API_KEY,
             top_n=config["retriever"]["top_n"],
             model=config["reranker"]["cohere_reranker_model"],
@@ -134,24 +329,85 @@ def build_rag_chain(verbose, model_id="cohere.command-r-16k"):
         # no reranker
         retriever = base_retriever
 
+    if config["text_splitting"]["small_to_big"]:
+        if verbose:
+            logger.info("Using small-to-big retrieval...")
+
+        # small chunks are matched (and reranked), parents go to the LLM
+        retriever = retriever | RunnableLambda(map_to_parents)
+
     # LS, 08/07 changed, llm can be chosen via UI
-    llm = get_llm(model_type=config["llm"]["model_type"], model_id=model_id)
+    # with "auto" the model for the answer is chosen for every request,
+    # the small model condenses the question
+    if model_id == AUTO_MODEL_ID:
+        llm = get_llm(
+            model_type=config["llm"]["model_type"],
+            model_id=config["routing"]["small_model"],
+        )
+    else:
+        llm = get_llm(model_type=config["llm"]["model_type"], model_id=model_id)
 
     # steps to add chat_history
     # 1. create a retriever using chat history
-    history_aware_retriever = create_history_aware_retriever(
-        llm, retriever, CONTEXT_Q_PROMPT
-    )
+    if config["retriever"]["speculative"]:
+        # retrieval with the question starts together with the condense step
+        history_aware_retriever = RunnableLambda(
+            SpeculativeHistoryAwareRetriever(
+                llm,
+                retriever,
+                embed_model,
+                CONTEXT_Q_PROMPT,
+                threshold=config["retriever"]["speculative_threshold"],
+            )
+        )
+    else:
+        history_aware_retriever = create_history_aware_retriever(
+            llm, retriever, CONTEXT_Q_PROMPT
+        )
 
     # 2. create the chain for answering
     # we need to use a different prompt from the one used to
     # condense the standalone question
 
     # be careful if english or italian
-    question_answer_chain = create_stuff_documents_chain(llm, QA_PROMPT)
+    def build_answer_chain(answer_model_id):
+        if answer_model_id == model_id:
+            answer_llm = llm
+        else:
+            answer_llm = get_llm(
+                model_type=config["llm"]["model_type"], model_id=answer_model_id
+            )
+
+        return create_stuff_documents_chain(answer_llm, QA_PROMPT)
+
+    # 3, the entire chain (as create_retrieval_chain, with the steps between
+    # retrieval and answer): context in the output is what the LLM receives
+    rag_chain = RunnablePassthrough.assign(
+        context=history_aware_retriever.with_config(run_name="retrieve_documents")
+    )
+
+    if model_id == AUTO_MODEL_ID:
+        if verbose:
+            logger.info("Using model routing...")
+
+        # the model is chosen on the retrieved docs, before packing
+        router = ModelRouter(build_answer_chain)
+        rag_chain = rag_chain | RunnablePassthrough.assign(
+            answer_model=RunnableLambda(router.route)
+        )
+        question_answer_chain = RunnableLambda(router)
+    else:
+        question_answer_chain = build_answer_chain(model_id)
+
+    if config["context_packing"]["enable"]:
+        # keep the prompt within the context window of the model
+        rag_chain = rag_chain | RunnablePassthrough.assign(
+            context=RunnableLambda(get_context_packer(model_id))
+        )
 
-    # 3, the entire chain
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    rag_chain = (
+        rag_chain | RunnablePassthrough.assign(answer=question_answer_chain)
+    ).with_config(run_name="retrieval_chain")
 
     # this returns sources and can be streamed
     return rag_chain
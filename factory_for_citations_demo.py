@@ -14,7 +14,7 @@ from langchain_community.embeddings import OCIGenAIEmbeddings
 
 from oci_command_r_oo import OCICommandR
 
-from utils import load_configuration
+from utils import load_configuration, read_preamble
 
 # private information
 from config_private import COMPARTMENT_ID, DB_USER, DB_PWD, DB_HOST_IP, DB_SERVICE
@@ -54,22 +54,35 @@ def get_embed_model():
     return embed_model
 
 
-def get_oracle_vs(embed_model):
+def get_oracle_vs(embed_model, pool=None):
     """
     create a connection and return oraclevs
+    pool: if given, searches take a connection from the pool
+    (to run them in parallel from several threads)
     """
     try:
         # we need to provide a connection as input to OracleVS
         connection = oracledb.connect(user=DB_USER, password=DB_PWD, dsn=DSN)
         logger.info("Connection successful!")
 
-        # get an instance of OracleVS
-        v_store = OracleVS(
-            client=connection,
-            table_name="DOE_DUBAI",
-            distance_strategy=DistanceStrategy.COSINE,
-            embedding_function=embed_model,
-        )
+        if pool is None:
+            # get an instance of OracleVS
+            v_store = OracleVS(
+                client=connection,
+                table_name="DOE_DUBAI",
+                distance_strategy=DistanceStrategy.COSINE,
+                embedding_function=embed_model,
+            )
+        else:
+            from oracle_vs_filters import OracleVSWithFilters
+
+            v_store = OracleVSWithFilters(
+                client=connection,
+                table_name="DOE_DUBAI",
+                distance_strategy=DistanceStrategy.COSINE,
+                embedding_function=embed_model,
+                pool=pool,
+            )
 
     except Exception as e:
         logger.error("Connection failed!")
@@ -88,7 +101,7 @@ def get_retriever(v_store):
     return retriever
 
 
-def get_chat_model():
+def get_chat_model(is_streaming=False):
     """
     build the chat Cohere client
     """
@@ -99,7 +112,8 @@ def get_chat_model():
         "temperature": 0.1,
         "max_tokens": 1024,
         # this one  seems good for italian
-        "preamble_override": "preamble02",
+        "preamble_override": read_preamble("preamble02"),
+        "is_streaming": is_streaming,
     }
     # this is a custom class that wraps OCI Python SDK
     chat = OCICommandR(**command_r_params)
@@ -107,15 +121,17 @@ def get_chat_model():
     return chat
 
 
-def do_query_and_answer(query):
+def get_documents_for_query(query, retriever=None):
     """
-    build the chain, process the query and return chat answer
+    do the semantic search and return the docs in the format for Cohere
+    retriever: if given, is reused (no new connection to the DB)
     """
-    embed_model = get_embed_model()
+    if retriever is None:
+        embed_model = get_embed_model()
 
-    v_store = get_oracle_vs(embed_model)
+        v_store = get_oracle_vs(embed_model)
 
-    retriever = get_retriever(v_store)
+        retriever = get_retriever(v_store)
 
     logger.info("Doing semantic search...")
 
@@ -139,7 +155,16 @@ def do_query_and_answer(query):
         for i, doc in enumerate(result_docs)
     ]
 
-    chat = get_chat_model()
+    return documents_txt
+
+
+def invoke_chat_model(query, documents_txt, is_streaming=False, chat=None):
+    """
+    call command-r with the documents as context
+    chat: if given, the client is reused
+    """
+    if chat is None:
+        chat = get_chat_model(is_streaming=is_streaming)
 
     logger.info("Invoking chat model...")
 
@@ -157,3 +182,24 @@ def do_query_and_answer(query):
     logger.info("Time for chat invoke: %s sec ...", time_elapsed)
 
     return response
+
+
+def do_query_and_answer(query):
+    """
+    build the chain, process the query and return chat answer
+    """
+    documents_txt = get_documents_for_query(query)
+
+    return invoke_chat_model(query, documents_txt)
+
+
+def do_query_and_stream(query):
+    """
+    as do_query_and_answer, but the response is streamed
+    returns also the documents, needed to complete streamed citations
+    """
+    documents_txt = get_documents_for_query(query)
+
+    response = invoke_chat_model(query, documents_txt, is_streaming=True)
+
+    return response, documents_txt
@@ -11,15 +11,12 @@ Python Version: 3.11
 """
 
 import logging
-import oracledb
-
-from langchain_community.vectorstores import OpenSearchVectorSearch
-from langchain_community.vectorstores.oraclevs import OracleVS
-from langchain_community.vectorstores.utils import DistanceStrategy
+import re
+import threading
 
+# LangChain vector stores and oracledb are imported only when needed
 from utils import check_value_in_list, load_configuration
 
-
 from config_private import (
     OPENSEARCH_USER,
     OPENSEARCH_PWD,
@@ -31,11 +28,239 @@ from config_private import (
 
 config = load_configuration()
 
+# to do the warmup of the OpenSearch index only once
+_warmup_done = False
+_warmup_lock = threading.Lock()
+
+# the pool of connections to the Oracle DB, created when first needed
+_oracle_pool = None
+_oracle_pool_lock = threading.Lock()
+
+# supported metadata filters
+FILTER_KEYS = ["tenant", "source", "date_from", "date_to"]
+
+# a tenant is part of a table name (23AI): only these chars are allowed
+TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_]{1,30}$")
+
+
+def get_oracle_connection():
+    """
+    a new connection to the Oracle DB
+    """
+    import oracledb
+
+    dsn = f"{DB_HOST_IP}:1521/{DB_SERVICE}"
+
+    return oracledb.connect(user=DB_USER, password=DB_PWD, dsn=dsn)
+
+
+def get_oracle_pool():
+    """
+    the pool of connections to the Oracle DB, shared in the process
+    (python-oracledb serializes the calls done on a single connection)
+    """
+    global _oracle_pool
+
+    with _oracle_pool_lock:
+        if _oracle_pool is None:
+            import oracledb
+
+            _oracle_pool = oracledb.create_pool(
+                user=DB_USER,
+                password=DB_PWD,
+                dsn=f"{DB_HOST_IP}:1521/{DB_SERVICE}",
+                min=1,
+                max=config["vector_store"]["23ai"]["pool_max"],
+                increment=1,
+            )
+
+    return _oracle_pool
+
+
+def check_tenant(tenant):
+    """
+    raise ValueError if tenant can't be used in a table name
+    """
+    if not isinstance(tenant, str) or not TENANT_PATTERN.match(tenant):
+        raise ValueError(f"Invalid tenant: {tenant!r}")
+
+
+def get_collection_name(tenant=None, collection_name=None):
+    """
+    in 23AI every tenant has its own table (partition)
+    the name is used in SQL, so the tenant is checked
+    collection_name: if not given, the one in config
+    """
+    if collection_name is None:
+        collection_name = config["vector_store"]["collection_name"]
+
+    if tenant:
+        check_tenant(tenant)
+        collection_name = f"{collection_name}_{tenant}".upper()
+
+    return collection_name
+
+
+def get_opensearch_params():
+    """
+    the params for OpenSearchVectorSearch, from config
+    """
+    os_config = config["vector_store"]["opensearch"]
+
+    return {
+        "opensearch_url": os_config["opensearch_url"],
+        "use_ssl": os_config["use_ssl"],
+        "verify_certs": os_config["verify_certs"],
+        "ssl_assert_hostname": os_config["ssl_assert_hostname"],
+        "ssl_show_warn": os_config["ssl_show_warn"],
+        "bulk_size": int(os_config["bulk_size"]),
+        "index_name": os_config["index_name"],
+        "engine": os_config["engine"],
+    }
+
+
+def get_ann_params():
+    """
+    the HNSW params for the OpenSearch index, from config
+    (used by OpenSearchVectorSearch when the index is created)
+    """
+    os_config = config["vector_store"]["opensearch"]
+
+    return {
+        "space_type": os_config["space_type"],
+        "m": int(os_config["m"]),
+        "ef_construction": int(os_config["ef_construction"]),
+        "ef_search": int(os_config["ef_search"]),
+    }
+
+
+def warmup_opensearch():
+    """
+    load the k-NN graphs in memory, so that first queries are not slow
+    done only once per process, in a background thread
+    (the caller, for ex. the UI building the chain, doesn't wait)
+    """
+    global _warmup_done
+
+    if not config["vector_store"]["opensearch"]["warmup_on_startup"]:
+        return
+
+    with _warmup_lock:
+        if _warmup_done:
+            return
+
+        _warmup_done = True
+
+    threading.Thread(target=_do_warmup, daemon=True).start()
+
+
+def _do_warmup():
+    from opensearch_bulk_utils import get_opensearch_client, warmup_index
+
+    logger = logging.getLogger("ConsoleLogger")
+
+    try:
+        index_name = config["vector_store"]["opensearch"]["index_name"]
+        warmup_index(get_opensearch_client(), index_name)
+        logger.info("Warmup of index %s done.", index_name)
+    except Exception as e:
+        logger.error("Error in warmup of OpenSearch index: %s", e)
+
+
+def add_method_parameters(body, method_parameters):
+    """
+    add method_parameters to every k-NN clause in the query body
+    """
+    if isinstance(body, dict):
+        for key, value in body.items():
+            if key == "knn" and isinstance(value, dict):
+                for field_query in value.values():
+                    field_query.setdefault("method_parameters", {}).update(
+                        method_parameters
+                    )
+            else:
+                add_method_parameters(value, method_parameters)
+
+    # lists of clauses, not vectors
+    elif isinstance(body, list) and body and isinstance(body[0], dict):
+        for item in body:
+            add_method_parameters(item, method_parameters)
 
-def get_vector_store(vector_store_type, embed_model):
+
+class KnnParamsClient:
+    """
+    wraps the OpenSearch client of OpenSearchVectorSearch: the k-NN queries
+    are sent with method_parameters (ef_search from config), so that the
+    value in config is used also with an existing index
+    (OpenSearch >= 2.16); other calls go to the client
+    """
+
+    def __init__(self, client, method_parameters):
+        self.client = client
+        self.method_parameters = method_parameters
+
+    def search(self, *args, body=None, **kwargs):
+        if body is not None:
+            add_method_parameters(body, self.method_parameters)
+
+        return self.client.search(*args, body=body, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def get_search_kwargs(vector_store_type, k, filters=None):
+    """
+    build the search_kwargs for as_retriever
+
+    filters: dict with (optional) tenant, source, date_from, date_to
+    dates are ISO strings (YYYY-MM-DD), compared to metadata ingest_date
+    """
+    search_kwargs = {"k": k}
+
+    if not filters:
+        return search_kwargs
+
+    for key in filters:
+        check_value_in_list(key, FILTER_KEYS)
+
+    if vector_store_type == "OPENSEARCH":
+        # efficient filtering: the filter is applied during the k-NN search
+        conditions = []
+
+        for key in ["tenant", "source"]:
+            if key in filters:
+                conditions.append({"term": {f"metadata.{key}.keyword": filters[key]}})
+
+        date_range = {}
+        if "date_from" in filters:
+            date_range["gte"] = filters["date_from"]
+        if "date_to" in filters:
+            date_range["lte"] = filters["date_to"]
+        if date_range:
+            conditions.append({"range": {"metadata.ingest_date": date_range}})
+
+        search_kwargs["efficient_filter"] = {"bool": {"filter": conditions}}
+
+    elif vector_store_type == "23AI":
+        # the tenant is handled choosing the table (see get_vector_store)
+        oracle_filter = {k: v for k, v in filters.items() if k != "tenant"}
+
+        if oracle_filter:
+            search_kwargs["filter"] = oracle_filter
+
+    return search_kwargs
+
+
+def get_vector_store(
+    vector_store_type, embed_model, tenant=None, collection_name=None
+):
     """
     vector_store_type: can be OPENSEARCH or 23AI
     embed_model an object wrapping the model used for embedings
+    tenant: in 23AI, to search only in the table of the tenant
+    collection_name: the table (23AI) or the index (OPENSEARCH),
+        if not the one in config
     return a Vector Store Object
     """
 
@@ -46,39 +271,45 @@ def get_vector_store(vector_store_type, embed_model):
     v_store = None
 
     if vector_store_type == "OPENSEARCH":
+        from langchain_community.vectorstores import OpenSearchVectorSearch
+
         # this assumes that there is an OpenSearch cluster available
         # or docker, at the specified URL
 
-        OPENSEARCH_PARAMS = {
-            "opensearch_url": config["vector_store"]["opensearch"]["opensearch_url"],
-            "use_ssl": config["vector_store"]["opensearch"]["use_ssl"],
-            "verify_certs": config["vector_store"]["opensearch"]["verify_certs"],
-            "ssl_assert_hostname": config["vector_store"]["opensearch"][
-                "ssl_assert_hostname"
-            ],
-            "ssl_show_warn": config["vector_store"]["opensearch"]["ssl_show_warn"],
-            "bulk_size": int(config["vector_store"]["opensearch"]["bulk_size"]),
-            "index_name": config["vector_store"]["opensearch"]["index_name"],
-            "engine": config["vector_store"]["opensearch"]["engine"],
-        }
+        opensearch_params = get_opensearch_params()
+        if collection_name is not None:
+            opensearch_params["index_name"] = collection_name
 
         v_store = OpenSearchVectorSearch(
             embedding_function=embed_model,
             http_auth=(OPENSEARCH_USER, OPENSEARCH_PWD),
-            **OPENSEARCH_PARAMS,
+            **opensearch_params,
         )
 
+        # ef_search of the index is fixed when it is created
+        if config["vector_store"]["opensearch"]["query_ef_search"]:
+            v_store.client = KnnParamsClient(
+                v_store.client, {"ef_search": get_ann_params()["ef_search"]}
+            )
+
+        warmup_opensearch()
+
     elif vector_store_type == "23AI":
-        dsn = f"{DB_HOST_IP}:1521/{DB_SERVICE}"
+        import oracledb
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        from oracle_vs_filters import OracleVSWithFilters
 
         try:
-            connection = oracledb.connect(user=DB_USER, password=DB_PWD, dsn=dsn)
+            connection = get_oracle_connection()
 
-            v_store = OracleVS(
+            # searches take a connection from the pool: the parallel ones
+            # (multi-query, speculative, batch) are not serialized
+            v_store = OracleVSWithFilters(
                 client=connection,
-                table_name=config["vector_store"]["collection_name"],
+                table_name=get_collection_name(tenant, collection_name),
                 distance_strategy=DistanceStrategy.COSINE,
                 embedding_function=embed_model,
+                pool=get_oracle_pool(),
             )
         except oracledb.Error as e:
             err_msg = "An error occurred in get_vector_store: " + str(e)
@@ -0,0 +1,126 @@
+"""
+Multi-query retrieval
+
+With a single LLM call we generate N variants of the question,
+we embed them (with the question) in a single batch and run
+the vector searches in parallel. Results are fused with
+Reciprocal Rank Fusion and deduplicated, before the reranker.
+So the latency is close to that of a single search.
+
+Python Version: 3.11
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from oracle_chat_prompts import MULTI_QUERY_PROMPT
+
+# the constant of Reciprocal Rank Fusion
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(results_lists, top_k):
+    """
+    fuse lists of docs (each ordered by relevance) removing duplicates
+    returns the first top_k docs
+    """
+    scores = {}
+    docs_by_key = {}
+
+    for results in results_lists:
+        for rank, doc in enumerate(results):
+            key = (
+                doc.metadata.get("source"),
+                doc.metadata.get("page"),
+                doc.page_content,
+            )
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs_by_key.setdefault(key, doc)
+
+    ranked_keys = sorted(scores, key=scores.get, reverse=True)
+
+    return [docs_by_key[key] for key in ranked_keys[:top_k]]
+
+
+class MultiQueryFanOutRetriever(BaseRetriever):
+    """
+    Retriever doing N searches in parallel with variants of the question
+
+    Usage:
+        retriever = MultiQueryFanOutRetriever(
+            llm=llm, vector_store=v_store, embed_model=embed_model,
+            n_queries=3, k=8
+        )
+    """
+
+    llm: Any
+    """the LLM used to generate the variants"""
+    vector_store: Any
+    embed_model: Any
+    n_queries: int = 3
+    """num. of variants, in addition to the question"""
+    k: int = 8
+    """num. of docs for every search, and returned"""
+    search_kwargs: dict = {}
+    """other params for the search (for ex: filters)"""
+
+    def generate_queries(self, question):
+        """
+        one LLM call to get the variants of the question
+        """
+        logger = logging.getLogger("ConsoleLogger")
+
+        messages = MULTI_QUERY_PROMPT.format_messages(
+            input=question, n_queries=self.n_queries
+        )
+
+        try:
+            output = self.llm.invoke(messages).content
+        except Exception as e:
+            # we can still search with the question
+            logger.error("Error generating query variants: %s", e)
+            return []
+
+        variants = [line.strip() for line in output.split("\n") if line.strip()]
+
+        return variants[: self.n_queries]
+
+    def _search(self, vector):
+        time_start = time()
+
+        docs = self.vector_store.similarity_search_by_vector(
+            vector, k=self.k, **self.search_kwargs
+        )
+
+        return docs, time() - time_start
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        queries = [query] + self.generate_queries(query)
+
+        # a single call for all the embeddings
+        vectors = self.embed_model.embed_documents(queries)
+
+        time_start = time()
+
+        with ThreadPoolExecutor(max_workers=len(vectors)) as executor:
+            results = list(executor.map(self._search, vectors))
+
+        # if the searches are really parallel, elapsed is close to the longest
+        # (with a single DB connection it would be close to the sum)
+        elapsed = time() - time_start
+        logging.getLogger("ConsoleLogger").info(
+            " Multi-query: %s searches in %s ms (sum of searches: %s ms)",
+            len(results),
+            round(elapsed * 1000),
+            round(sum(search_time for _, search_time in results) * 1000),
+        )
+
+        return reciprocal_rank_fusion([docs for docs, _ in results], self.k)
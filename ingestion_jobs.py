@@ -0,0 +1,185 @@
+"""
+Background loading of files in the Vector Store
+
+Files are identified by the hash of their content (and the tenant):
+a file already loaded (or in progress) is skipped,
+even if uploaded again or with another name.
+All the files submitted together are embedded in shared batches.
+
+Python Version: 3.11
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from usage_accounting import usage_scope
+from utils import get_console_logger, load_configuration
+
+config = load_configuration()
+
+# job status
+QUEUED = "queued"
+PARSING = "parsing"
+INDEXING = "indexing"
+DONE = "done"
+ERROR = "error"
+
+
+def content_hash(content: bytes, tenant=None) -> str:
+    """
+    the key of a file (the same file can be loaded for several tenants)
+    """
+    key = hashlib.sha256(content).hexdigest()
+
+    if tenant:
+        key = f"{tenant}:{key}"
+
+    return key
+
+
+class IngestionQueue:
+    """
+    Queue of jobs to load files in the Vector Store, in background
+
+    Usage:
+        queue = IngestionQueue()
+        queue.submit([(file_name, content), ...], tenant=None)
+        queue.get_jobs()
+    """
+
+    def __init__(self, n_workers=None, registry_file=None):
+        if n_workers is None:
+            n_workers = config["ingestion"]["n_workers"]
+        if registry_file is None:
+            registry_file = config["ingestion"]["registry_file"]
+
+        self.registry_file = registry_file
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+        self.lock = threading.Lock()
+        self.logger = get_console_logger()
+
+        # file hash -> job info (for this process)
+        self.jobs = {}
+        # file hash -> name, for the files already in the Vector Store
+        self.registry = self._read_registry()
+
+    def _read_registry(self):
+        if os.path.exists(self.registry_file):
+            with open(self.registry_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _save_registry(self):
+        with open(self.registry_file, "w", encoding="utf-8") as f:
+            json.dump(self.registry, f, indent=2)
+
+    def submit(self, files, tenant=None):
+        """
+        files: list of (file_name, content)
+        tenant: if given, files are loaded for the tenant (in 23AI its table)
+        returns the list of file names accepted (not duplicates)
+        """
+        from factory_vector_store import check_tenant
+
+        if tenant:
+            # before queuing: an invalid tenant is reported to the caller
+            check_tenant(tenant)
+
+        new_files = []
+
+        with self.lock:
+            for file_name, content in files:
+                key = content_hash(content, tenant)
+
+                # files stay in the uploader, so a file with errors is not
+                # retried on every rerun (it is, after a restart)
+                if key in self.registry or key in self.jobs:
+                    continue
+
+                self.jobs[key] = {
+                    "name": file_name,
+                    "status": QUEUED,
+                    "progress": 0.0,
+                    "error": None,
+                }
+                new_files.append((key, file_name, content))
+
+        if new_files:
+            self.executor.submit(self._run, new_files, tenant)
+
+        return [file_name for _, file_name, _ in new_files]
+
+    def get_jobs(self):
+        """
+        a copy of the jobs info, to display progress
+        """
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def has_running_jobs(self):
+        """
+        True if some job is not finished
+        """
+        return any(job["status"] not in (DONE, ERROR) for job in self.get_jobs())
+
+    def _update(self, keys, **kwargs):
+        with self.lock:
+            for key in keys:
+                self.jobs[key].update(kwargs)
+
+    def _run(self, new_files, tenant=None):
+        """
+        parse all the files, then embed and index all the chunks together
+        """
+        # imported here, so the UI doesn't pay for them until a file is loaded
+        from factory import get_embed_model
+        from chunk_index_utils import load_book_and_split, add_docs_to_store
+
+        keys = [key for key, _, _ in new_files]
+        time_start = time()
+
+        try:
+            # embeddings are counted for the job (file hashes)
+            with usage_scope("ingestion", ",".join(keys)):
+                docs = []
+
+                with tempfile.TemporaryDirectory() as tmp_dir_name:
+                    for key, file_name, content in new_files:
+                        self._update([key], status=PARSING)
+
+                        temp_file_path = os.path.join(tmp_dir_name, file_name)
+                        with open(temp_file_path, "wb") as f:
+                            f.write(content)
+
+                        docs += load_book_and_split(temp_file_path, tenant)
+
+                        self._update([key], progress=0.5)
+
+                self._update(keys, status=INDEXING)
+
+                embed_model = get_embed_model(config["embeddings"]["embed_model_type"])
+                add_docs_to_store(docs, embed_model, tenant=tenant)
+
+        except Exception as e:
+            self.logger.error("Error loading files: %s", e)
+            self._update(keys, status=ERROR, error=str(e))
+            return
+
+        with self.lock:
+            for key, file_name, _ in new_files:
+                self.registry[key] = file_name
+                self.jobs[key].update(status=DONE, progress=1.0)
+
+            self._save_registry()
+
+        self.logger.info(
+            "Loaded %s files, %s chunks in %s sec.",
+            len(new_files),
+            len(docs),
+            round(time() - time_start, 1),
+        )
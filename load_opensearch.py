@@ -7,12 +7,25 @@ Python Version: 3.11
 Usage:
     With this code you can load the initial content inside 
     the OpenSearch based Vector Store
+
+    python load_opensearch.py [--bulk]
+
+    --bulk: for large initial loads, uses parallel bulk requests
+            (see opensearch_bulk_utils)
 """
 
+import argparse
+
 from langchain_community.vectorstores import OpenSearchVectorSearch
 
 from factory import get_embed_model
-from chunk_index_utils import load_books_and_split
+from factory_vector_store import (
+    get_opensearch_params,
+    get_ann_params,
+    get_vector_store,
+)
+from chunk_index_utils import load_books_and_split, make_child_chunks
+from opensearch_bulk_utils import bulk_load_opensearch
 from utils import get_console_logger, load_configuration
 
 from config_private import OPENSEARCH_USER, OPENSEARCH_PWD
@@ -21,31 +34,35 @@ logger = get_console_logger()
 
 config = load_configuration()
 
+parser = argparse.ArgumentParser(description="Load books in OpenSearch.")
+parser.add_argument("--bulk", action="store_true", help="Use the bulk load mode")
+
+args = parser.parse_args()
+
 # load all the books in BOOKS_DIR
 books_dir = config["text_splitting"]["books_dir"]
 
 docs = load_books_and_split(books_dir)
 
+# only the small chunks are embedded
+if config["text_splitting"]["small_to_big"]:
+    docs = make_child_chunks(docs)
+
 embed_model = get_embed_model(model_type="OCI")
 
-OPENSEARCH_PARAMS = {
-    "opensearch_url": config["vector_store"]["opensearch"]["opensearch_url"],
-    "use_ssl": config["vector_store"]["opensearch"]["use_ssl"],
-    "verify_certs": config["vector_store"]["opensearch"]["verify_certs"],
-    "ssl_assert_hostname": config["vector_store"]["opensearch"]["ssl_assert_hostname"],
-    "ssl_show_warn": config["vector_store"]["opensearch"]["ssl_show_warn"],
-    "bulk_size": int(config["vector_store"]["opensearch"]["bulk_size"]),
-    "index_name": config["vector_store"]["opensearch"]["index_name"],
-    "engine": config["vector_store"]["opensearch"]["engine"],
-}
-
-# load text and embeddings in OpenSearch
-docsearch = OpenSearchVectorSearch.from_documents(
-    docs,
-    embedding=embed_model,
-    http_auth=(OPENSEARCH_USER, OPENSEARCH_PWD),
-    **OPENSEARCH_PARAMS
-)
+if args.bulk:
+    bulk_load_opensearch(docs, embed_model)
+
+    docsearch = get_vector_store("OPENSEARCH", embed_model)
+else:
+    # load text and embeddings in OpenSearch
+    docsearch = OpenSearchVectorSearch.from_documents(
+        docs,
+        embedding=embed_model,
+        http_auth=(OPENSEARCH_USER, OPENSEARCH_PWD),
+        **get_opensearch_params(),
+        **get_ann_params()
+    )
 
 # Do a test
 QUERY = "La metformina può essere usata per curare il diabete di tipo 2 nei pazienti anziani?"
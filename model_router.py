@@ -0,0 +1,201 @@
+"""
+Routing of the requests between LLMs
+
+With model_id = "auto" the model used for the answer is chosen for every
+request, from features that are cheap to compute:
+    * length of the question
+    * size of the retrieved context (estimated tokens)
+    * if there is a chat history
+simple requests go to the small model, the others to the large model.
+The policy is in the [routing] section of config.toml.
+
+The estimated savings (cost and latency) against a fixed model
+(baseline_model) are logged after every request.
+
+Python Version: 3.11
+"""
+
+import logging
+import threading
+
+from utils import estimate_tokens, load_configuration
+
+config = load_configuration()
+
+# the model_id that enables the routing
+AUTO_MODEL_ID = "auto"
+
+
+def get_routing_features(inputs, chars_per_token):
+    """
+    the features used to choose the model
+    inputs: the input of the answer chain (input, chat_history, context)
+    """
+    context_text = "".join(doc.page_content for doc in inputs.get("context", []))
+
+    return {
+        "question_chars": len(inputs["input"]),
+        "context_tokens": estimate_tokens(context_text, chars_per_token),
+        "has_history": len(inputs.get("chat_history", [])) > 0,
+    }
+
+
+class RoutingStats:
+    """
+    requests per model and estimated savings against the baseline model
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.n_requests = {}
+        # measured latency (sum, sec.) per model
+        self.latency = {}
+        self.cost = 0.0
+        self.baseline_cost = 0.0
+        self.latency_saved = 0.0
+
+    def get_expected_latency(self, model_id):
+        """
+        the mean measured latency, or the one in config if not measured
+        """
+        n_requests = self.n_requests.get(model_id, 0)
+
+        if n_requests > 0:
+            return self.latency[model_id] / n_requests
+
+        return config["routing"]["expected_latency_sec"][model_id]
+
+    def record(self, model_id, latency, n_tokens):
+        """
+        record a request answered by model_id
+        n_tokens: the estimated tokens (prompt + answer)
+        """
+        routing_config = config["routing"]
+        baseline_model = routing_config["baseline_model"]
+        prices = routing_config["cost_per_1k_tokens"]
+
+        with self.lock:
+            # before adding the request, if model_id is the baseline
+            self.latency_saved += self.get_expected_latency(baseline_model) - latency
+
+            self.n_requests[model_id] = self.n_requests.get(model_id, 0) + 1
+            self.latency[model_id] = self.latency.get(model_id, 0.0) + latency
+
+            self.cost += n_tokens * prices[model_id] / 1000.0
+            self.baseline_cost += n_tokens * prices[baseline_model] / 1000.0
+
+    def log_summary(self):
+        """
+        print the stats on the console
+        """
+        logger = logging.getLogger("ConsoleLogger")
+
+        with self.lock:
+            if self.baseline_cost == 0:
+                return
+
+            logger.info(
+                " Routing: %s, est. cost saved vs %s: %s perc., "
+                "est. latency saved: %s sec.",
+                self.n_requests,
+                config["routing"]["baseline_model"],
+                round((1 - self.cost / self.baseline_cost) * 100.0, 1),
+                round(self.latency_saved, 2),
+            )
+
+
+class ModelRouter:
+    """
+    Chooses, for every request, the answer chain of the small or large model
+
+    Usage:
+        router = ModelRouter(build_answer_chain)
+        RunnableLambda(router)
+    or, to know the model before the answer step (for ex. to pack context):
+        RunnablePassthrough.assign(answer_model=RunnableLambda(router.route))
+        | RunnablePassthrough.assign(answer=RunnableLambda(router))
+
+    build_answer_chain(model_id) returns the chain answering with model_id
+    (input, chat_history, context -> answer), created on first use
+    """
+
+    def __init__(self, build_answer_chain):
+        self.build_answer_chain = build_answer_chain
+        self.answer_chains = {}
+        self.lock = threading.Lock()
+
+        self.stats = RoutingStats()
+
+    def select_model(self, features):
+        """
+        the large model if any threshold is exceeded, otherwise the small one
+        """
+        routing_config = config["routing"]
+
+        use_large = (
+            features["question_chars"] > routing_config["max_question_chars"]
+            or features["context_tokens"] > routing_config["max_context_tokens"]
+            or (features["has_history"] and routing_config["large_on_history"])
+        )
+
+        if use_large:
+            return routing_config["large_model"]
+
+        return routing_config["small_model"]
+
+    def get_answer_chain(self, model_id):
+        """
+        the answer chain for model_id, created only once
+        """
+        with self.lock:
+            if model_id not in self.answer_chains:
+                self.answer_chains[model_id] = self.build_answer_chain(model_id)
+
+            return self.answer_chains[model_id]
+
+    def route(self, inputs):
+        """
+        the model_id for the request (input, chat_history, context)
+        """
+        features = get_routing_features(
+            inputs, config["context_packing"]["chars_per_token"]
+        )
+
+        return self._route_features(features)
+
+    def _route_features(self, features):
+        model_id = self.select_model(features)
+
+        logging.getLogger("ConsoleLogger").info(
+            " Routing to %s, features: %s", model_id, features
+        )
+
+        return model_id
+
+    def __call__(self, inputs):
+        """
+        returns the chain to use: it is invoked (or streamed) by LangChain
+        the model is answer_model in inputs if already chosen with route
+        (for ex. before context packing), otherwise it is chosen here
+        """
+        chars_per_token = config["context_packing"]["chars_per_token"]
+
+        features = get_routing_features(inputs, chars_per_token)
+        model_id = inputs.get("answer_model") or self._route_features(features)
+
+        # prompt tokens, without the template
+        prompt_tokens = features["context_tokens"] + estimate_tokens(
+            inputs["input"]
+            + "".join(str(msg.content) for msg in inputs.get("chat_history", [])),
+            chars_per_token,
+        )
+
+        def on_end(run):
+            latency = (run.end_time - run.start_time).total_seconds()
+            answer_tokens = estimate_tokens(str(run.outputs), chars_per_token)
+
+            self.stats.record(model_id, latency, prompt_tokens + answer_tokens)
+            self.stats.log_summary()
+
+        # on_end is called also when the answer is streamed
+        return self.get_answer_chain(model_id).with_listeners(on_end=on_end)
@@ -4,6 +4,11 @@ oci_chat_utils
 Code common to oci_command_r_oo and oci_llama3_oo
 """
 
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
 import oci
 from oci.generative_ai_inference import GenerativeAiInferenceClient
 from oci.retry import NoneRetryStrategy
@@ -49,3 +54,144 @@ def get_generative_ai_dp_client(endpoint, profile, use_session_token):
         )
 
     return client
+
+
+#
+# Streaming
+#
+# format of the streamed events
+COHERE = "COHERE"
+GENERIC = "GENERIC"
+
+
+@dataclass
+class StreamChunk:
+    """
+    a piece of a streamed answer, the same for Cohere and generic models
+    """
+
+    text: str = ""
+    """the new text (not the text so far)"""
+    citations: List[dict] = field(default_factory=list)
+    """citations, as in the event (only Cohere)"""
+    finish_reason: Optional[str] = None
+    """set in the last chunk"""
+
+
+def decode_event(data: str, api_format: str) -> StreamChunk:
+    """
+    translate the data of an event in a StreamChunk
+
+    Cohere: {"text": ...}, {"citations": [...]}, the last event
+        repeats the entire text with finishReason and can have citations
+        not sent before
+    generic: {"message": {"content": [{"text": ...}]}}, then finishReason
+    """
+    res = json.loads(data)
+    finish_reason = res.get("finishReason")
+    citations = res.get("citations") or []
+
+    if api_format == COHERE:
+        # the last event repeats the whole text: only citations are returned
+        if finish_reason:
+            return StreamChunk(citations=citations, finish_reason=finish_reason)
+
+        return StreamChunk(text=res.get("text", ""), citations=citations)
+
+    text = ""
+    if "message" in res:
+        text = "".join(item.get("text", "") for item in res["message"]["content"])
+
+    return StreamChunk(text=text, finish_reason=finish_reason)
+
+
+def _citation_key(citation: dict) -> tuple:
+    """
+    identifies a citation in a stream
+    """
+    return citation.get("start"), citation.get("end"), citation.get("text")
+
+
+class ChatStream:
+    """
+    Iterates over the events of a streamed response (is_stream = True)
+    as StreamChunk, until the last one
+
+    The stream can be cancelled (for ex. if the user leaves the page):
+    the HTTP connection is closed and the generation stops.
+    Cancel with cancel() (from any thread), with cancel_event or
+    closing the iterator (for ex. break in the for loop).
+
+    If the response has on_stream_end (set by the client, for ex. to
+    count the tokens), it is called with the text generated, when the
+    stream ends or is cancelled.
+
+    Usage:
+        for chunk in ChatStream(response, GENERIC):
+            print(chunk.text, end="")
+    """
+
+    def __init__(self, response, api_format, cancel_event=None):
+        """
+        response: the response of client.chat
+        api_format: COHERE or GENERIC
+        cancel_event: optional threading.Event, checked on every event
+        """
+        self.response = response
+        self.api_format = api_format
+        self.cancel_event = cancel_event or threading.Event()
+        self.closed = False
+
+    def cancel(self):
+        """
+        stop the stream, the pending read is interrupted
+        """
+        self.cancel_event.set()
+        self.close()
+
+    def close(self):
+        """
+        close the HTTP connection, if not already done
+        """
+        if not self.closed:
+            self.closed = True
+            self.response.data.close()
+
+    def __iter__(self) -> Iterator[StreamChunk]:
+        seen_citations = set()
+        texts = []
+
+        try:
+            for event in self.response.data.events():
+                if self.cancel_event.is_set():
+                    break
+
+                # keep-alive or empty events
+                if not event.data:
+                    continue
+
+                chunk = decode_event(event.data, self.api_format)
+
+                # the last event can repeat citations already returned
+                chunk.citations = [
+                    citation
+                    for citation in chunk.citations
+                    if _citation_key(citation) not in seen_citations
+                ]
+                seen_citations.update(map(_citation_key, chunk.citations))
+
+                texts.append(chunk.text)
+                yield chunk
+
+                if chunk.finish_reason:
+                    break
+        except Exception:
+            # a read on a closed connection fails: expected if cancelled
+            if not self.cancel_event.is_set():
+                raise
+        finally:
+            self.close()
+
+            on_stream_end = getattr(self.response, "on_stream_end", None)
+            if on_stream_end is not None:
+                on_stream_end("".join(texts))
@@ -9,6 +9,11 @@ last update: 07/06/2024
 # Extract start, end, and document_ids
 from oci.response import Response
 
+from oci_chat_utils import ChatStream, COHERE
+
+HIGHLIGHT_START = '<span style="background-color: green;">'
+HIGHLIGHT_END = "</span>"
+
 
 def extract_document_list(response: Response):
     """
@@ -30,6 +35,14 @@ def extract_document_list(response: Response):
     return sorted_docs
 
 
+def build_document_index(documents: list) -> dict:
+    """
+    index documents by id, to resolve citations with a single lookup
+    documents: list of dict with (at least) id, source, page
+    """
+    return {doc["id"]: doc for doc in documents}
+
+
 def extract_citations_from_response(response: Response):
     """
     This function extract form the Cohere response
@@ -54,7 +67,15 @@ def extract_citations_from_response(response: Response):
 def find_source_page_by_id(data: dict, search_id) -> tuple:
     """
     find source page of a document from the id
+    data: can be the list of docs or the index built with build_document_index
     """
+    if isinstance(data, dict):
+        item = data.get(search_id)
+
+        if item is not None:
+            return item["source"], item["page"]
+        return None, None
+
     for item in data:
         if item["id"] == search_id:
             return item["source"], item["page"]
@@ -62,6 +83,22 @@ def find_source_page_by_id(data: dict, search_id) -> tuple:
     return None, None
 
 
+def complete_citation(citation: dict, doc_index: dict) -> dict:
+    """
+    complete a single citation with source, page of the cited documents
+    """
+    documents = []
+    for doc_id in citation["document_ids"]:
+        source, page = find_source_page_by_id(doc_index, doc_id)
+        documents.append({"id": doc_id, "source": source, "page": page})
+
+    return {
+        "interval": (citation["start"], citation["end"]),
+        "text": citation["text"],
+        "documents": documents,
+    }
+
+
 # this functions complete citations with source (name of doc) and page
 
 
@@ -70,23 +107,86 @@ def extract_complete_citations(response: Response) -> list:
     This function extract from the Cohere response
     documents and citations and complete citations with source, page
     """
-    extracted_doc = extract_document_list(response)
+    doc_index = build_document_index(extract_document_list(response))
     extracted_citations = extract_citations_from_response(response)
 
-    complete_citations = []
-    for citation in extracted_citations:
-        document_ids = citation["document_ids"]
+    return [complete_citation(citation, doc_index) for citation in extracted_citations]
 
-        documents = []
-        for doc_id in document_ids:
-            source, page = find_source_page_by_id(extracted_doc, doc_id)
-            documents.append({"id": doc_id, "source": source, "page": page})
 
-        new_citation = {
-            "interval": (citation["start"], citation["end"]),
-            "text": citation["text"],
-            "documents": documents,
-        }
-        complete_citations.append(new_citation)
+def render_highlights(text: str, citations: list) -> str:
+    """
+    Highlight all the cited spans in text, adding the list of doc ids
+    in square brackets, building the output in a single pass
 
-    return complete_citations
+    citations: list of complete citations (see extract_complete_citations)
+    overlapping citations are skipped (Cohere doesn't produce them)
+    """
+    pieces = []
+    cursor = 0
+
+    for citation in sorted(citations, key=lambda x: x["interval"][0]):
+        start, end = citation["interval"]
+
+        # spans not (yet) contained in text or overlapping the previous one
+        if start < cursor or end > len(text):
+            continue
+
+        doc_ids = [doc["id"] for doc in citation["documents"]]
+
+        pieces.append(text[cursor:start])
+        pieces.append(HIGHLIGHT_START)
+        pieces.append(text[start:end])
+        pieces.append(HIGHLIGHT_END)
+        pieces.append(f' [{", ".join(doc_ids)}]')
+
+        cursor = end
+
+    pieces.append(text[cursor:])
+
+    return "".join(pieces)
+
+
+def _normalize_streamed_citation(item: dict) -> dict:
+    """
+    streamed events use camelCase, align with the SDK objects
+    """
+    return {
+        "start": item["start"],
+        "end": item["end"],
+        "text": item["text"],
+        "document_ids": item.get("documentIds", item.get("document_ids", [])),
+    }
+
+
+def stream_citations(response: Response, documents: list, cancel_event=None):
+    """
+    Consume the events of a streamed Cohere response (is_stream = True)
+    and yield, as soon as they arrive:
+        {"text": delta} for a new piece of the answer
+        {"citations": [complete citations]} for a citation-generation event
+
+    documents: the list of documents sent with the request
+    (in streaming the response doesn't return them)
+    cancel_event: optional threading.Event, if set the generation is stopped
+    (it is stopped also closing the generator)
+    """
+    doc_index = build_document_index(documents)
+    stream = ChatStream(response, COHERE, cancel_event)
+
+    try:
+        for chunk in stream:
+            if chunk.text:
+                yield {"text": chunk.text}
+
+            if chunk.citations:
+                yield {
+                    "citations": [
+                        complete_citation(
+                            _normalize_streamed_citation(item), doc_index
+                        )
+                        for item in chunk.citations
+                    ]
+                }
+    finally:
+        # also when the caller closes this generator: the generation stops
+        stream.close()
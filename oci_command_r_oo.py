@@ -7,10 +7,9 @@ last update: 07/06/2024
 """
 
 from typing import Any, Dict, List, Optional
+import contextvars
 import logging
 
-import json
-
 from langchain_core.callbacks import (
     CallbackManagerForLLMRun,
 )
@@ -21,7 +20,13 @@ from langchain_core.outputs import ChatGeneration, ChatResult
 from oci.generative_ai_inference.models import CohereChatRequest, ChatDetails
 from oci.generative_ai_inference.models import OnDemandServingMode
 
-from oci_chat_utils import get_generative_ai_dp_client
+from oci_chat_utils import get_generative_ai_dp_client, ChatStream, COHERE
+from usage_accounting import (
+    CHAT,
+    estimate_usage_tokens,
+    get_oci_usage,
+    record_usage,
+)
 
 logger = logging.getLogger("oci_command_r")
 
@@ -166,8 +171,46 @@ class OCICommandR(BaseChatModel):
             logger.error("Error in invoke: %s", e)
             chat_response = None
 
+        if chat_response is not None:
+            self._record_usage(chat_response, query, chat_history, documents)
+
         return chat_response
 
+    def _record_usage(self, chat_response, query, chat_history, documents):
+        """
+        count the tokens (usage_accounting), estimated if not returned
+        with streaming the call is counted when the stream ends (ChatStream)
+        """
+        input_tokens = estimate_usage_tokens(
+            query + str(chat_history or "") + str(documents or "")
+        )
+
+        if self.is_streaming:
+            # the stream can be read in another scope: counted in this one
+            context = contextvars.copy_context()
+
+            def on_stream_end(text):
+                context.run(
+                    record_usage,
+                    CHAT,
+                    self.model,
+                    input_tokens,
+                    estimate_usage_tokens(text),
+                )
+
+            chat_response.on_stream_end = on_stream_end
+            return
+
+        usage = get_oci_usage(chat_response.data.chat_response)
+
+        if usage is None:
+            usage = (
+                input_tokens,
+                estimate_usage_tokens(chat_response.data.chat_response.text),
+            )
+
+        record_usage(CHAT, self.model, usage[0], usage[1])
+
     def print_response(self, chat_response):
         """
         helper function to print LLm output
@@ -176,12 +219,16 @@ class OCICommandR(BaseChatModel):
         print("")
 
         if self.is_streaming:
-            for event in chat_response.data.events():
-                res = json.loads(event.data)
-                if "text" in res.keys():
-                    # 9/06 (added to remove duplication of text)
-                    if "finishReason" not in res.keys():
-                        print(res["text"], end="", flush=True)
+            stream = ChatStream(chat_response, COHERE)
+
+            try:
+                # the last event, repeating the whole text, is not returned
+                for chunk in stream:
+                    print(chunk.text, end="", flush=True)
+            except KeyboardInterrupt:
+                # Ctrl-C stops the generation, not only the printing
+                stream.cancel()
+                raise
 
             print("\n")
         else:
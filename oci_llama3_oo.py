@@ -9,7 +9,6 @@ last update: 10/06/2024
 
 from typing import Any, Dict, List, Optional, Iterator
 import logging
-import json
 
 from langchain_core.callbacks import (
     CallbackManagerForLLMRun,
@@ -23,7 +22,13 @@ from oci.generative_ai_inference.models import GenericChatRequest, ChatDetails
 from oci.generative_ai_inference.models import BaseChatRequest, TextContent, Message
 from oci.generative_ai_inference.models import OnDemandServingMode
 
-from oci_chat_utils import get_generative_ai_dp_client
+from oci_chat_utils import get_generative_ai_dp_client, ChatStream, GENERIC
+from usage_accounting import (
+    CHAT,
+    estimate_usage_tokens,
+    get_oci_usage,
+    record_usage,
+)
 
 logger = logging.getLogger("oci_llama3")
 
@@ -172,9 +177,18 @@ class OCILlama3(BaseChatModel):
     ) -> ChatResult:
         response = self._handle_request(messages, is_streaming=False)
 
+        out_text = response.data.chat_response.choices[0].message.content[0].text
+
+        # count the tokens (usage_accounting), estimated if not returned
+        usage = get_oci_usage(response.data.chat_response) or (
+            self._estimate_input_tokens(messages),
+            estimate_usage_tokens(out_text),
+        )
+        record_usage(CHAT, self.model, usage[0], usage[1])
+
         # prepare the output
         out_message = AIMessage(
-            content=response.data.chat_response.choices[0].message.content[0].text,
+            content=out_text,
             response_metadata={},
         )
 
@@ -207,18 +221,33 @@ class OCILlama3(BaseChatModel):
         """
         response = self._handle_request(messages, is_streaming=True)
 
-        for event in response.data.events():
-            res = json.loads(event.data)
-            if "message" in res.keys():
-                content = res["message"]["content"][0]["text"]
-                chunk = ChatGenerationChunk(message=AIMessageChunk(content=content))
+        output_text = []
+        # if the consumer stops iterating, the HTTP stream is closed
+        for stream_chunk in ChatStream(response, GENERIC):
+            if stream_chunk.text:
+                output_text.append(stream_chunk.text)
+                chunk = ChatGenerationChunk(
+                    message=AIMessageChunk(content=stream_chunk.text)
+                )
                 yield chunk
 
+        # count the tokens (usage_accounting)
+        record_usage(
+            CHAT,
+            self.model,
+            self._estimate_input_tokens(messages),
+            estimate_usage_tokens("".join(output_text)),
+        )
+
         chunk = ChatGenerationChunk(
             message=AIMessageChunk(content="", response_metadata={})
         )
         yield chunk
 
+    def _estimate_input_tokens(self, messages: List[BaseMessage]) -> int:
+        """estimated num. of tokens of the messages"""
+        return estimate_usage_tokens("".join(str(msg.content) for msg in messages))
+
     def print_response(self, chat_response):
         """
         helper function to print handling streaming/no_streaming
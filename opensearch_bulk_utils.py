@@ -0,0 +1,262 @@
+"""
+Bulk load of chunks in OpenSearch
+
+For the initial load of a large number of chunks:
+    * refresh and replicas are disabled during the load
+    * embeddings are computed in batches by a pool of threads, a few
+      batches ahead, while parallel bulk requests (bounded in size)
+      write the previous ones
+    * settings are restored, then segments are merged and
+      the k-NN graphs are loaded in memory (warmup)
+    * docs have the ids of get_chunk_ids (chunk_index_utils): a load
+      retried after an error replaces the docs, without duplicates
+
+The index has the same fields used by OpenSearchVectorSearch
+(vector_field, text, metadata), so it can be used by the RAG chain.
+
+Python Version: 3.11
+"""
+
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from opensearchpy import OpenSearch, helpers
+
+from chunk_index_utils import get_chunk_ids
+from factory_vector_store import get_ann_params
+from utils import get_console_logger, load_configuration
+
+from config_private import OPENSEARCH_USER, OPENSEARCH_PWD
+
+config = load_configuration()
+
+VECTOR_FIELD = "vector_field"
+TEXT_FIELD = "text"
+
+
+def get_opensearch_client():
+    """
+    the low-level OpenSearch client, from config
+    """
+    os_config = config["vector_store"]["opensearch"]
+
+    return OpenSearch(
+        hosts=[os_config["opensearch_url"]],
+        http_auth=(OPENSEARCH_USER, OPENSEARCH_PWD),
+        use_ssl=os_config["use_ssl"],
+        verify_certs=os_config["verify_certs"],
+        ssl_assert_hostname=os_config["ssl_assert_hostname"],
+        ssl_show_warn=os_config["ssl_show_warn"],
+        timeout=600,
+    )
+
+
+def get_index_body(dimension):
+    """
+    settings and mappings for the k-NN index
+    (the same used by OpenSearchVectorSearch, with HNSW params from config)
+    """
+    ann_params = get_ann_params()
+    engine = config["vector_store"]["opensearch"]["engine"]
+
+    method_params = {
+        "ef_construction": ann_params["ef_construction"],
+        "m": ann_params["m"],
+    }
+    # with faiss ef_search is a param of the method
+    if engine == "faiss":
+        method_params["ef_search"] = ann_params["ef_search"]
+
+    return {
+        "settings": {
+            "index": {"knn": True, "knn.algo_param.ef_search": ann_params["ef_search"]}
+        },
+        "mappings": {
+            "properties": {
+                VECTOR_FIELD: {
+                    "type": "knn_vector",
+                    "dimension": dimension,
+                    "method": {
+                        "name": "hnsw",
+                        "space_type": ann_params["space_type"],
+                        "engine": engine,
+                        "parameters": method_params,
+                    },
+                }
+            }
+        },
+    }
+
+
+def set_bulk_settings(client, index_name):
+    """
+    disable refresh and replicas, returns the settings to restore
+    """
+    settings = client.indices.get_settings(index=index_name)[index_name]["settings"]
+
+    old_settings = {
+        "refresh_interval": settings["index"].get("refresh_interval", "1s"),
+        "number_of_replicas": settings["index"].get("number_of_replicas", "1"),
+    }
+
+    client.indices.put_settings(
+        index=index_name,
+        body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+    )
+
+    return old_settings
+
+
+def restore_settings(client, index_name, old_settings):
+    """
+    restore the settings changed by set_bulk_settings
+    """
+    client.indices.put_settings(index=index_name, body={"index": old_settings})
+
+
+def generate_actions(docs, embed_model, index_name, batch_size, n_workers=None):
+    """
+    yield the bulk actions, in the order of docs
+    embeddings are computed by n_workers threads, at most 2 * n_workers
+    batches ahead: the bulk writers don't wait for every single batch
+    """
+    if n_workers is None:
+        n_workers = config["vector_store"]["opensearch"]["embed_workers"]
+
+    def embed_batch(batch):
+        return embed_model.embed_documents([doc.page_content for doc in batch])
+
+    ids = get_chunk_ids(docs)
+    batches = (
+        (docs[i : i + batch_size], ids[i : i + batch_size])
+        for i in range(0, len(docs), batch_size)
+    )
+    in_flight = deque()
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for batch, batch_ids in batches:
+            # in the same context: embeddings are counted for the job
+            in_flight.append(
+                (
+                    batch,
+                    batch_ids,
+                    executor.submit(
+                        contextvars.copy_context().run, embed_batch, batch
+                    ),
+                )
+            )
+
+            if len(in_flight) < 2 * n_workers:
+                continue
+
+            yield from batch_actions(index_name, *in_flight.popleft())
+
+        while in_flight:
+            yield from batch_actions(index_name, *in_flight.popleft())
+
+
+def batch_actions(index_name, batch, batch_ids, f_vectors):
+    """
+    the actions of a batch, when its embeddings are ready
+    """
+    for doc, doc_id, vector in zip(batch, batch_ids, f_vectors.result()):
+        yield {
+            "_op_type": "index",
+            "_index": index_name,
+            "_id": doc_id,
+            VECTOR_FIELD: vector,
+            TEXT_FIELD: doc.page_content,
+            "metadata": doc.metadata,
+        }
+
+
+def warmup_index(client, index_name):
+    """
+    load the k-NN graphs of the index in memory
+    """
+    return client.transport.perform_request(
+        "GET", f"/_plugins/_knn/warmup/{index_name}"
+    )
+
+
+def bulk_load_opensearch(docs, embed_model, index_name=None):
+    """
+    load docs in the index (created if needed) with parallel bulk requests
+    returns the num. of docs indexed and the num. of errors
+    """
+    if index_name is None:
+        index_name = config["vector_store"]["opensearch"]["index_name"]
+
+    if not docs:
+        return 0, 0
+
+    client = get_opensearch_client()
+
+    if not client.indices.exists(index=index_name):
+        dimension = len(embed_model.embed_query(docs[0].page_content))
+        client.indices.create(index=index_name, body=get_index_body(dimension))
+
+    actions = generate_actions(
+        docs,
+        embed_model,
+        index_name,
+        config["embeddings"]["oci"]["embed_batch_size"],
+    )
+
+    return run_bulk_load(client, index_name, actions)
+
+
+def run_bulk_load(client, index_name, actions):
+    """
+    write the actions in the index (already created) with parallel bulk
+    requests, then merge segments and warmup
+    returns the num. of docs indexed and the num. of errors
+    """
+    logger = get_console_logger()
+    os_config = config["vector_store"]["opensearch"]
+
+    old_settings = set_bulk_settings(client, index_name)
+
+    n_ok = 0
+    n_errors = 0
+    time_start = time()
+
+    try:
+        for ok, info in helpers.parallel_bulk(
+            client,
+            actions,
+            thread_count=os_config["bulk_workers"],
+            chunk_size=os_config["bulk_chunk_size"],
+            max_chunk_bytes=os_config["bulk_max_bytes"],
+            raise_on_error=False,
+        ):
+            if ok:
+                n_ok += 1
+            else:
+                n_errors += 1
+                logger.error("Error in bulk load: %s", info)
+    finally:
+        restore_settings(client, index_name, old_settings)
+
+    logger.info(
+        "Indexed %s docs (%s errors) in %s sec.",
+        n_ok,
+        n_errors,
+        round(time() - time_start, 1),
+    )
+
+    client.indices.refresh(index=index_name)
+
+    logger.info("Merging segments...")
+    client.indices.forcemerge(
+        index=index_name,
+        max_num_segments=os_config["force_merge_segments"],
+        request_timeout=3600,
+    )
+
+    logger.info("Warming up k-NN graphs...")
+    warmup_index(client, index_name)
+
+    return n_ok, n_errors
@@ -0,0 +1,159 @@
+"""
+Bulk insert of chunks in Oracle 23ai
+
+OracleVS.add_documents converts every vector (a list of Python floats)
+and sends all the rows with a single executemany. Here:
+    * vectors are bound as array.array('f'), built from the float32
+      buffer when they are NumPy arrays (no Python float per value)
+    * rows are sent with executemany in batches of insert_batch_size,
+      with input sizes set once
+    * commit is done every commit_every rows, not for every batch
+    * rows with an id already in the table are skipped: with the same
+      ids (see get_chunk_ids in chunk_index_utils) a load that failed
+      after some commits can be retried without duplicates
+
+The table has the same columns (and ids) used by OracleVS, so it can be
+used by the RAG chain. See bench_oracle_insert.py for the rows/s.
+
+Python Version: 3.11
+"""
+
+import array
+import hashlib
+import json
+import uuid
+
+import numpy as np
+
+from utils import load_configuration
+
+config = load_configuration()
+
+# ORA-00001: unique constraint violated (the id is already in the table)
+DUPLICATE_KEY_ERROR = 1
+
+
+def to_vector_bind(vector):
+    """
+    the value to bind to a VECTOR column (or to a query)
+    """
+    if isinstance(vector, array.array) and vector.typecode == "f":
+        return vector
+
+    if isinstance(vector, np.ndarray):
+        bind = array.array("f")
+        # copy of the buffer, without creating Python floats
+        bind.frombytes(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+        return bind
+
+    return array.array("f", vector)
+
+
+def to_row_id(key=None):
+    """
+    the id of a row, as OracleVS computes it (from key or from a new uuid)
+    """
+    if key is None:
+        key = str(uuid.uuid4())
+
+    return hashlib.sha256(key.encode()).hexdigest()[:16].upper()
+
+
+class OracleBulkWriter:
+    """
+    Inserts texts, metadata and vectors in a 23ai table, in batches
+
+    Usage:
+        writer = OracleBulkWriter(connection, "MY_BOOKS")
+        writer.write(texts, metadatas, vectors)
+    """
+
+    def __init__(self, connection, table_name, batch_size=None, commit_every=None):
+        oracle_config = config["vector_store"]["23ai"]
+
+        if batch_size is None:
+            batch_size = oracle_config["insert_batch_size"]
+        if commit_every is None:
+            commit_every = oracle_config["commit_every"]
+
+        self.connection = connection
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+
+    def create_table(self, dimension):
+        """
+        create the table (as OracleVS does), if it doesn't exist
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    id RAW(16) DEFAULT SYS_GUID() PRIMARY KEY,
+                    text CLOB,
+                    metadata CLOB,
+                    embedding VECTOR({int(dimension)}, FLOAT32)
+                )
+                """
+            )
+
+    def write(self, texts, metadatas, vectors, ids=None, hash_ids=True):
+        """
+        insert the rows, vectors: list of lists, 2D NumPy array or array('f')
+        ids: keys of the rows (hashed as OracleVS does), new ones if not given
+        hash_ids: False if ids are already ids of rows (for ex. exported)
+        rows with an id already in the table are not inserted again
+        returns the ids of the rows
+        """
+        import oracledb
+
+        if ids is None:
+            ids = [to_row_id() for _ in texts]
+        elif hash_ids:
+            ids = [to_row_id(key) for key in ids]
+        else:
+            ids = list(ids)
+
+        sql = (
+            f"INSERT INTO {self.table_name} (id, text, metadata, embedding) "
+            "VALUES (:1, :2, :3, :4)"
+        )
+
+        n_uncommitted = 0
+
+        with self.connection.cursor() as cursor:
+            # the types are set once, not inferred for every batch
+            # (long strings are bound as LONG: no temporary LOBs)
+            cursor.setinputsizes(
+                None,
+                oracledb.DB_TYPE_LONG,
+                oracledb.DB_TYPE_LONG,
+                oracledb.DB_TYPE_VECTOR,
+            )
+
+            for i in range(0, len(texts), self.batch_size):
+                end = i + self.batch_size
+
+                rows = [
+                    (row_id, text, json.dumps(metadata), to_vector_bind(vector))
+                    for row_id, text, metadata, vector in zip(
+                        ids[i:end], texts[i:end], metadatas[i:end], vectors[i:end]
+                    )
+                ]
+                # an error doesn't stop the batch: rows saved by a previous
+                # (failed) load are skipped, other errors are raised
+                cursor.executemany(sql, rows, batcherrors=True)
+
+                for error in cursor.getbatcherrors():
+                    if error.code != DUPLICATE_KEY_ERROR:
+                        raise oracledb.DatabaseError(error)
+
+                n_uncommitted += len(rows)
+                if n_uncommitted >= self.commit_every:
+                    self.connection.commit()
+                    n_uncommitted = 0
+
+        self.connection.commit()
+
+        return ids
+
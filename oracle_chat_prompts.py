@@ -58,3 +58,37 @@ QA_PROMPT_IT = ChatPromptTemplate.from_messages(
         ("human", "{input}"),
     ]
 )
+
+#
+# The prompt to summarise the older part of a conversation
+#
+SUMMARY_SYSTEM_PROMPT = """Progressively summarize the conversation below, \
+adding the new lines to the current summary. Keep names, facts and questions \
+the user may refer to later. Write at most {max_words} words and return only \
+the new summary.
+
+Current summary:
+{summary}"""
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", SUMMARY_SYSTEM_PROMPT),
+        MessagesPlaceholder("new_lines"),
+        ("human", "Write the new summary."),
+    ]
+)
+
+#
+# The prompt to generate variants of the question (multi-query retrieval)
+#
+MULTI_QUERY_SYSTEM_PROMPT = """You help to search documents in a Vector Store. \
+Given the user question, write {n_queries} different versions of it, to find \
+relevant documents also when the question is ambiguous. Use the same language \
+of the question. Return only the questions, one per line, without numbers."""
+
+MULTI_QUERY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", MULTI_QUERY_SYSTEM_PROMPT),
+        ("human", "{input}"),
+    ]
+)
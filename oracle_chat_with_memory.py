@@ -21,18 +21,15 @@ Warnings:
     This module is in development, may change in future versions.
 """
 
-import os
 import time
-import tempfile
+import uuid
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage
 
-from factory import build_rag_chain, get_embed_model
-from chunk_index_utils import (
-    load_book_and_split,
-    add_docs_to_opensearch,
-    add_docs_to_23ai,
-)
+from factory import build_rag_chain, get_llm
+from chat_memory import ConversationMemory
+from ingestion_jobs import IngestionQueue
+from usage_accounting import usage_scope
 from utils import (
     get_console_logger,
     enable_tracing,
@@ -55,10 +52,23 @@ def reset_conversation():
     when push the button reset the chat_history
     """
     # chat_history is per session
+    # (all the messages, to display them)
     st.session_state.chat_history = []
 
+    # the bounded history sent to the LLM
+    st.session_state.chat_memory = ConversationMemory(
+        llm=get_llm(
+            model_type=config["llm"]["model_type"],
+            model_id=config["chat_memory"]["summary_model"],
+        )
+    )
+
     st.session_state.request_count = 0
 
+    # to count the usage (tokens...) of the session
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
+
 
 # defined here to avoid import of streamlit in other module
 # cause we need here to use @cache
@@ -110,30 +120,70 @@ def nostream_output(v_ai_msg):
 
 
 # case streaming
-def stream_output(v_ai_msg):
+def stream_output(v_ai_msg, v_time_start=None):
     """
     format the output when using streaming
+
+    chunks are accumulated and the text is rendered at most every
+    render_interval_sec, or when render_min_chars new chars are available,
+    to avoid re-rendering the whole answer for every token
+    v_time_start: when the request started, to measure time to first token
     """
+    if v_time_start is None:
+        v_time_start = time.time()
+
+    render_interval = config["ui"]["render_interval_sec"]
+    render_min_chars = config["ui"]["render_min_chars"]
+
     text_placeholder = st.empty()
+    refs_placeholder = st.empty()
+
     formatted_output = ""
+    refs = ""
+    # chars not yet rendered
+    n_pending = 0
+    last_render = 0.0
+    first_token_time = None
+    render_time = 0.0
+    n_renders = 0
 
     for chunk in v_ai_msg:
+        if config["ui"]["add_references"] and "context" in chunk:
+            # the context arrives before the answer: show references now
+            refs = format_references(chunk["context"])
+            refs_placeholder.markdown(refs, unsafe_allow_html=True)
+
         if "answer" in chunk:
             formatted_output += chunk["answer"]
-            text_placeholder.markdown(formatted_output, unsafe_allow_html=True)
+            n_pending += len(chunk["answer"])
+
+            now = time.time()
+            if (
+                first_token_time is None
+                or now - last_render >= render_interval
+                or n_pending >= render_min_chars
+            ):
+                text_placeholder.markdown(formatted_output, unsafe_allow_html=True)
 
-        if config["ui"]["add_references"]:
-            if "context" in chunk:
-                refs = format_references(chunk["context"])
+                if first_token_time is None:
+                    first_token_time = time.time() - v_time_start
 
-    # references must be added at the end
-    # in Langchain they're passed before the answer in the stream
-    if config["ui"]["add_references"]:
-        formatted_output += refs
+                last_render = time.time()
+                render_time += last_render - now
+                n_renders += 1
+                n_pending = 0
 
+    # the last chunks
     text_placeholder.markdown(formatted_output, unsafe_allow_html=True)
 
-    return formatted_output
+    logger.info(
+        "Time to first token: %s sec., render time: %s sec. (%s renders)",
+        round(first_token_time or 0.0, 2),
+        round(render_time, 3),
+        n_renders + 1,
+    )
+
+    return formatted_output + refs
 
 
 def display_msg_on_rerun(chat_hist):
@@ -153,36 +203,46 @@ def display_msg_on_rerun(chat_hist):
             st.markdown(message["content"])
 
 
-def write_temporary_file(v_tmp_dir_name, v_uploaded_file):
+# shared by all the sessions
+@st.cache_resource
+def get_ingestion_queue():
     """
-    Write the uploaded file as a temporary file
+    the queue of the jobs loading files in the Vector Store
     """
-    temp_file_path = os.path.join(v_tmp_dir_name, v_uploaded_file.name)
+    return IngestionQueue()
 
-    with open(temp_file_path, "wb") as f:
-        f.write(v_uploaded_file.getbuffer())
 
-    return temp_file_path
-
-
-def load_uploaded_file_in_vector_store(v_uploaded_file):
+def submit_uploaded_files(v_uploaded_files, tenant=None):
     """
-    load the uploaded file in the Vector Store and index
+    load the uploaded files in the Vector Store, in background
+    files already loaded are skipped
+    tenant: if given, files are loaded for the tenant
     """
+    try:
+        accepted = get_ingestion_queue().submit(
+            [(v_file.name, v_file.getvalue()) for v_file in v_uploaded_files],
+            tenant=tenant,
+        )
+    except ValueError as e:
+        st.sidebar.error(str(e))
+        return
 
-    # write a temporary file with the content
-    with tempfile.TemporaryDirectory() as tmp_dir_name:
-        temp_file_path = write_temporary_file(tmp_dir_name, v_uploaded_file)
+    for file_name in accepted:
+        logger.info("Loading %s in the Vector Store...", file_name)
 
-        # prepare for loading
-        docs = load_book_and_split(temp_file_path)
 
-    embed_model = get_embed_model(config["embeddings"]["embed_model_type"])
+def show_ingestion_progress():
+    """
+    show in the sidebar the status of the loading jobs
+    """
+    for job in get_ingestion_queue().get_jobs():
+        if job["status"] == "error":
+            st.sidebar.error(f"{job['name']}: {job['error']}")
+        else:
+            st.sidebar.progress(job["progress"], text=f"{job['name']}: {job['status']}")
 
-    if config["vector_store"]["store_type"] == "OPENSEARCH":
-        add_docs_to_opensearch(docs, embed_model)
-    elif config["vector_store"]["store_type"] == "23AI":
-        add_docs_to_23ai(docs, embed_model)
+    if get_ingestion_queue().has_running_jobs():
+        st.sidebar.button("Refresh status")
 
 
 def rimuovi_caratteri_dopo_sottostringa(stringa, sottostringa):
@@ -205,6 +265,8 @@ def get_model_list():
         "cohere.command-r-16k",
         "cohere.command-r-plus",
         "meta.llama-3-70b-instruct",
+        # chosen for every request, see [routing] in config.toml
+        "auto",
     ]
 
 
@@ -235,21 +297,17 @@ model_list = get_model_list()
 model_id = st.sidebar.selectbox("Select LLM", model_list)
 
 # to load other pdf
-uploaded_file = st.sidebar.file_uploader(
-    label="Upload files", type=["pdf"], accept_multiple_files=False
+# files are loaded in background: the chat can be used in the meantime
+uploaded_files = st.sidebar.file_uploader(
+    label="Upload files", type=["pdf"], accept_multiple_files=True
 )
+upload_tenant = st.sidebar.text_input("Tenant for uploads (optional)").strip()
 
-if uploaded_file:
-    logger.info("Loading %s in the Vector Store...", uploaded_file.name)
+if uploaded_files:
+    # files stay in the uploader across reruns: duplicates are skipped
+    submit_uploaded_files(uploaded_files, upload_tenant or None)
 
-    load_uploaded_file_in_vector_store(uploaded_file)
-
-    logger.info("Loaded !")
-
-    # reload the rag_chain (do we need?)
-    rag_chain = build_rag_chain(verbose=config["ui"]["verbose"], model_id=model_id)
-
-    uploaded_file = None
+show_ingestion_progress()
 
 # Initialize chat history
 if "chat_history" not in st.session_state:
@@ -270,45 +328,58 @@ if question := st.chat_input(config["ui"]["hello_msg"]):
     # Display user message in chat message container
     st.chat_message(USER).markdown(question)
 
+    # the history before this question, with older messages summarised
+    llm_history = st.session_state.chat_memory.get_history()
+
     # Add user message to chat history
     st.session_state.chat_history.append(HumanMessage(content=question))
+    st.session_state.chat_memory.add_message(HumanMessage(content=question))
+
+    st.session_state.request_count += 1
 
     # here we call the RAG chain...
     try:
-        with st.spinner("Calling AI..."):
-            time_start = time.time()
-
-            st.session_state.request_count += 1
-            logger.info("")
-            logger.info("Question n. %s", st.session_state.request_count)
-
-            #
-            # Here we invoke the GenAI service
-            #
-
-            # prepare the input adding chat_history
-            input_msg = {
-                "input": question,
-                "chat_history": st.session_state.chat_history,
-            }
-
-            if config["ui"]["do_streaming"]:
-                ai_msg = rag_chain.stream(input_msg)
-            else:
-                ai_msg = rag_chain.invoke(input_msg)
-
-        # Display the response in chat message container
-        with st.chat_message(ASSISTANT):
-            if config["ui"]["do_streaming"]:
-                output = stream_output(ai_msg)
-            else:
-                output = nostream_output(ai_msg)
-
-            # Add assistant response to chat history
-
-            # remove references
-            output = rimuovi_caratteri_dopo_sottostringa(output, "Reference")
-            st.session_state.chat_history.append(AIMessage(content=output))
+        # tokens, embeddings and rerank calls are counted for the request
+        with usage_scope(
+            st.session_state.session_id, st.session_state.request_count
+        ):
+            with st.spinner("Calling AI..."):
+                time_start = time.time()
+
+                logger.info("")
+                logger.info("Question n. %s", st.session_state.request_count)
+
+                #
+                # Here we invoke the GenAI service
+                #
+
+                # prepare the input adding chat_history
+                input_msg = {
+                    "input": question,
+                    "chat_history": llm_history,
+                }
+
+                if config["ui"]["do_streaming"]:
+                    ai_msg = rag_chain.stream(input_msg)
+                else:
+                    ai_msg = rag_chain.invoke(input_msg)
+
+            # Display the response in chat message container
+            with st.chat_message(ASSISTANT):
+                if config["ui"]["do_streaming"]:
+                    output = stream_output(ai_msg, time_start)
+                else:
+                    output = nostream_output(ai_msg)
+
+                # Add assistant response to chat history
+
+                # remove references
+                output = rimuovi_caratteri_dopo_sottostringa(output, "Reference")
+                st.session_state.chat_history.append(AIMessage(content=output))
+                st.session_state.chat_memory.add_message(AIMessage(content=output))
+
+            # the summary of older messages is updated in background
+            st.session_state.chat_memory.update_summary_async()
 
         logger.info("Elapsed time: %s sec.", round((time.time() - time_start), 1))
 
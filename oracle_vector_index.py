@@ -0,0 +1,230 @@
+"""
+Management of the vector index on Oracle 23ai collections
+
+Without a vector index every similarity search is an exact scan
+of the table. Supported indexes:
+    HNSW: in-memory neighbor graph (needs vector_memory_size > 0)
+    IVF: neighbor partitions
+
+Usage:
+    python oracle_vector_index.py create|rebuild|drop [--type HNSW|IVF]
+        [--table MY_BOOKS]
+    python oracle_vector_index.py bench [--accuracy 80 90 95 99]
+        [--n_queries 50] [--k 8]
+
+    bench samples query vectors from the table and reports, for every target
+    accuracy, the recall against the exact search and the latency.
+
+    To test locally you can use the 23ai Free container:
+        docker run -d -p 1521:1521 -e ORACLE_PWD=<pwd>
+            container-registry.oracle.com/database/free:latest
+
+Python Version: 3.11
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+
+from factory_vector_store import get_oracle_connection, get_collection_name
+from oracle_bulk_writer import to_vector_bind
+from utils import check_value_in_list, get_console_logger, load_configuration
+
+config = load_configuration()
+
+INDEX_TYPES = ["HNSW", "IVF"]
+
+
+def get_index_name(table_name, index_type):
+    """
+    the name of the vector index for table_name
+    """
+    return f"{table_name}_{index_type}_IDX".upper()
+
+
+def create_vector_index(connection, table_name, index_type=None, accuracy=None):
+    """
+    create the vector index on the embedding column of table_name
+    params not given are taken from [vector_store.23ai]
+    """
+    oracle_config = config["vector_store"]["23ai"]
+
+    if index_type is None:
+        index_type = oracle_config["index_type"]
+    if accuracy is None:
+        accuracy = oracle_config["target_accuracy"]
+
+    check_value_in_list(index_type, INDEX_TYPES)
+
+    if index_type == "HNSW":
+        organization = "INMEMORY NEIGHBOR GRAPH"
+        params = (
+            f"TYPE HNSW, NEIGHBORS {int(oracle_config['hnsw_neighbors'])}, "
+            f"EFCONSTRUCTION {int(oracle_config['hnsw_ef_construction'])}"
+        )
+    else:
+        organization = "NEIGHBOR PARTITIONS"
+        params = f"TYPE IVF, NEIGHBOR PARTITIONS {int(oracle_config['ivf_partitions'])}"
+
+    ddl = f"""
+        CREATE VECTOR INDEX {get_index_name(table_name, index_type)}
+        ON {table_name} (embedding)
+        ORGANIZATION {organization}
+        DISTANCE COSINE
+        WITH TARGET ACCURACY {int(accuracy)}
+        PARAMETERS ({params})
+        PARALLEL {int(oracle_config['index_parallel'])}
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(ddl)
+
+
+def vector_index_exists(connection, table_name, index_type=None):
+    """
+    check if the vector index exists
+    """
+    if index_type is None:
+        index_type = config["vector_store"]["23ai"]["index_type"]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM user_indexes WHERE index_name = :name",
+            name=get_index_name(table_name, index_type),
+        )
+        (n_found,) = cursor.fetchone()
+
+    return n_found > 0
+
+
+def ensure_vector_index(connection, table_name):
+    """
+    create the vector index (with params from config) if it doesn't exist
+    """
+    if not vector_index_exists(connection, table_name):
+        create_vector_index(connection, table_name)
+
+
+def drop_vector_index(connection, table_name, index_type=None):
+    """
+    drop the vector index, if it exists
+    """
+    if index_type is None:
+        index_type = config["vector_store"]["23ai"]["index_type"]
+
+    if vector_index_exists(connection, table_name, index_type):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX {get_index_name(table_name, index_type)}")
+
+
+def rebuild_vector_index(connection, table_name, index_type=None, accuracy=None):
+    """
+    drop and create again (for ex. after a large load, or to change params)
+    """
+    drop_vector_index(connection, table_name, index_type)
+    create_vector_index(connection, table_name, index_type, accuracy)
+
+
+def search_ids(connection, table_name, vector, k, accuracy=None):
+    """
+    ids of the top k rows, exact search if accuracy is None
+    returns ids and latency in ms
+    """
+    if accuracy is None:
+        fetch = f"FETCH EXACT FIRST {int(k)} ROWS ONLY"
+    else:
+        fetch = (
+            f"FETCH APPROX FIRST {int(k)} ROWS ONLY "
+            f"WITH TARGET ACCURACY {int(accuracy)}"
+        )
+
+    query = f"""
+        SELECT id FROM {table_name}
+        ORDER BY vector_distance(embedding, :embedding, COSINE)
+        {fetch}
+    """
+
+    time_start = time()
+    with connection.cursor() as cursor:
+        cursor.execute(query, embedding=to_vector_bind(vector))
+        ids = {row[0] for row in cursor.fetchall()}
+
+    return ids, (time() - time_start) * 1000
+
+
+def benchmark(connection, table_name, accuracy_list, n_queries, k):
+    """
+    recall and latency of the approximate search for every target accuracy
+    """
+    logger = get_console_logger()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT embedding FROM {table_name} SAMPLE (10) "
+            f"FETCH FIRST {int(n_queries)} ROWS ONLY"
+        )
+        queries = [row[0] for row in cursor.fetchall()]
+
+    exact = [search_ids(connection, table_name, vec, k) for vec in queries]
+    exact_latency = np.array([latency for _, latency in exact])
+
+    logger.info("Table: %s, queries: %s, k: %s", table_name, len(queries), k)
+    logger.info("accuracy  recall  p50 (ms)  p95 (ms)")
+    logger.info(
+        "%8s  %6.3f  %8.1f  %8.1f",
+        "exact",
+        1.0,
+        np.percentile(exact_latency, 50),
+        np.percentile(exact_latency, 95),
+    )
+
+    for accuracy in accuracy_list:
+        recalls = []
+        latencies = []
+
+        for vec, (exact_ids, _) in zip(queries, exact):
+            ids, latency = search_ids(connection, table_name, vec, k, accuracy)
+
+            recalls.append(len(ids & exact_ids) / max(len(exact_ids), 1))
+            latencies.append(latency)
+
+        logger.info(
+            "%8s  %6.3f  %8.1f  %8.1f",
+            accuracy,
+            np.mean(recalls),
+            np.percentile(latencies, 50),
+            np.percentile(latencies, 95),
+        )
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Manage 23ai vector indexes.")
+    parser.add_argument("command", choices=["create", "rebuild", "drop", "bench"])
+    parser.add_argument("--type", choices=INDEX_TYPES, default=None)
+    parser.add_argument("--table", type=str, default=get_collection_name())
+    parser.add_argument("--accuracy", type=int, nargs="+", default=[80, 90, 95, 99])
+    parser.add_argument("--n_queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=config["retriever"]["top_k"])
+
+    args = parser.parse_args()
+
+    db_connection = get_oracle_connection()
+
+    time_start = time()
+
+    if args.command == "create":
+        create_vector_index(db_connection, args.table, args.type)
+    elif args.command == "rebuild":
+        rebuild_vector_index(db_connection, args.table, args.type)
+    elif args.command == "drop":
+        drop_vector_index(db_connection, args.table, args.type)
+    else:
+        benchmark(db_connection, args.table, args.accuracy, args.n_queries, args.k)
+
+    logger.info("Elapsed time: %s sec.", round(time() - time_start, 1))
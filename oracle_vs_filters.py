@@ -0,0 +1,95 @@
+"""
+OracleVS with filters applied in the DB
+
+Python Version: 3.11
+"""
+
+import json
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores.oraclevs import OracleVS
+
+from oracle_bulk_writer import to_vector_bind
+
+
+class OracleVSWithFilters(OracleVS):
+    """
+    OracleVS where the metadata filter (source, dates) is applied
+    in the WHERE clause, before the top-k, instead of on the top-k results
+
+    accuracy: target accuracy (%) of the approximate search, if a vector
+    index exists; can be given per request, for ex:
+        retriever.invoke(question, accuracy=90)
+
+    pool: if given, every search takes its own connection from the pool,
+    so that parallel searches are not serialized on client
+    """
+
+    def __init__(self, *args, pool=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.pool = pool
+
+    def similarity_search_by_vector_with_relevance_scores(
+        self, embedding, k=4, filter=None, accuracy=None, **kwargs
+    ):
+        if not filter and accuracy is None and self.pool is None:
+            return super().similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, **kwargs
+            )
+
+        filter = filter or {}
+        conditions = []
+        binds = {"embedding": to_vector_bind(embedding)}
+
+        if "source" in filter:
+            conditions.append("JSON_VALUE(metadata, '$.source') = :source")
+            binds["source"] = filter["source"]
+        if "date_from" in filter:
+            conditions.append("JSON_VALUE(metadata, '$.ingest_date') >= :date_from")
+            binds["date_from"] = filter["date_from"]
+        if "date_to" in filter:
+            conditions.append("JSON_VALUE(metadata, '$.ingest_date') <= :date_to")
+            binds["date_to"] = filter["date_to"]
+
+        where_clause = " AND ".join(conditions) if conditions else "1 = 1"
+
+        accuracy_clause = ""
+        if accuracy is not None:
+            accuracy_clause = f"WITH TARGET ACCURACY {int(accuracy)}"
+
+        query = f"""
+            SELECT text, metadata,
+                vector_distance(embedding, :embedding, COSINE) AS distance
+            FROM {self.table_name}
+            WHERE {where_clause}
+            ORDER BY distance
+            FETCH APPROX FIRST {int(k)} ROWS ONLY {accuracy_clause}
+        """
+
+        if self.pool is None:
+            return self._execute_search(self.client, query, binds)
+
+        with self.pool.acquire() as connection:
+            return self._execute_search(connection, query, binds)
+
+    def _execute_search(self, connection, query, binds):
+        docs_and_scores = []
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, binds)
+
+            for text, metadata, distance in cursor.fetchall():
+                if hasattr(text, "read"):
+                    text = text.read()
+                # metadata is a CLOB with JSON in tables created by OracleVS
+                if hasattr(metadata, "read"):
+                    metadata = metadata.read()
+                if isinstance(metadata, str):
+                    metadata = json.loads(metadata)
+
+                docs_and_scores.append(
+                    (Document(page_content=text, metadata=metadata), distance)
+                )
+
+        return docs_and_scores
@@ -0,0 +1,243 @@
+"""
+Store of the parent chunks, for small-to-big retrieval
+
+In small-to-big mode small (child) chunks are embedded, for a precise
+match, and the larger (parent) chunks containing them are sent to the LLM.
+Children have the id of the parent in metadata (parent_id).
+
+The texts of the parents are kept in a single UTF-8 file, with the
+offsets in a NumPy array (the id index): a parent is read with
+a single seek, without loading the whole store.
+
+An id is "<generation>:<position>": the generation is created with the
+store, so children indexed with a store that was deleted (or with a
+store on another host) are not mapped to the wrong parent.
+
+Python Version: 3.11
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from utils import load_configuration
+
+config = load_configuration()
+
+TEXTS_FILE = "parents.txt"
+OFFSETS_FILE = "parents_offsets.npy"
+GENERATION_FILE = "parents_generation.txt"
+
+
+class ParentStore:
+    """
+    parent_id -> text of the parent chunk
+
+    Usage:
+        store = ParentStore()
+        ids = store.add(texts)
+        texts = store.get(ids)
+    """
+
+    def __init__(self, store_dir=None):
+        if store_dir is None:
+            store_dir = config["text_splitting"]["parent_store_dir"]
+
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.texts_path = os.path.join(store_dir, TEXTS_FILE)
+        self.offsets_path = os.path.join(store_dir, OFFSETS_FILE)
+        self.generation_path = os.path.join(store_dir, GENERATION_FILE)
+        self.lock = threading.Lock()
+
+        new_store = not os.path.exists(self.offsets_path)
+
+        # offsets[i] is the start of parent i, the last one the end of the file
+        if new_store:
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self._save_offsets()
+        else:
+            self.offsets = np.load(self.offsets_path)
+
+        # created also if empty: get() works before the first add
+        with open(self.texts_path, "wb" if new_store else "ab"):
+            pass
+
+        # a new store (or one created before generations) has a new
+        # generation: ids of older stores are not valid
+        if new_store or not os.path.exists(self.generation_path):
+            with open(self.generation_path, "w", encoding="utf-8") as f:
+                f.write(uuid.uuid4().hex[:12])
+
+        self.generation = self._read_generation()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, parent_id):
+        position = self._to_position(parent_id)
+
+        if position is not None and position >= len(self):
+            self._reload_offsets()
+
+        return position is not None and position < len(self)
+
+    def _to_position(self, parent_id):
+        # the position in the store, None if the id is of another generation
+        generation, _, position = str(parent_id).rpartition(":")
+
+        if generation != self.generation or not position.isdigit():
+            return None
+
+        return int(position)
+
+    def add(self, texts):
+        """
+        append the texts, returns their ids
+        other processes (for ex. a batch load) can add at the same time:
+        the files are locked while the parents are appended
+        """
+        encoded = [text.encode("utf-8") for text in texts]
+
+        with self.lock, open(self.texts_path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                # the offsets saved by the last writer, also of another process
+                self.offsets = np.load(self.offsets_path)
+                first_position = len(self)
+
+                # texts of a writer stopped before saving the offsets
+                f.truncate(self.offsets[-1])
+                f.write(b"".join(encoded))
+                f.flush()
+
+                lengths = np.array([len(item) for item in encoded], dtype=np.int64)
+                new_offsets = self.offsets[-1] + np.cumsum(lengths)
+                self.offsets = np.concatenate([self.offsets, new_offsets])
+
+                self._save_offsets()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return [
+            f"{self.generation}:{position}"
+            for position in range(first_position, first_position + len(texts))
+        ]
+
+    def _save_offsets(self):
+        # replaced at once: readers never load a partial file
+        tmp_path = self.offsets_path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.offsets)
+        os.replace(tmp_path, self.offsets_path)
+
+    def _read_generation(self):
+        with open(self.generation_path, encoding="utf-8") as f:
+            return f.read().strip()
+
+    def _reload_offsets(self):
+        # parents added by another process (for ex. a batch load),
+        # or the store recreated
+        with self.lock:
+            if os.path.exists(self.offsets_path):
+                self.offsets = np.load(self.offsets_path)
+                self.generation = self._read_generation()
+
+    def get(self, ids):
+        """
+        the texts of the parents with ids (in the same order)
+        raises KeyError if an id is not in this store
+        """
+        if not ids:
+            return []
+
+        positions = [self._to_position(parent_id) for parent_id in ids]
+
+        if None not in positions and max(positions) >= len(self):
+            self._reload_offsets()
+
+        for parent_id, position in zip(ids, positions):
+            if position is None or position >= len(self):
+                raise KeyError(f"Parent {parent_id} not in the parent store")
+
+        texts = []
+
+        with open(self.texts_path, "rb") as f:
+            for position in positions:
+                start, end = self.offsets[position], self.offsets[position + 1]
+                f.seek(start)
+                texts.append(f.read(end - start).decode("utf-8"))
+
+        return texts
+
+    def size_bytes(self):
+        """
+        size on disk (texts and index)
+        """
+        return os.path.getsize(self.texts_path) + os.path.getsize(self.offsets_path)
+
+
+def map_to_parents(docs, store=None):
+    """
+    replace the child chunks with their parents, removing duplicates
+    a parent takes the position (and the metadata) of its first child
+    docs without parent_id (flat chunking) are returned as they are, at
+    their position, as children whose parent is not in the store
+    """
+    from langchain_core.documents import Document
+
+    if store is None:
+        store = get_parent_store()
+
+    # None: the doc is returned as it is
+    doc_parent_ids = []
+    for doc in docs:
+        parent_id = doc.metadata.get("parent_id")
+
+        if parent_id is not None and parent_id not in store:
+            logging.getLogger("ConsoleLogger").warning(
+                "Parent %s not in the parent store, using the child", parent_id
+            )
+            parent_id = None
+
+        doc_parent_ids.append(parent_id)
+
+    # unique, in rank order
+    parent_ids = list(dict.fromkeys(pid for pid in doc_parent_ids if pid is not None))
+    parent_texts = dict(zip(parent_ids, store.get(parent_ids)))
+
+    parents = []
+    for doc, parent_id in zip(docs, doc_parent_ids):
+        if parent_id is None:
+            parents.append(doc)
+        elif parent_id in parent_texts:
+            parents.append(
+                Document(
+                    page_content=parent_texts.pop(parent_id), metadata=doc.metadata
+                )
+            )
+
+    return parents
+
+
+_parent_store = None
+_parent_store_lock = threading.Lock()
+
+
+def get_parent_store():
+    """
+    the store shared by ingestion and retrieval
+    """
+    global _parent_store
+
+    with _parent_store_lock:
+        if _parent_store is None:
+            _parent_store = ParentStore()
+
+    return _parent_store
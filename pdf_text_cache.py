@@ -0,0 +1,113 @@
+"""
+Cache of the text of the pages of PDF files
+
+Parsing the PDF is the slowest part of loading the books: the text of
+the pages is saved (gzipped JSON) in pdf_cache_dir ([text_splitting]),
+with the hash of the file and the version of the parser as key.
+So changing chunk_size, or re-loading the same books, costs only the split.
+
+The pages are returned as PyPDFLoader does (metadata: source, page).
+
+Python Version: 3.11
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from glob import glob
+
+from utils import get_console_logger, load_configuration
+
+config = load_configuration()
+
+# to be changed if the text extracted, for the same parser, changes
+CACHE_FORMAT = 1
+
+
+def file_hash(file_path):
+    """
+    sha256 of the content of the file
+    """
+    sha = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def get_parser_version():
+    """
+    the cache is invalid if the version of pypdf changes
+    """
+    import pypdf
+
+    return f"pypdf-{pypdf.__version__}-{CACHE_FORMAT}"
+
+
+def get_cache_path(file_path, cache_dir=None):
+    """
+    the file in the cache for file_path
+    """
+    if cache_dir is None:
+        cache_dir = config["text_splitting"]["pdf_cache_dir"]
+
+    return os.path.join(
+        cache_dir, f"{file_hash(file_path)}_{get_parser_version()}.json.gz"
+    )
+
+
+def load_pdf_pages(file_path, cache_dir=None):
+    """
+    the pages of the PDF file (list of Document), from the cache if there
+    """
+    from langchain_core.documents import Document
+
+    cache_path = get_cache_path(file_path, cache_dir)
+
+    if os.path.exists(cache_path):
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            pages = json.load(f)
+    else:
+        from langchain_community.document_loaders import PyPDFLoader
+
+        pages = [doc.page_content for doc in PyPDFLoader(file_path=file_path).load()]
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        # written and renamed: a parallel reader never sees half a file
+        tmp_path = cache_path + f".{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(pages, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+
+    # source is the current path, the same content can have another name
+    return [
+        Document(page_content=text, metadata={"source": file_path, "page": page})
+        for page, text in enumerate(pages)
+    ]
+
+
+def load_and_split_pdf(file_path, text_splitter, cache_dir=None):
+    """
+    as PyPDFLoader(file_path).load_and_split(text_splitter), using the cache
+    """
+    return text_splitter.split_documents(load_pdf_pages(file_path, cache_dir))
+
+
+def load_pdf_dir_pages(books_dir, cache_dir=None):
+    """
+    the pages of all the PDF files in books_dir, using the cache
+    """
+    logger = get_console_logger()
+
+    pages = []
+
+    for book in sorted(glob(books_dir + "/*.pdf")):
+        pages += load_pdf_pages(book, cache_dir)
+
+    logger.info("Loaded %s pages from %s...", len(pages), books_dir)
+
+    return pages
@@ -0,0 +1,151 @@
+"""
+Speculative retrieval
+
+On follow-up questions the standalone question is generated by the LLM
+(condense step) and only then the search is done. In speculative mode
+the search with the user question starts at the same time as the
+condense step: if the condensed question is the same (or its embedding
+is very similar) the results of the speculative search are used,
+otherwise they are discarded and the search is done again.
+
+Python Version: 3.11
+"""
+
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import numpy as np
+from langchain_core.output_parsers import StrOutputParser
+
+
+class SpeculationStats:
+    """
+    how often speculation wins and how much time it saves
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_wins = 0
+        self.time_saved = 0.0
+        self.time_wasted = 0.0
+
+    def record(self, win, retrieval_time, condense_time, check_time=0.0):
+        """
+        if win, the retrieval ran in parallel with the condense step
+        otherwise the speculative retrieval was useless
+        check_time: the equivalence check, done after the condense step
+        only because of speculation: it is subtracted from the time saved
+        """
+        with self.lock:
+            self.n_requests += 1
+            self.time_saved -= check_time
+
+            if win:
+                self.n_wins += 1
+                self.time_saved += min(retrieval_time, condense_time)
+            else:
+                self.time_wasted += retrieval_time
+
+    def log_summary(self):
+        """
+        print the stats on the console
+        """
+        logger = logging.getLogger("ConsoleLogger")
+
+        with self.lock:
+            if self.n_requests == 0:
+                return
+
+            logger.info(
+                " Speculative retrieval: %s/%s wins (%s perc.), "
+                "saved %s sec. (net of the checks), wasted retrieval %s sec.",
+                self.n_wins,
+                self.n_requests,
+                round(self.n_wins * 100.0 / self.n_requests, 1),
+                round(self.time_saved, 2),
+                round(self.time_wasted, 2),
+            )
+
+
+class SpeculativeHistoryAwareRetriever:
+    """
+    Replaces create_history_aware_retriever: input and output are the same
+    (a dict with input and chat_history -> list of docs)
+
+    Usage:
+        retriever = SpeculativeHistoryAwareRetriever(
+            llm, base_retriever, embed_model, CONTEXT_Q_PROMPT, threshold=0.95
+        )
+        RunnableLambda(retriever)
+    """
+
+    def __init__(self, llm, retriever, embed_model, prompt, threshold=0.95):
+        self.condense_chain = prompt | llm | StrOutputParser()
+        self.retriever = retriever
+        self.embed_model = embed_model
+        self.threshold = threshold
+
+        self.stats = SpeculationStats()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def _timed(self, func, *args):
+        time_start = time()
+        result = func(*args)
+
+        return result, time() - time_start
+
+    def is_equivalent(self, question, condensed):
+        """
+        same text, or embeddings with cosine similarity above threshold
+        """
+        if condensed.strip().lower() == question.strip().lower():
+            return True
+
+        vectors = np.array(self.embed_model.embed_documents([question, condensed]))
+        cos_sim = np.dot(vectors[0], vectors[1]) / (
+            np.linalg.norm(vectors[0]) * np.linalg.norm(vectors[1])
+        )
+
+        return cos_sim >= self.threshold
+
+    def __call__(self, inputs):
+        question = inputs["input"]
+
+        # first question: no need to condense
+        if not inputs.get("chat_history"):
+            return self.retriever.invoke(question)
+
+        f_docs = self.executor.submit(
+            contextvars.copy_context().run,
+            self._timed,
+            self.retriever.invoke,
+            question,
+        )
+        condensed, condense_time = self._timed(self.condense_chain.invoke, inputs)
+
+        win, check_time = self._timed(self.is_equivalent, question, condensed)
+
+        if win:
+            docs, retrieval_time = f_docs.result()
+            self.stats.record(True, retrieval_time, condense_time, check_time)
+        else:
+
+            def record_discarded(future):
+                # a failed speculative search is not counted
+                if future.exception() is not None:
+                    return
+
+                _, retrieval_time = future.result()
+                self.stats.record(False, retrieval_time, condense_time, check_time)
+
+            # the speculative search is not awaited, only recorded when done
+            f_docs.add_done_callback(record_discarded)
+            docs = self.retriever.invoke(condensed)
+
+        self.stats.log_summary()
+
+        return docs
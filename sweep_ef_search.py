@@ -0,0 +1,140 @@
+"""
+Recall vs latency of the OpenSearch k-NN index for different ef_search
+
+Usage:
+    python sweep_ef_search.py [--ef_search 16 32 64 128 256 512]
+        [--n_queries 100] [--k 8]
+
+    Query vectors are sampled from the index itself.
+    For every query the exact top-k (script_score, brute force) is the
+    ground truth; recall is the fraction of it found by the approximate
+    search done with the given ef_search (method_parameters in the
+    k-NN query, needs OpenSearch >= 2.16).
+
+Python Version: 3.11
+"""
+
+import argparse
+from time import time
+
+import numpy as np
+
+from opensearch_bulk_utils import get_opensearch_client, warmup_index, VECTOR_FIELD
+from factory_vector_store import get_ann_params
+from utils import get_console_logger, load_configuration
+
+config = load_configuration()
+
+
+def sample_query_vectors(client, index_name, n_queries):
+    """
+    take n_queries random vectors from the index
+    """
+    response = client.search(
+        index=index_name,
+        body={
+            "size": n_queries,
+            "_source": [VECTOR_FIELD],
+            "query": {"function_score": {"random_score": {"seed": 42}}},
+        },
+    )
+
+    return [hit["_source"][VECTOR_FIELD] for hit in response["hits"]["hits"]]
+
+
+def exact_search(client, index_name, vector, k):
+    """
+    brute force search, the ground truth
+    """
+    body = {
+        "size": k,
+        "_source": False,
+        "query": {
+            "script_score": {
+                "query": {"match_all": {}},
+                "script": {
+                    "source": "knn_score",
+                    "lang": "knn",
+                    "params": {
+                        "field": VECTOR_FIELD,
+                        "query_value": vector,
+                        "space_type": get_ann_params()["space_type"],
+                    },
+                },
+            }
+        },
+    }
+    response = client.search(index=index_name, body=body)
+
+    return {hit["_id"] for hit in response["hits"]["hits"]}
+
+
+def approx_search(client, index_name, vector, k, ef_search):
+    """
+    k-NN search with ef_search, returns the ids and the latency in ms
+    """
+    body = {
+        "size": k,
+        "_source": False,
+        "query": {
+            "knn": {
+                VECTOR_FIELD: {
+                    "vector": vector,
+                    "k": k,
+                    "method_parameters": {"ef_search": ef_search},
+                }
+            }
+        },
+    }
+
+    time_start = time()
+    response = client.search(index=index_name, body=body)
+    latency = (time() - time_start) * 1000
+
+    return {hit["_id"] for hit in response["hits"]["hits"]}, latency
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Sweep of ef_search.")
+    parser.add_argument(
+        "--ef_search", type=int, nargs="+", default=[16, 32, 64, 128, 256, 512]
+    )
+    parser.add_argument("--n_queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=config["retriever"]["top_k"])
+
+    args = parser.parse_args()
+
+    os_client = get_opensearch_client()
+    index = config["vector_store"]["opensearch"]["index_name"]
+
+    # so that the first values of ef_search don't pay the loading of graphs
+    warmup_index(os_client, index)
+
+    queries = sample_query_vectors(os_client, index, args.n_queries)
+    ground_truth = [exact_search(os_client, index, vec, args.k) for vec in queries]
+
+    logger.info("Index: %s, queries: %s, k: %s", index, len(queries), args.k)
+    logger.info("ef_search  recall  p50 (ms)  p95 (ms)")
+
+    for ef in args.ef_search:
+        recalls = []
+        latencies = []
+
+        for vec, exact_ids in zip(queries, ground_truth):
+            ids, elapsed = approx_search(os_client, index, vec, args.k, ef)
+
+            recalls.append(len(ids & exact_ids) / max(len(exact_ids), 1))
+            latencies.append(elapsed)
+
+        logger.info(
+            "%9s  %6.3f  %8.1f  %8.1f",
+            ef,
+            np.mean(recalls),
+            np.percentile(latencies, 50),
+            np.percentile(latencies, 95),
+        )
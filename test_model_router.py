@@ -0,0 +1,74 @@
+"""
+Tests of the routing of the requests between LLMs (model_router)
+
+Usage:
+    python -m pytest test_model_router.py
+
+The answer chains are fake (they return the model_id): no LLM is called.
+
+Python Version: 3.11
+"""
+
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from model_router import ModelRouter
+from utils import load_configuration
+
+config = load_configuration()
+
+
+def build_fake_answer_chain(model_id):
+    """
+    a chain answering with the model_id used
+    """
+    return RunnableLambda(lambda inputs: model_id)
+
+
+def make_inputs(question="What is Oracle 23ai?", context_chars=100, history=None):
+    """
+    the input of the answer chain
+    """
+    return {
+        "input": question,
+        "chat_history": history or [],
+        "context": [Document(page_content="x" * context_chars)],
+    }
+
+
+def test_call_routes_simple_request_to_small_model():
+    router = ModelRouter(build_fake_answer_chain)
+    inputs = make_inputs()
+
+    answer = router(inputs).invoke(inputs)
+
+    assert answer == config["routing"]["small_model"]
+    assert router.stats.n_requests == {config["routing"]["small_model"]: 1}
+
+
+def test_call_routes_large_context_to_large_model():
+    router = ModelRouter(build_fake_answer_chain)
+    # well above max_context_tokens, whatever chars_per_token is
+    inputs = make_inputs(
+        context_chars=config["routing"]["max_context_tokens"] * 10
+    )
+
+    assert router(inputs).invoke(inputs) == config["routing"]["large_model"]
+
+
+def test_call_uses_answer_model_if_given():
+    router = ModelRouter(build_fake_answer_chain)
+    inputs = {
+        **make_inputs(history=[HumanMessage(content="Hi")]),
+        "answer_model": config["routing"]["large_model"],
+    }
+
+    assert router(inputs).invoke(inputs) == config["routing"]["large_model"]
+
+
+def test_route_and_call_agree():
+    router = ModelRouter(build_fake_answer_chain)
+    inputs = make_inputs(question="x" * (config["routing"]["max_question_chars"] + 1))
+
+    assert router(inputs).invoke(inputs) == router.route(inputs)
@@ -2,97 +2,120 @@
 Streamlit client for simple test on OCI Command R
 """
 
+from contextlib import closing
 from time import time
 from pprint import pprint
 import streamlit as st
 
-from factory_for_citations_demo import do_query_and_answer
-from utils import get_console_logger
-from oci_citations_utils import extract_complete_citations, extract_document_list
+from factory_for_citations_demo import do_query_and_answer, do_query_and_stream
+from utils import get_console_logger, load_configuration
+from oci_citations_utils import (
+    extract_complete_citations,
+    extract_document_list,
+    render_highlights,
+    stream_citations,
+)
+
+config = load_configuration()
 
 # Constant
 USER = "user"
 ASSISTANT = "assistant"
 
 
-def highlight_substrings(text, delimiters, doc_ids_list):
+def show_streamed_answer(v_response, v_documents):
     """
-    Evidenzia le sottostringhe in un testo e aggiunge le liste di doc_id tra parentesi quadre.
-
-    Args:
-    - text (str): il testo originale.
-    - delimiters (list of tuples): ogni tupla contiene (start, end).
-    - doc_ids_list (list of lists): lista delle liste di doc_id associati ai delimitatori.
+    show the answer while it is generated, with the highlights of the
+    citations in the last render
 
-    Returns:
-    - str: il testo con le sottostringhe evidenziate e le liste di doc_id aggiunte.
+    the text is rendered at most every render_interval_sec, or when
+    render_min_chars new chars are available (as in the chat app)
     """
-    combined = list(zip(delimiters, doc_ids_list))
-    combined.sort(key=lambda x: x[0][0], reverse=True)
+    render_interval = config["ui"]["render_interval_sec"]
+    render_min_chars = config["ui"]["render_min_chars"]
+
+    text_placeholder = st.empty()
+
+    answer_so_far = ""
+    citations_so_far = []
+    # chars not yet rendered
+    n_pending = 0
+    last_render = 0.0
+
+    # if the user leaves the page or pushes a button, streamlit stops the
+    # script here: closing the stream, the generation is cancelled
+    with closing(stream_citations(v_response, v_documents)) as items:
+        for item in items:
+            if "citations" in item:
+                citations_so_far.extend(item["citations"])
+
+            if "text" in item:
+                answer_so_far += item["text"]
+                n_pending += len(item["text"])
 
-    for (start, end), doc_ids in combined:
-        original_substring = text[start:end]
-        highlighted_substring = (
-            f'<span style="background-color: green;">{original_substring}</span>'
-        )
-        doc_id_str = f' [{", ".join(doc_ids)}]'
-        text = text[:start] + highlighted_substring + doc_id_str + text[end:]
+                now = time()
+                if (
+                    now - last_render >= render_interval
+                    or n_pending >= render_min_chars
+                ):
+                    text_placeholder.markdown(answer_so_far)
 
-    return text
+                    last_render = now
+                    n_pending = 0
+
+    # the whole answer, with highlights, only once
+    text_placeholder.markdown(
+        render_highlights(answer_so_far, citations_so_far), unsafe_allow_html=True
+    )
+
+    return citations_so_far
 
 
 st.title("Oracle AI Assistant")
 st.text_input("Ask a question:", key="question")
+st.checkbox("Streaming", key="streaming")
 
 logger = get_console_logger()
 
-# this is a list of tuples (start, end)
-span_demarks = []
-# this is a list of list [[1,2], [1,3]]
-doc_ids = []
-
 if st.button("Answer"):
     question = st.session_state.question
 
-    with st.spinner("Invoking Command-R..."):
-        time_start = time()
-
-        # here we call the LLM
-        response = do_query_and_answer(question)
-
-        time_elapsed = time() - time_start
-        logger.info("Total elapsed time: %s sec.", round(time_elapsed, 1))
-        logger.info("")
+    time_start = time()
 
-    answer = response.data.chat_response.text
+    if st.session_state.streaming:
+        # here we call the LLM, the answer is shown while generated
+        response, documents = do_query_and_stream(question)
 
-    # handle citations
-    citations = extract_complete_citations(response)
+        # a click reruns the script: the stream is closed (see above)
+        st.button("Stop")
 
-    for citation in citations:
-        span_demarks.append(citation["interval"])
+        citations = show_streamed_answer(response, documents)
+    else:
+        with st.spinner("Invoking Command-R..."):
+            # here we call the LLM
+            response = do_query_and_answer(question)
 
-        docs_for_this_citation = []
-        for doc in citation["documents"]:
-            docs_for_this_citation.append(doc["id"])
-        doc_ids.append(docs_for_this_citation)
+        answer = response.data.chat_response.text
 
-        assert len(doc_ids) == len(span_demarks)
+        # handle citations
+        citations = extract_complete_citations(response)
 
-    # insert citation
-    highlighted_text = highlight_substrings(answer, span_demarks, doc_ids)
+        # insert citation
+        highlighted_text = render_highlights(answer, citations)
 
-    # logger.info(answer)
+        st.markdown(highlighted_text, unsafe_allow_html=True)
 
-    st.markdown(highlighted_text, unsafe_allow_html=True)
+        # show document for citations
+        documents = extract_document_list(response)
 
-    # show document for citations
-    extracted_doc = extract_document_list(response)
+    time_elapsed = time() - time_start
+    logger.info("Total elapsed time: %s sec.", round(time_elapsed, 1))
+    logger.info("")
 
     st.markdown("")
     st.markdown("Document list:")
 
-    for doc in extracted_doc:
+    for doc in documents:
         st.markdown(f"[{doc['id']}]: {doc['source']}, pag: {doc['page']}")
 
     pprint(citations)
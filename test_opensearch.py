@@ -13,10 +13,9 @@ Python Version: 3.11
 from glob import glob
 from tqdm.auto import tqdm
 
-from langchain_community.document_loaders import PyPDFLoader
-
 from factory import get_embed_model, get_vector_store
 from chunk_index_utils import get_recursive_text_splitter
+from pdf_text_cache import load_and_split_pdf
 from utils import get_console_logger, load_configuration
 
 
@@ -40,9 +39,7 @@ books_list = glob(books_dir + "/*.pdf")
 docs = []
 
 for book in tqdm(books_list):
-    loader = PyPDFLoader(file_path=book)
-
-    docs += loader.load_and_split(text_splitter=text_splitter)
+    docs += load_and_split_pdf(book, text_splitter)
 
 logger.info("Loaded %s chunks...", len(docs))
 
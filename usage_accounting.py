@@ -0,0 +1,270 @@
+"""
+Usage accounting: tokens, embedded documents and rerank calls
+
+Every call to the models is recorded, in memory, for the current
+session and request (set with usage_scope). Counters are flushed
+periodically, as JSON lines, to the file in [usage] (config.toml):
+one line for every request and one for every session active since the
+previous flush. Lines have the counters since the previous flush (then
+they are dropped from memory): the totals are the sum of the lines.
+
+When the service doesn't return the num. of tokens, it is estimated
+(with chars_per_token in [context_packing]).
+
+Usage:
+    with usage_scope(session_id, request_id):
+        rag_chain.invoke(...)
+
+    record_usage("chat", model_id, input_tokens=..., output_tokens=...)
+
+Python Version: 3.11
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+
+from utils import estimate_tokens, load_configuration
+
+config = load_configuration()
+
+# kinds of calls
+CHAT = "chat"
+EMBED = "embed"
+RERANK = "rerank"
+
+# the scope of the calls, not set: they are counted as "unscoped"
+_session_id = contextvars.ContextVar("usage_session_id", default="unscoped")
+_request_id = contextvars.ContextVar("usage_request_id", default=None)
+
+
+@contextmanager
+def usage_scope(session_id, request_id=None):
+    """
+    the calls done inside are counted for session_id and request_id
+    """
+    session_token = _session_id.set(str(session_id))
+    request_token = _request_id.set(request_id)
+
+    try:
+        yield
+    finally:
+        _request_id.reset(request_token)
+        _session_id.reset(session_token)
+
+
+def estimate_usage_tokens(text):
+    """
+    tokens of text, for the calls where the service doesn't return them
+    """
+    return estimate_tokens(text, config["context_packing"]["chars_per_token"])
+
+
+def new_counters():
+    """
+    the counters for a request or a session
+    """
+    return {
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "embedded_docs": 0,
+        "embed_tokens": 0,
+        "rerank_calls": 0,
+        "reranked_docs": 0,
+        "chat_calls": 0,
+        "by_model": {},
+    }
+
+
+def update_counters(counters, kind, model_id, input_tokens, output_tokens, n_docs):
+    """
+    add a call to counters
+    """
+    if kind == CHAT:
+        counters["chat_calls"] += 1
+        counters["input_tokens"] += input_tokens
+        counters["output_tokens"] += output_tokens
+    elif kind == EMBED:
+        counters["embedded_docs"] += n_docs
+        counters["embed_tokens"] += input_tokens
+    else:
+        counters["rerank_calls"] += 1
+        counters["reranked_docs"] += n_docs
+
+    by_model = counters["by_model"].setdefault(model_id, [0, 0])
+    by_model[0] += input_tokens
+    by_model[1] += output_tokens
+
+
+class UsageAccountant:
+    """
+    in-memory counters per request and per session, flushed to a file
+    """
+
+    def __init__(self, usage_file, flush_interval):
+        self.usage_file = usage_file
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+        # (session_id, request_id) -> counters, since the last flush
+        self.requests = {}
+        # session_id -> counters, since the last flush
+        self.sessions = {}
+        self.last_flush = time()
+
+    def record(self, kind, model_id, input_tokens=0, output_tokens=0, n_docs=0):
+        """
+        record a call in the current scope
+        """
+        session_id = _session_id.get()
+        request_key = (session_id, _request_id.get())
+
+        with self.lock:
+            for counters in (
+                self.requests.setdefault(request_key, new_counters()),
+                self.sessions.setdefault(session_id, new_counters()),
+            ):
+                update_counters(
+                    counters, kind, model_id, input_tokens, output_tokens, n_docs
+                )
+
+            to_flush = time() - self.last_flush >= self.flush_interval
+
+        if to_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        append the requests and sessions since the last flush to the file
+        """
+        with self.lock:
+            requests = self.requests
+            sessions = self.sessions
+            # flushed counters are dropped: memory doesn't grow with sessions
+            self.requests = {}
+            self.sessions = {}
+            self.last_flush = time()
+
+            timestamp = datetime.now().isoformat(timespec="seconds")
+            lines = [
+                json.dumps(
+                    {
+                        "time": timestamp,
+                        "type": "request",
+                        "session_id": session_id,
+                        "request_id": request_id,
+                        **counters,
+                    }
+                )
+                for (session_id, request_id), counters in requests.items()
+            ]
+            lines += [
+                json.dumps(
+                    {
+                        "time": timestamp,
+                        "type": "session",
+                        "session_id": session_id,
+                        **counters,
+                    }
+                )
+                for session_id, counters in sessions.items()
+            ]
+
+        if not lines:
+            return
+
+        try:
+            with open(self.usage_file, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logging.getLogger("ConsoleLogger").error("Error writing usage: %s", e)
+
+
+_accountant = None
+_accountant_lock = threading.Lock()
+
+
+def get_usage_accountant():
+    """
+    the accountant shared by all the modules, None if disabled
+    """
+    global _accountant
+
+    if not config["usage"]["enable"]:
+        return None
+
+    with _accountant_lock:
+        if _accountant is None:
+            _accountant = UsageAccountant(
+                config["usage"]["usage_file"], config["usage"]["flush_interval_sec"]
+            )
+            # what is not yet flushed is written at exit
+            atexit.register(_accountant.flush)
+
+    return _accountant
+
+
+def record_usage(kind, model_id, input_tokens=0, output_tokens=0, n_docs=0):
+    """
+    record a call, if usage accounting is enabled
+    """
+    accountant = get_usage_accountant()
+
+    if accountant is not None:
+        accountant.record(kind, model_id, input_tokens, output_tokens, n_docs)
+
+
+def get_usage_callback(model_id):
+    """
+    a LangChain callback handler recording the calls of a chat model
+    """
+    # imported here, to keep this module light
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallbackHandler(BaseCallbackHandler):
+        """
+        records input and output tokens of every call of the chat model
+        """
+
+        def __init__(self):
+            self.input_tokens = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            text = "".join(str(msg.content) for batch in messages for msg in batch)
+            self.input_tokens[run_id] = estimate_usage_tokens(text)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            input_tokens = self.input_tokens.pop(run_id, 0)
+
+            text = "".join(gen.text for gens in response.generations for gen in gens)
+            output_tokens = estimate_usage_tokens(text)
+
+            # the real values, if returned by the service
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = token_usage.get("prompt_tokens", input_tokens)
+            output_tokens = token_usage.get("completion_tokens", output_tokens)
+
+            record_usage(CHAT, model_id, input_tokens, output_tokens)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self.input_tokens.pop(run_id, None)
+
+    return UsageCallbackHandler()
+
+
+def get_oci_usage(chat_response):
+    """
+    (prompt_tokens, completion_tokens) from the response of the OCI client,
+    None if not returned by the service (depends on model and SDK version)
+    """
+    usage = getattr(chat_response, "usage", None)
+
+    if usage is None or usage.prompt_tokens is None:
+        return None
+
+    return usage.prompt_tokens, usage.completion_tokens or 0
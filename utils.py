@@ -7,10 +7,15 @@ Python Version: 3.11
 
 import logging
 import os
-import toml
+from pathlib import Path
 
+from config_registry import get_registry, LiveConfig, CONFIG_SCHEMA
 from config_private import LANGSMITH_API_KEY
 
+# next to this file: the working directory of the app doesn't matter
+CONFIG_FILE = str(Path(__file__).parent / "config.toml")
+PREAMBLE_FILE = str(Path(__file__).parent / "preamble_library.toml")
+
 
 def remove_path_from_ref(ref_pathname):
     """
@@ -27,10 +32,10 @@ def remove_path_from_ref(ref_pathname):
 def load_configuration():
     """
     read the configuration from config.toml
+    the file is parsed once and shared, changes are reloaded
+    (see config_registry)
     """
-    config = toml.load("config.toml")
-
-    return config
+    return LiveConfig(get_registry(CONFIG_FILE, CONFIG_SCHEMA))
 
 
 def enable_tracing(config):
@@ -64,6 +69,14 @@ def get_console_logger():
     return logger
 
 
+def estimate_tokens(text, chars_per_token=4.0):
+    """
+    cheap estimate of the num. of tokens in text
+    (no tokenizer call, good enough to stay within a budget)
+    """
+    return int(len(text) / chars_per_token) + 1
+
+
 def format_docs(docs):
     """
     format docs for LCEL
@@ -138,13 +151,13 @@ def answer(chain, question):
 
 def read_preamble(
     preamble_id: str,
-    file_name="preamble_library.toml",
+    file_name=PREAMBLE_FILE,
 ):
     """
     read a preamble
     preamble_id: the name of the preamble in the file
+    (the file is parsed once, changes are reloaded)
     """
-    with open(file_name, "r") as file:
-        preambles = toml.load(file)
+    preambles = get_registry(file_name).get()
 
     return preambles["cohere_preambles"][preamble_id]
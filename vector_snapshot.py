@@ -0,0 +1,354 @@
+"""
+Snapshot of a Vector Store in Parquet, to move it without re-embedding
+
+Usage:
+    python vector_snapshot.py export --store 23AI|OPENSEARCH --file snap.parquet
+        [--name MY_BOOKS]
+    python vector_snapshot.py import --store 23AI|OPENSEARCH --file snap.parquet
+        [--name NEW_COLLECTION]
+
+    --name is the table (23AI) or the index (OPENSEARCH),
+    if not given the one in config.
+
+    The snapshot has a row for every chunk: id, text, metadata (JSON)
+    and vector (fixed size list of float32). Rows are read and written in
+    batches (row groups), so the whole collection is never in memory.
+    The embeddings model is saved in the file metadata: the vectors
+    can be used only with the same model.
+
+Python Version: 3.11
+"""
+
+import argparse
+import json
+import re
+from time import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from factory_vector_store import get_collection_name, get_oracle_connection
+from utils import check_value_in_list, get_console_logger, load_configuration
+
+config = load_configuration()
+
+# rows per batch (row group of the Parquet file)
+BATCH_SIZE = 5000
+
+# keys in the metadata of the Parquet file
+EMBED_MODEL_KEY = b"embed_model"
+DIMENSION_KEY = b"dimension"
+
+# ids of 23AI rows, as exported (hex of RAW(16))
+ROW_ID = re.compile(r"(?:[0-9A-F]{2}){1,16}")
+
+
+def get_snapshot_schema(dimension):
+    """
+    the schema of the snapshot, with the embeddings model in metadata
+    """
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("text", pa.string()),
+            ("metadata", pa.string()),
+            ("vector", pa.list_(pa.float32(), dimension)),
+        ],
+        metadata={
+            EMBED_MODEL_KEY: config["embeddings"]["oci"]["embed_model"].encode(),
+            DIMENSION_KEY: str(dimension).encode(),
+        },
+    )
+
+
+def to_record_batch(ids, texts, metadatas, vectors):
+    """
+    a batch of rows as Arrow, vectors is a float32 matrix (n, dimension)
+    """
+    n_rows, dimension = vectors.shape
+
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(ids, type=pa.string()),
+            pa.array(texts, type=pa.string()),
+            pa.array(metadatas, type=pa.string()),
+            pa.FixedSizeListArray.from_arrays(
+                pa.array(vectors.reshape(n_rows * dimension), type=pa.float32()),
+                dimension,
+            ),
+        ],
+        schema=get_snapshot_schema(dimension),
+    )
+
+
+def vectors_to_numpy(batch):
+    """
+    the vector column of a record batch as a float32 matrix (no copy)
+    """
+    column = batch.column("vector")
+
+    return column.flatten().to_numpy().reshape(len(batch), column.type.list_size)
+
+
+#
+# export
+#
+def iter_oracle_batches(table_name):
+    """
+    yield the rows of the 23AI table, in batches
+    """
+    connection = get_oracle_connection()
+
+    with connection.cursor() as cursor:
+        cursor.arraysize = BATCH_SIZE
+        cursor.prefetchrows = BATCH_SIZE + 1
+        # texts (CLOB) as str, with a single round-trip per batch
+        # (only for this query, not for the other users of oracledb)
+        cursor.execute(
+            f"SELECT id, text, metadata, embedding FROM {table_name}",
+            fetch_lobs=False,
+        )
+
+        while rows := cursor.fetchmany():
+            yield (
+                [row[0].hex().upper() for row in rows],
+                [row[1] for row in rows],
+                [
+                    row[2] if isinstance(row[2], str) else json.dumps(row[2])
+                    for row in rows
+                ],
+                # from the buffers of the arrays, not value by value
+                np.vstack(
+                    [np.frombuffer(row[3], dtype=row[3].typecode) for row in rows]
+                ).astype(np.float32, copy=False),
+            )
+
+
+def iter_opensearch_batches(index_name):
+    """
+    yield the docs of the OpenSearch index, in batches
+    """
+    from opensearchpy import helpers
+
+    from opensearch_bulk_utils import TEXT_FIELD, VECTOR_FIELD, get_opensearch_client
+
+    hits = helpers.scan(
+        get_opensearch_client(),
+        index=index_name,
+        query={"query": {"match_all": {}}},
+        size=BATCH_SIZE,
+        _source=[TEXT_FIELD, VECTOR_FIELD, "metadata"],
+    )
+
+    batch = []
+    for hit in hits:
+        batch.append(hit)
+
+        if len(batch) == BATCH_SIZE:
+            yield opensearch_hits_to_columns(batch)
+            batch = []
+
+    if batch:
+        yield opensearch_hits_to_columns(batch)
+
+
+def opensearch_hits_to_columns(hits):
+    """
+    from a list of hits to (ids, texts, metadatas, vectors)
+    """
+    from opensearch_bulk_utils import TEXT_FIELD, VECTOR_FIELD
+
+    return (
+        [hit["_id"] for hit in hits],
+        [hit["_source"][TEXT_FIELD] for hit in hits],
+        [json.dumps(hit["_source"].get("metadata", {})) for hit in hits],
+        np.array([hit["_source"][VECTOR_FIELD] for hit in hits], dtype=np.float32),
+    )
+
+
+def export_snapshot(store_type, name, file_name):
+    """
+    write all the chunks of the Vector Store in the snapshot
+    returns the num. of rows
+    """
+    if store_type == "23AI":
+        batches = iter_oracle_batches(name)
+    else:
+        batches = iter_opensearch_batches(name)
+
+    writer = None
+    n_rows = 0
+
+    try:
+        for ids, texts, metadatas, vectors in batches:
+            record_batch = to_record_batch(ids, texts, metadatas, vectors)
+
+            if writer is None:
+                writer = pq.ParquetWriter(file_name, record_batch.schema)
+
+            writer.write_batch(record_batch)
+            n_rows += len(ids)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    # an empty store: a file without rows (dimension 0), that can be imported
+    if writer is None:
+        pq.write_table(get_snapshot_schema(0).empty_table(), file_name)
+
+    return n_rows
+
+
+#
+# import
+#
+def import_to_23ai(parquet_file, table_name, dimension):
+    """
+    insert the rows of the snapshot in the table (created if needed)
+    with the same ids
+    """
+    from oracle_bulk_writer import OracleBulkWriter, to_row_id
+    from oracle_vector_index import ensure_vector_index
+
+    connection = get_oracle_connection()
+
+    writer = OracleBulkWriter(connection, table_name)
+    writer.create_table(dimension)
+
+    n_rows = 0
+    for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE):
+        # ids of exported rows are kept, not hashed again
+        # (ids from OpenSearch are hashed, as OracleVS does)
+        ids = [
+            key if ROW_ID.fullmatch(key) else to_row_id(key)
+            for key in batch.column("id").to_pylist()
+        ]
+
+        writer.write(
+            batch.column("text").to_pylist(),
+            [json.loads(m) for m in batch.column("metadata").to_pylist()],
+            vectors_to_numpy(batch),
+            ids=ids,
+            hash_ids=False,
+        )
+        n_rows += len(batch)
+
+    if config["vector_store"]["23ai"]["create_index"]:
+        ensure_vector_index(connection, table_name)
+
+    return n_rows
+
+
+def import_to_opensearch(parquet_file, index_name, dimension):
+    """
+    index the rows of the snapshot (index created if needed) with bulk requests
+    """
+    from opensearch_bulk_utils import (
+        TEXT_FIELD,
+        VECTOR_FIELD,
+        get_index_body,
+        get_opensearch_client,
+        run_bulk_load,
+    )
+
+    client = get_opensearch_client()
+
+    if not client.indices.exists(index=index_name):
+        client.indices.create(index=index_name, body=get_index_body(dimension))
+
+    def generate_actions():
+        for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE):
+            vectors = vectors_to_numpy(batch)
+            rows = zip(
+                batch.column("id").to_pylist(),
+                batch.column("text").to_pylist(),
+                batch.column("metadata").to_pylist(),
+                vectors,
+            )
+
+            for doc_id, text, metadata, vector in rows:
+                yield {
+                    "_op_type": "index",
+                    "_index": index_name,
+                    "_id": doc_id,
+                    VECTOR_FIELD: vector.tolist(),
+                    TEXT_FIELD: text,
+                    "metadata": json.loads(metadata),
+                }
+
+    n_ok, _ = run_bulk_load(client, index_name, generate_actions())
+
+    return n_ok
+
+
+def import_snapshot(store_type, name, file_name):
+    """
+    load the snapshot in the Vector Store, returns the num. of rows
+    """
+    logger = get_console_logger()
+
+    parquet_file = pq.ParquetFile(file_name)
+    file_metadata = parquet_file.schema_arrow.metadata
+
+    snapshot_model = file_metadata[EMBED_MODEL_KEY].decode()
+    if snapshot_model != config["embeddings"]["oci"]["embed_model"]:
+        logger.warning(
+            "Snapshot vectors computed with %s, configured model is %s",
+            snapshot_model,
+            config["embeddings"]["oci"]["embed_model"],
+        )
+
+    dimension = int(file_metadata[DIMENSION_KEY])
+
+    if parquet_file.metadata.num_rows == 0:
+        logger.warning("The snapshot %s has no rows, nothing to import", file_name)
+        return 0
+
+    if store_type == "23AI":
+        return import_to_23ai(parquet_file, name, dimension)
+
+    return import_to_opensearch(parquet_file, name, dimension)
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    logger = get_console_logger()
+
+    parser = argparse.ArgumentParser(description="Export/import Vector Stores.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument(
+        "--store", type=str, default=config["vector_store"]["store_type"]
+    )
+    parser.add_argument("--file", type=str, required=True, help="Parquet file")
+    parser.add_argument("--name", type=str, help="Table or index name")
+
+    args = parser.parse_args()
+
+    check_value_in_list(args.store, ["OPENSEARCH", "23AI"])
+
+    collection = args.name
+    if collection is None:
+        if args.store == "23AI":
+            collection = get_collection_name()
+        else:
+            collection = config["vector_store"]["opensearch"]["index_name"]
+
+    time_start = time()
+
+    if args.command == "export":
+        n_total = export_snapshot(args.store, collection, args.file)
+    else:
+        n_total = import_snapshot(args.store, collection, args.file)
+
+    elapsed = time() - time_start
+
+    logger.info(
+        "%s: %s rows in %s sec. (%s rows/s)",
+        args.command,
+        n_total,
+        round(elapsed, 1),
+        round(n_total / max(elapsed, 1e-6)),
+    )